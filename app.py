@@ -1,5 +1,6 @@
 # Import necessary libraries
-from flask import Flask, render_template, request, session, jsonify, Response, redirect
+from flask import Flask, render_template, request, session, jsonify, Response, redirect, stream_with_context, g
+import asyncio
 import subprocess
 import platform
 import os
@@ -13,16 +14,66 @@ import shutil
 import uuid
 import datetime
 import json
+import queue
+import signal
+import csv
+import codecs
+import itertools
 import ipaddress
-import dns.resolver
+import math
+import statistics
+import struct
+import bisect
+import functools
+import importlib
+import inspect
+import weakref
+from urllib.parse import parse_qs
+from array import array
+import threading
+import atexit
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, fields
+from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
 
+class LazyModule:
+    """
+    Stands in for a package whose submodules are imported on first attribute access, so that
+    importing app.py (for a health check or a CLI command that never sends a DNS query) does not
+    pay for loading them. Unlike importlib.util.LazyLoader, the first access is safe from
+    several threads at once.
+    """
+
+    def __init__(self, name, submodules):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    for submodule in self._submodules:
+                        importlib.import_module(f"{self._name}.{submodule}")
+                    self._module = sys.modules[self._name]
+                module = self._module
+        return getattr(module, attr)
+
+# dnspython is the largest import after Flask; it is loaded by the first DNS lookup
+dns = LazyModule('dns', ('asyncquery', 'asyncresolver', 'exception', 'flags', 'message', 'opcode', 'rcode',
+                         'rdataclass', 'rdatatype', 'resolver', 'version'))
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Initialize the Flask application
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.secret_key = os.getenv('SECRET_KEY') or os.urandom(24)  # Set SECRET_KEY to keep sessions valid across restarts
 logging.basicConfig(level=logging.INFO)
 
 # ============================================================================
@@ -37,6 +88,8 @@ ENABLE_CANONICAL_REDIRECT = os.getenv('ENABLE_CANONICAL_REDIRECT', 'false').lowe
 # DNS Status Monitoring
 STATUS_CHECK_HOST = os.getenv('STATUS_CHECK_HOST', '8.8.8.8')
 STATUS_CHECK_INTERVAL = int(os.getenv('STATUS_CHECK_INTERVAL', '300'))  # Default: 5 minutes
+STATUS_CHECK_DNS_SERVERS = os.getenv('STATUS_CHECK_DNS_SERVERS', 'false').lower() in ('true', '1', 'yes')  # Also monitor DNS_SERVERS
+STATUS_HISTORY_SIZE = int(os.getenv('STATUS_HISTORY_SIZE', '288'))  # Probe results kept per host (288 = 1 day at 5 minutes)
 
 # Custom DNS Servers (comma-separated)
 CUSTOM_DNS_SERVERS_STR = os.getenv('CUSTOM_DNS_SERVERS', '8.8.8.8,1.1.1.1,8.8.4.4,1.0.0.1')
@@ -48,59 +101,293 @@ DEFAULT_DOMAIN = os.getenv('DEFAULT_DOMAIN', '')
 # Flask Environment
 FLASK_ENV = os.getenv('FLASK_ENV', 'production')
 
+# Production server: 'wsgi' (Waitress) or 'asgi' (uvicorn, async /api/* routes)
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))  # Waitress processes sharing the listen socket (1 = single process)
+WEB_THREADS = int(os.getenv('WEB_THREADS', '25'))  # Request threads per Waitress process
+WEB_GRACEFUL_TIMEOUT = float(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))  # Seconds a stopping worker gets to finish in-flight requests
+WEB_WORKER_FD = os.getenv('NETDIAG_WORKER_FD')  # Set by the supervisor in the worker processes it starts
+
+# Bulk NSLookup Concurrency
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '16'))  # Parallel targets per bulk run
+BULK_RATE_LIMIT_PER_SERVER = float(os.getenv('BULK_RATE_LIMIT_PER_SERVER', '50'))  # DNS queries/sec per DNS server, 0 = unlimited
+BULK_JOB_WORKERS = int(os.getenv('BULK_JOB_WORKERS', '2'))  # Bulk jobs processed at the same time
+BULK_JOB_RETENTION_HOURS = float(os.getenv('BULK_JOB_RETENTION_HOURS', '24'))  # Finished jobs are deleted after this
+BULK_DEDUP_MAX_ENTRIES = int(os.getenv('BULK_DEDUP_MAX_ENTRIES', '100000'))  # Names/addresses remembered per bulk run, 0 = no deduplication
+
+# DNS Answer Cache
+DNS_CACHE_MAX_ENTRIES = int(os.getenv('DNS_CACHE_MAX_ENTRIES', '10000'))  # 0 disables the cache
+DNS_CACHE_MAX_TTL = int(os.getenv('DNS_CACHE_MAX_TTL', '3600'))  # Upper bound on how long any answer is kept (seconds)
+
+# Batch API
+BATCH_MAX_JOBS = int(os.getenv('BATCH_MAX_JOBS', '1000'))  # Jobs accepted per /api/batch request
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '50'))  # Jobs run in parallel per batch
+
+# API Response Cache (identical tool requests answered from memory for a short freshness window)
+API_CACHE_ENABLED = os.getenv('API_CACHE_ENABLED', 'false').lower() in ('true', '1', 'yes')
+API_CACHE_TTL = float(os.getenv('API_CACHE_TTL', '5'))  # Seconds an nslookup, dig, compare or netconnection response stays fresh
+API_CACHE_TOOL_TTLS = {  # Per-tool overrides, e.g. "nslookup=30,ping=2"; 0 disables caching for that tool
+    tool.strip(): float(ttl) for tool, _, ttl in (item.partition('=') for item in os.getenv('API_CACHE_TOOL_TTLS', '').split(','))
+    if tool.strip()
+}
+API_CACHE_MAX_ENTRIES = int(os.getenv('API_CACHE_MAX_ENTRIES', '1000'))
+
+# Ping Engine: 'auto' (ICMP socket, falling back to TCP connect), 'icmp', 'tcp' or 'system' (ping binary)
+PING_ENGINE = os.getenv('PING_ENGINE', 'auto').lower()
+PING_TIMEOUT = float(os.getenv('PING_TIMEOUT', '2.0'))  # Seconds to wait for each echo reply
+PING_INTERVAL = float(os.getenv('PING_INTERVAL', '0.2'))  # Seconds between echo requests to the same host
+PING_TCP_PORTS = [int(p) for p in os.getenv('PING_TCP_PORTS', '443,80').split(',') if p.strip()]  # Ports used by TCP ping
+
+# TCP Port Scanning
+SCAN_DEFAULT_TIMEOUT = float(os.getenv('SCAN_DEFAULT_TIMEOUT', '1.0'))  # Seconds per connect attempt
+SCAN_DEFAULT_RETRIES = int(os.getenv('SCAN_DEFAULT_RETRIES', '1'))  # Extra attempts for ports that time out
+SCAN_DEFAULT_PARALLELISM = int(os.getenv('SCAN_DEFAULT_PARALLELISM', '256'))  # Connects in flight per scan
+SCAN_MAX_PARALLELISM = int(os.getenv('SCAN_MAX_PARALLELISM', '1024'))
+SCAN_MAX_PROBES = int(os.getenv('SCAN_MAX_PROBES', '65536'))  # Upper bound on hosts x ports per scan
+SCAN_MAX_TIMEOUT = 10.0
+SCAN_MAX_RETRIES = 5
+
+# Subnet Sweeps (PTR lookup and optional liveness probe for every address of CIDR blocks)
+SWEEP_MAX_ADDRESSES = int(os.getenv('SWEEP_MAX_ADDRESSES', '65536'))  # Addresses accepted per sweep (65536 = a /16)
+SWEEP_CONCURRENCY = int(os.getenv('SWEEP_CONCURRENCY', '256'))  # Addresses in flight per sweep
+SWEEP_TIMEOUT = float(os.getenv('SWEEP_TIMEOUT', '1.0'))  # Seconds to wait for each liveness probe
+SWEEP_MAX_PORTS = 16  # TCP liveness ports probed at once per address
+
+# Dig Engine
+DIG_TIMEOUT = float(os.getenv('DIG_TIMEOUT', '5.0'))  # Seconds to wait for each DNS response
+DIG_DEFAULT_BUFSIZE = int(os.getenv('DIG_DEFAULT_BUFSIZE', '1232'))  # EDNS UDP buffer size advertised by default
+DIG_TRACE_MAX_STEPS = 16  # Referrals followed by +trace before giving up
+NAMESERVER_ADDRESS_TTL = int(os.getenv('NAMESERVER_ADDRESS_TTL', '300'))  # Seconds a DNS server hostname's address is reused
+RESOLVER_REGISTRY_MAX_ENTRIES = int(os.getenv('RESOLVER_REGISTRY_MAX_ENTRIES', '256'))  # Shared resolvers (and server addresses) kept
+COMPARE_MAX_SERVERS = int(os.getenv('COMPARE_MAX_SERVERS', '50'))  # Resolvers accepted per comparison
+
+# Traceroute Engine: 'auto' (in-process UDP prober, falling back to the binary), 'udp' or 'system' (traceroute/tracert)
+TRACEROUTE_ENGINE = os.getenv('TRACEROUTE_ENGINE', 'auto').lower()
+TRACEROUTE_MAX_HOPS = int(os.getenv('TRACEROUTE_MAX_HOPS', '30'))
+TRACEROUTE_PROBES = int(os.getenv('TRACEROUTE_PROBES', '3'))  # Probes sent to each hop
+TRACEROUTE_TIMEOUT = float(os.getenv('TRACEROUTE_TIMEOUT', '3.0'))  # Seconds to wait for each probe; all hops are probed at once
+TRACEROUTE_PROBE_INTERVAL = float(os.getenv('TRACEROUTE_PROBE_INTERVAL', '0.25'))  # Seconds between probe rounds, spaced to stay under router ICMP rate limits
+
+# API Usage Log (written in batches by a background thread)
+API_LOG_QUEUE_SIZE = int(os.getenv('API_LOG_QUEUE_SIZE', '10000'))  # Entries buffered before the overflow policy applies
+API_LOG_BATCH_SIZE = int(os.getenv('API_LOG_BATCH_SIZE', '500'))  # Entries written per batch
+API_LOG_FLUSH_INTERVAL = float(os.getenv('API_LOG_FLUSH_INTERVAL', '1.0'))  # Seconds a partial batch waits before it is written
+API_LOG_OVERFLOW = os.getenv('API_LOG_OVERFLOW', 'drop').lower()  # 'drop' new entries or 'block' the request until there is room
+API_LOG_BLOCK_TIMEOUT = 1.0  # With 'block', seconds a request waits before its entry is dropped anyway
+
+# Metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('true', '1', 'yes')  # Serve Prometheus metrics at /metrics
+METRICS_PUSH_INTERVAL = float(os.getenv('METRICS_PUSH_INTERVAL', '5'))  # Seconds between metric pushes from worker processes
+
+# Path Monitors (continuous MTR-style traceroutes, kept in memory)
+PATH_MONITOR_TARGETS = [t.strip() for t in os.getenv('PATH_MONITOR_TARGETS', '').split(',') if t.strip()]  # Monitored from startup
+PATH_MONITOR_INTERVAL = float(os.getenv('PATH_MONITOR_INTERVAL', '60'))  # Default seconds between rounds per target
+PATH_MONITOR_MIN_INTERVAL = 5.0
+PATH_MONITOR_MAX_INTERVAL = 86400.0
+PATH_MONITOR_HISTORY_SIZE = int(os.getenv('PATH_MONITOR_HISTORY_SIZE', '360'))  # Rounds kept per target (360 = 6 hours at 60s)
+PATH_MONITOR_MAX_TARGETS = int(os.getenv('PATH_MONITOR_MAX_TARGETS', '500'))
+PATH_MONITOR_CONCURRENCY = int(os.getenv('PATH_MONITOR_CONCURRENCY', '32'))  # Rounds in flight at once across all targets
+
 # ============================================================================
 
-# Define base directories for storing results and logs
+# Define base directories for storing results and logs (created on first write, not at import)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 BULK_RESULTS_DIR = os.path.join(BASE_DIR, 'bulk_results')
-os.makedirs(BULK_RESULTS_DIR, exist_ok=True)
+BULK_JOBS_DIR = os.path.join(BULK_RESULTS_DIR, 'jobs')
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
-os.makedirs(LOGS_DIR, exist_ok=True)
 
 @app.before_request
 def enforce_canonical_host_and_log():
-    """Before each request, enforce a canonical hostname and log API-like usage."""
+    """Before each request, enforce a canonical hostname and note the start time for the API usage log."""
     try:
+        g.request_started = time.perf_counter()
         host = request.host or ''
         path = request.path or ''
-        remote = request.remote_addr or request.environ.get('REMOTE_ADDR')
-        ua = request.headers.get('User-Agent', '')
 
         if ENABLE_CANONICAL_REDIRECT and request.method == 'GET' and path == '/' and host.lower() != CANONICAL_HOST.lower():
             protocol = 'https' if request.is_secure else 'http'
             canonical = f"{protocol}://{CANONICAL_HOST}{request.full_path if request.query_string else '/'}"
             return ('', 302, {'Location': canonical})
-        
-        looks_like_api = False
-        if request.headers.get('Authorization'):
-            looks_like_api = True
-        if request.content_type and 'application/json' in (request.content_type or ''):
-            looks_like_api = True
-        if request.method != 'GET':
-            looks_like_api = True
-        
-        if looks_like_api:
-            ts = datetime.datetime.utcnow().isoformat() + 'Z'
-            entry = {'timestamp': ts, 'remote': remote, 'path': path, 'method': request.method, 'user_agent': ua}
-            try:
-                api_logger.info(json.dumps(entry))
-            except Exception:
-                logging.exception('Failed to write api usage log')
     except Exception:
         logging.exception('Error in before_request handler')
 
-# Configure a rotating file logger for API usage
+def looks_like_api_request(method, content_type, authorization):
+    """True for requests the usage log records: an Authorization header, a JSON body or a non-GET method."""
+    return bool(authorization) or 'application/json' in (content_type or '') or method != 'GET'
+
+@app.after_request
+def record_request_metrics(response):
+    """Records the latency and status of every request per route for /metrics."""
+    try:
+        started = g.get('request_started')
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        if started is not None:
+            HTTP_DURATION.observe(time.perf_counter() - started, (route, request.method))
+        HTTP_RESPONSES.inc((route, str(response.status_code)))
+    except Exception:
+        logging.exception('Error recording request metrics')
+    return response
+
+@app.after_request
+def log_api_usage(response):
+    """
+    After each API-like request, queue a usage entry with its latency and status for the background
+    writer. For streamed responses the latency is the time until the response started.
+    """
+    try:
+        if looks_like_api_request(request.method, request.content_type, request.headers.get('Authorization')):
+            started = g.get('request_started')
+            API_USAGE.record(
+                request.remote_addr or request.environ.get('REMOTE_ADDR'), request.path or '', request.method,
+                request.headers.get('User-Agent', ''), response.status_code,
+                (time.perf_counter() - started) * 1000 if started is not None else None
+            )
+    except Exception:
+        logging.exception('Error in after_request handler')
+    return response
+
+# Rotating file logger for API usage; the file handler is attached by get_api_logger() on first use
 API_USAGE_LOG = os.path.join(LOGS_DIR, 'api_usage.log')
 api_logger = logging.getLogger('api_usage')
 api_logger.setLevel(logging.INFO)
-if not any(isinstance(h, logging.handlers.TimedRotatingFileHandler) for h in api_logger.handlers):
-    try:
-        handler = logging.handlers.TimedRotatingFileHandler(API_USAGE_LOG, when='W0', interval=1, backupCount=8, encoding='utf-8')
-        formatter = logging.Formatter('%(message)s')
-        handler.setFormatter(formatter)
-        api_logger.addHandler(handler)
-    except Exception:
-        logging.exception('Failed to configure API usage rotating log handler')
+_api_logger_lock = threading.Lock()
+
+def get_api_logger():
+    """Returns api_logger, creating the logs directory and attaching the rotating file handler once."""
+    with _api_logger_lock:
+        if not any(isinstance(h, logging.handlers.TimedRotatingFileHandler) for h in api_logger.handlers):
+            try:
+                os.makedirs(LOGS_DIR, exist_ok=True)
+                handler = logging.handlers.TimedRotatingFileHandler(API_USAGE_LOG, when='W0', interval=1, backupCount=8, encoding='utf-8')
+                formatter = logging.Formatter('%(message)s')
+                handler.setFormatter(formatter)
+                api_logger.addHandler(handler)
+            except Exception:
+                logging.exception('Failed to configure API usage rotating log handler')
+    return api_logger
+
+class ApiUsageLog:
+    """
+    Writes API usage entries from a background thread. Request threads only enqueue a tuple; the
+    writer formats the timestamps, JSON-encodes the entries and hands each batch to api_logger as
+    one record, so the file handler's lock is taken and the file flushed once per batch instead
+    of once per request. The queue is bounded: when it is full, new entries are dropped and
+    counted ('drop'), or the request waits up to API_LOG_BLOCK_TIMEOUT for room ('block').
+    Dropped entries are reported in the log as a {"event": "dropped"} line.
+    """
+
+    def __init__(self, get_logger, max_queue, batch_size, flush_interval, overflow):
+        # Resolved when the writer starts, so the log file is only opened once there is something to log
+        self.get_logger = get_logger
+        self.logger = None
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self._dropped_unreported = 0
+        self.written = 0
+        self.batches = 0
+
+    def record(self, remote, path, method, user_agent, status, latency_ms, wait=True):
+        """
+        Queues one entry. Only waits if the overflow policy is 'block', the queue is full and wait is
+        true; callers on an event loop pass wait=False.
+        """
+        if self._thread is None:
+            self._start()
+        entry = (time.time(), remote, path, method, user_agent, status, latency_ms)
+        try:
+            if self.overflow == 'block' and wait:
+                self._queue.put(entry, timeout=API_LOG_BLOCK_TIMEOUT)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._dropped_unreported += 1
+
+    def flush(self):
+        """
+        Writes everything still queued from the calling thread (used at interpreter exit). The writer
+        is asked to finish the batch it is collecting first, so entries it already took are not lost.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=API_LOG_BLOCK_TIMEOUT)
+                self._thread.join(self.flush_interval + API_LOG_BLOCK_TIMEOUT)
+            except queue.Full:
+                pass
+        entries = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                entries.append(entry)
+        if entries or self._dropped_unreported:
+            self._write(entries)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'dropped': self.dropped,
+            'written': self.written,
+            'batches': self.batches
+        }
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                if self.logger is None:
+                    self.logger = self.get_logger()
+                self._thread = threading.Thread(target=self._run, name='api-usage-log', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        # A None entry (queued by flush) stops the writer after the batch it belongs to
+        stopping = False
+        while not stopping:
+            entries = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(entries) < self.batch_size and entries[-1] is not None:
+                try:
+                    entries.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if entries[-1] is None:
+                stopping = True
+                entries.pop()
+            if entries:
+                self._write(entries)
+
+    def _write(self, entries):
+        lines = [json.dumps({
+            'timestamp': datetime.datetime.utcfromtimestamp(at).isoformat() + 'Z',
+            'remote': remote,
+            'path': path,
+            'method': method,
+            'user_agent': user_agent,
+            'status': status,
+            'latency_ms': round(latency_ms, 2) if latency_ms is not None else None
+        }) for at, remote, path, method, user_agent, status, latency_ms in entries]
+        with self._lock:
+            dropped, self._dropped_unreported = self._dropped_unreported, 0
+        if dropped:
+            lines.append(json.dumps({'timestamp': datetime.datetime.utcnow().isoformat() + 'Z', 'event': 'dropped',
+                                     'count': dropped}))
+        try:
+            self.logger.info('\n'.join(lines))
+            self.written += len(entries)
+            self.batches += 1
+        except Exception:
+            logging.exception('Failed to write api usage log')
+
+API_USAGE = ApiUsageLog(get_api_logger, API_LOG_QUEUE_SIZE, API_LOG_BATCH_SIZE, API_LOG_FLUSH_INTERVAL, API_LOG_OVERFLOW)
 
 # List of DNS servers for selection in the UI
 if CUSTOM_DNS_SERVERS_FROM_ENV:
@@ -115,7 +402,7 @@ else:
 
 def is_valid_target(target):
     """Check if the target string contains only valid characters for a hostname or IP."""
-    return all(c.isalnum() or c in ('.', '-', '_') for c in target)
+    return is_ip_address(target) or all(c.isalnum() or c in ('.', '-', '_') for c in target)
 
 def is_ip_address(target):
     """Check if the target string is a valid IPv4 or IPv6 address."""
@@ -125,10 +412,875 @@ def is_ip_address(target):
     except ValueError:
         return False
 
-def _resolve_hostname_with_fallback(target, dns_server):
+# --- Metrics ---
+
+class _ShardOwner:
+    """Held in a metric's thread-local storage; it is released when its thread ends, which retires the shard."""
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+class _ShardedMetric:
+    """
+    Base of the in-process metrics. Every thread updates its own shard (a dict keyed by label
+    values) without taking a lock; the one-time shard registration is the only locked step.
+    Collection sums the shards, so recording stays cheap under load. When a thread ends, its
+    shard is folded into a retired total, so short-lived worker pools do not pile up shards.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            owner = _ShardOwner({})
+            with self._lock:
+                self._shards.append(owner.shard)
+            weakref.finalize(owner, self._retire, owner.shard)
+            self._local.owner = owner
+            return owner.shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._merge(self._retired, shard)
+            # By identity: list.remove() would match the first shard with equal contents
+            self._shards = [s for s in self._shards if s is not shard]
+
+    def _merge(self, totals, shard):
+        for labels, value in shard.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def _totals(self):
+        totals = {}
+        with self._lock:
+            self._merge(totals, self._retired)
+            shards = list(self._shards)
+        for shard in shards:
+            # dict.copy() is atomic, so a shard may be read while its thread keeps writing
+            self._merge(totals, shard.copy())
+        return totals
+
+    def collect(self):
+        """Returns (suffix, labels, value) samples."""
+        return [('', labels, value) for labels, value in sorted(self._totals().items())]
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+
+    def inc(self, labels=(), value=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+class Gauge(Counter):
+    """A sharded up/down gauge, e.g. requests in flight: each shard holds that thread's net change."""
+    kind = 'gauge'
+
+    def dec(self, labels=(), value=1):
+        self.inc(labels, -value)
+
+class Histogram(_ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)):
+        super(Histogram, self).__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # One count per bucket, one for +Inf, then the sum of the observed values
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, totals, shard):
+        for labels, counts in shard.items():
+            total = totals.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for i, count in enumerate(list(counts)):
+                total[i] += count
+
+    def collect(self):
+        samples = []
+        for labels, counts in sorted(self._totals().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', labels + (('+Inf' if bound == float('inf') else f"{bound:g}"),), cumulative))
+            samples.append(('_sum', labels, counts[-1]))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+class MetricsRegistry:
+    """Holds the metrics and renders them, plus the values of registered collectors, in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), **kwargs):
+        return self._register(Histogram(name, help_text, labelnames, **kwargs))
+
+    def add_collector(self, collector):
+        """
+        Registers a function called at render time. It returns (name, kind, help, samples) tuples,
+        samples being ({label: value}, value) pairs, for values already tracked elsewhere.
+        """
+        self._collectors.append(collector)
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    @staticmethod
+    def _format_labels(names, values):
+        if not names:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+        return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+    @staticmethod
+    def _format_value(value):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    def families(self):
+        """
+        Returns the current values as (name, kind, help, samples) tuples, samples being
+        (name suffix, label names, label values, value) tuples. The result can be pickled.
+        """
+        families = []
+        for metric in self._metrics:
+            samples = []
+            for suffix, labels, value in metric.collect():
+                names = metric.labelnames + (('le',) if suffix == '_bucket' else ())
+                samples.append((suffix, names, tuple(labels), value))
+            families.append((metric.name, metric.kind, metric.help, samples))
+        for collector in self._collectors:
+            try:
+                collected = collector()
+            except Exception:
+                logging.exception("Metrics collector failed")
+                continue
+            for name, kind, help_text, samples in collected:
+                families.append((name, kind, help_text,
+                                 [('', tuple(labels), tuple(labels.values()), value) for labels, value in samples]))
+        return families
+
+    @classmethod
+    def format(cls, families):
+        """Renders families() output in Prometheus text format."""
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, names, values, value in samples:
+                lines.append(f"{name}{suffix}{cls._format_labels(names, values)} {cls._format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def render(self):
+        return self.format(self.families())
+
+class MetricsAggregator:
+    """
+    Sums the metrics of the worker processes in the supervisor when WEB_WORKERS > 1. Workers push
+    the totals of their registry every METRICS_PUSH_INTERVAL seconds and when they answer a
+    scrape; a scrape shows the supervisor's own metrics plus the latest push of every worker, so
+    each series stays monotonic whichever worker answers. The counters and histograms of workers
+    that exited are kept; their gauges are dropped.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._workers = {}
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def push(self, pid, families):
+        with self._lock:
+            self._workers[pid] = families
+
+    def retire(self, pid):
+        """Folds the last push of an exited worker into the retired totals."""
+        with self._lock:
+            families = self._workers.pop(pid, None)
+            if families:
+                self._merge(self._retired, [family for family in families if family[1] != 'gauge'])
+
+    def render(self, pid=None, families=None):
+        """Returns the summed metrics in Prometheus text format, after storing the caller's push if given."""
+        merged = {}
+        self._merge(merged, self.registry.families())
+        with self._lock:
+            if pid is not None:
+                self._workers[pid] = families
+            self._merge(merged, self._families(self._retired))
+            for worker_families in self._workers.values():
+                self._merge(merged, worker_families)
+        return self.registry.format(self._families(merged))
+
+    @staticmethod
+    def _merge(totals, families):
+        for name, kind, help_text, samples in families:
+            family_totals = totals.setdefault(name, (kind, help_text, {}))[2]
+            for suffix, names, values, value in samples:
+                key = (suffix, names, values)
+                family_totals[key] = family_totals.get(key, 0) + value
+
+    @staticmethod
+    def _families(totals):
+        return [(name, kind, help_text, [(*key, value) for key, value in samples.items()])
+                for name, (kind, help_text, samples) in totals.items()]
+
+METRICS = MetricsRegistry()
+METRICS_AGGREGATOR = MetricsAggregator(METRICS)
+TOOL_DURATION = METRICS.histogram('netdiag_tool_duration_seconds', 'Duration of diagnostic tool calls.', ('tool',))
+TOOL_CALLS = METRICS.counter('netdiag_tool_calls_total', 'Diagnostic tool calls by outcome (ok, error, timeout or cancelled).', ('tool', 'outcome'))
+TOOL_IN_FLIGHT = METRICS.gauge('netdiag_tool_in_flight', 'Diagnostic tool calls currently running.', ('tool',))
+DNS_QUERY_DURATION = METRICS.histogram('netdiag_dns_query_duration_seconds', 'Duration of DNS queries sent to each DNS server (cache misses only).', ('server',))
+DNS_QUERIES = METRICS.counter('netdiag_dns_queries_total', 'DNS queries sent to each DNS server by outcome.', ('server', 'outcome'))
+BULK_WORK = METRICS.counter('netdiag_bulk_work_total', 'Bulk NSLookup rows (resolved or unresolved), and lookups, pings and PTR lookups performed or reused from an earlier row.', ('kind', 'result'))
+SUBPROCESS_SPAWNS = METRICS.counter('netdiag_subprocess_spawns_total', 'External commands started.', ('command',))
+HTTP_DURATION = METRICS.histogram('netdiag_http_request_duration_seconds', 'Time until the response started, per route.', ('route', 'method'))
+HTTP_RESPONSES = METRICS.counter('netdiag_http_responses_total', 'HTTP responses per route and status code.', ('route', 'status'))
+
+_metric_dns_servers = None
+
+def _dns_server_label(server):
+    """
+    Label for per-DNS-server metrics. Configured DNS servers (given as an address, or as a
+    hostname whose address the resolver registry holds) and the system resolvers keep their
+    address; any other (user-supplied) server is reported as 'other' to bound the label set.
+    """
+    global _metric_dns_servers
+    if _metric_dns_servers is None:
+        _metric_dns_servers = {RESOLVERS.split_server(s)[0] for s in DNS_SERVERS}
+    if server in _metric_dns_servers:
+        return server
+    if any(RESOLVERS.cached_address(name) == server for name in _metric_dns_servers):
+        return server
+    try:
+        system_nameservers = RESOLVERS.system_nameservers()
+    except Exception:
+        system_nameservers = ()
+    return server if server in system_nameservers else 'other'
+
+def observe_dns_query(server, started, outcome):
+    """Records one DNS query to server that began at perf_counter() value started."""
+    label = _dns_server_label(server)
+    DNS_QUERY_DURATION.observe(time.perf_counter() - started, (label,))
+    DNS_QUERIES.inc((label, outcome))
+
+def _dns_outcome(exc):
+    if isinstance(exc, dns.resolver.NXDOMAIN):
+        return 'nxdomain'
+    if isinstance(exc, dns.resolver.NoAnswer):
+        return 'noanswer'
+    if isinstance(exc, (dns.exception.Timeout, dns.resolver.LifetimeTimeout)):
+        return 'timeout'
+    return 'error'
+
+def _dns_failure(exc):
+    """Classifies a failed DNS resolution for NSLookupResult.failure; None for NXDOMAIN and NoAnswer, which are answers."""
+    outcome = _dns_outcome(exc)
+    return None if outcome in ('nxdomain', 'noanswer') else outcome
+
+def _tool_outcome(result):
+    """Classifies a tool result (a result model, or the last dict of a stream) as ok, error or timeout."""
+    failure = getattr(result, 'failure', None)
+    if failure:
+        return 'timeout' if failure == 'timeout' else 'error'
+    error = result.get('error') if isinstance(result, dict) else getattr(result, 'error', None)
+    if not error:
+        return 'ok'
+    return 'timeout' if re.search(r'timed out|timeout', str(error), re.IGNORECASE) else 'error'
+
+def instrument_tool(tool):
+    """
+    Decorator recording the duration, outcome and in-flight count of a tool function (async or
+    sync) that returns a result model, or of a generator (async or sync) of rows or events, which
+    is timed from its first item to its end. Outcomes come from the result's error, or that of the
+    generator's last item; exceptions count as errors and generators closed early as cancelled.
+    """
+    labels = (tool,)
+
+    def start():
+        TOOL_IN_FLIGHT.inc(labels)
+        return time.perf_counter()
+
+    def finish(started, outcome):
+        TOOL_IN_FLIGHT.dec(labels)
+        TOOL_DURATION.observe(time.perf_counter() - started, labels)
+        TOOL_CALLS.inc((tool, outcome))
+
+    def decorate(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                started, outcome, item = start(), 'error', None
+                items = func(*args, **kwargs)
+                try:
+                    async for item in items:
+                        yield item
+                    outcome = _tool_outcome(item)
+                except (GeneratorExit, asyncio.CancelledError):
+                    outcome = 'cancelled'
+                    raise
+                finally:
+                    try:
+                        await items.aclose()
+                    finally:
+                        finish(started, outcome)
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                started, outcome, item = start(), 'error', None
+                items = func(*args, **kwargs)
+                try:
+                    for item in items:
+                        yield item
+                    outcome = _tool_outcome(item)
+                except GeneratorExit:
+                    outcome = 'cancelled'
+                    raise
+                finally:
+                    try:
+                        items.close()
+                    finally:
+                        finish(started, outcome)
+            return gen_wrapper
+
+        if not asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            def sync_wrapper(*args, **kwargs):
+                started, outcome = start(), 'error'
+                try:
+                    result = func(*args, **kwargs)
+                    outcome = _tool_outcome(result)
+                    return result
+                finally:
+                    finish(started, outcome)
+            return sync_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started, outcome = start(), 'error'
+            try:
+                result = await func(*args, **kwargs)
+                outcome = _tool_outcome(result)
+                return result
+            finally:
+                finish(started, outcome)
+        return wrapper
+    return decorate
+
+class DNSAnswerCache:
+    """
+    Process-wide DNS answer cache keyed by (qname, rdtype, nameserver).
+    Positive answers are kept for their record TTL; NXDOMAIN/NoAnswer results are kept
+    for the SOA minimum of the negative response (RFC 2308). When the cache is full,
+    the least recently used entry is evicted.
     """
-    Internal helper to resolve a hostname with all custom logic.
-    Returns a tuple: (list_of_ips, notes_string, canonical_name, list_of_aliases)
+
+    def __init__(self, max_entries=DNS_CACHE_MAX_ENTRIES, max_ttl=DNS_CACHE_MAX_TTL):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached answer or exception for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl):
+        """Stores value for ttl seconds. Entries with no TTL are not cached."""
+        ttl = min(ttl, self.max_ttl)
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions
+            }
+
+DNS_CACHE = DNSAnswerCache()
+
+def _negative_ttl(exc):
+    """Returns the negative caching TTL for an NXDOMAIN/NoAnswer exception, taken from the SOA in its response."""
+    if isinstance(exc, dns.resolver.NXDOMAIN):
+        responses = list(exc.kwargs.get('responses', {}).values())
+    else:
+        responses = [exc.kwargs.get('response')]
+    for response in responses:
+        if response is None:
+            continue
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return min(rrset.ttl, rrset[0].minimum)
+    return 0
+
+# --- Asyncio Execution Core ---
+
+_async_loop = None
+_async_loop_lock = threading.Lock()
+
+def get_async_loop():
+    """
+    Returns the event loop that runs all diagnostics coroutines.
+    Unless an ASGI server has adopted its own loop, a dedicated daemon thread is started on first use.
+    """
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='diagnostics-loop', daemon=True).start()
+            _async_loop = loop
+        return _async_loop
+
+def adopt_async_loop():
+    """Makes the currently running loop the diagnostics loop, if none has been started yet."""
+    global _async_loop
+    if _async_loop is not None:
+        return
+    with _async_loop_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.get_running_loop()
+
+def run_async(coro, timeout=None):
+    """
+    Runs a coroutine on the diagnostics loop from synchronous code (Flask views, worker threads)
+    and blocks until it finishes.
+    """
+    loop = get_async_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_async() cannot be called from the diagnostics loop; await the coroutine instead.")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+async def run_on_async_loop(coro):
+    """Awaits a coroutine on the diagnostics loop from any other event loop."""
+    loop = get_async_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+async def iterate_bounded(func, items, limit):
+    """
+    Applies the coroutine function func to each item with at most limit calls in flight,
+    yielding results in completion order. Items are consumed lazily, so items may be a generator.
+    """
+    items = iter(items)
+    pending = set()
+    try:
+        while True:
+            while len(pending) < limit:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                pending.add(asyncio.ensure_future(func(item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+def iterate_async(agen):
+    """Iterates an async generator on the diagnostics loop from synchronous code (e.g. a streamed Flask response)."""
+    try:
+        while True:
+            try:
+                item = run_async(_anext(agen))
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        run_async(agen.aclose())
+
+class ResolverRegistry:
+    """
+    Shares one pre-configured async resolver per nameserver instead of building a new
+    dns.asyncresolver.Resolver (and re-reading resolv.conf) for every lookup.
+    Nameservers may be IP addresses, hostnames (resolved once, then re-resolved after
+    NAMESERVER_ADDRESS_TTL seconds) or either form with a "#port" suffix, as in dig.
+    The system default resolver is rebuilt when resolv.conf changes. Since DNS servers come
+    from clients, at most max_entries resolvers and server addresses are kept; the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, address_ttl=NAMESERVER_ADDRESS_TTL, resolv_conf='/etc/resolv.conf',
+                 max_entries=RESOLVER_REGISTRY_MAX_ENTRIES):
+        self.address_ttl = address_ttl
+        self.resolv_conf = resolv_conf
+        self.max_entries = max(1, max_entries)
+        self._resolvers = OrderedDict()
+        self._addresses = OrderedDict()
+        self._system = None
+        self._system_mtime = None
+        self._lock = threading.Lock()
+        self.resolvers_built = 0
+        self.address_lookups = 0
+        self.system_reloads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def split_server(dns_server):
+        """Splits "server#port" into (server, port); the port defaults to 53."""
+        server, _, port = str(dns_server).strip().partition('#')
+        if port and not (port.isdigit() and 1 <= int(port) <= 65535):
+            raise ValueError(f"Invalid DNS server port in '{dns_server}'")
+        return server, int(port or 53)
+
+    def _recall(self, entries, key):
+        """Returns the entry for key (or None), marking it as the most recently used."""
+        with self._lock:
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+            return value
+
+    def _remember(self, entries, key, value):
+        """Stores value under key as the most recently used entry, evicting the oldest beyond max_entries."""
+        with self._lock:
+            value = entries.setdefault(key, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.evictions += 1
+            return value
+
+    def system_resolver(self):
+        """Returns the resolver configured from the system settings, reloading it if resolv.conf changed."""
+        try:
+            mtime = os.stat(self.resolv_conf).st_mtime
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self._system is None or mtime != self._system_mtime:
+                if self._system is not None:
+                    logging.info(f"{self.resolv_conf} changed; reloading the system resolver")
+                    self.system_reloads += 1
+                self._system = dns.asyncresolver.Resolver(filename=self.resolv_conf)
+                self._system_mtime = mtime
+            return self._system
+
+    def cached_address(self, server):
+        """Returns the address held for a nameserver hostname, without resolving it, or None."""
+        with self._lock:
+            entry = self._addresses.get(server)
+        return entry[0] if entry else None
+
+    def system_nameservers(self):
+        """Returns the nameservers of the current system resolver (loading it if needed)."""
+        system = self._system or self.system_resolver()
+        return {str(ns) for ns in system.nameservers}
+
+    async def nameserver_address(self, dns_server):
+        """Returns (ip_address, port) for a nameserver, using the system resolver's first one by default."""
+        if not dns_server or dns_server == 'System Default':
+            resolver = self.system_resolver()
+            return str(resolver.nameservers[0]), resolver.port
+        server, port = self.split_server(dns_server)
+        if is_ip_address(server):
+            return server, port
+
+        cached = self._recall(self._addresses, server)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0], port
+        infos = await asyncio.get_running_loop().getaddrinfo(server, port, type=socket.SOCK_DGRAM)
+        address = infos[0][4][0]
+        self.address_lookups += 1
+        with self._lock:
+            self._addresses.pop(server, None)
+        self._remember(self._addresses, server, (address, time.monotonic() + self.address_ttl))
+        return address, port
+
+    async def get(self, dns_server):
+        """
+        Returns the shared resolver for dns_server. Callers must not modify it.
+        Raises socket.gaierror if a nameserver hostname cannot be resolved.
+        """
+        if not dns_server or dns_server == 'System Default':
+            return self.system_resolver()
+        address, port = await self.nameserver_address(dns_server)
+        key = (address, port)
+        resolver = self._recall(self._resolvers, key)
+        if resolver is None:
+            resolver = dns.asyncresolver.Resolver(configure=False)
+            resolver.nameservers = [address]
+            resolver.port = port
+            self.resolvers_built += 1
+            resolver = self._remember(self._resolvers, key, resolver)
+        return resolver
+
+    def stats(self):
+        """Returns registry counters for diagnostics."""
+        return {
+            'resolvers': len(self._resolvers),
+            'cached_nameserver_addresses': len(self._addresses),
+            'nameserver_address_lookups': self.address_lookups,
+            'system_resolver_reloads': self.system_reloads,
+            'evictions': self.evictions
+        }
+
+RESOLVERS = ResolverRegistry()
+
+async def resolve_cached(resolver, qname, rdtype, lifetime=5):
+    """
+    Resolves qname/rdtype with the given async resolver, serving repeated queries from DNS_CACHE.
+    Raises the same dnspython exceptions as resolver.resolve(), including cached
+    NXDOMAIN/NoAnswer results.
+    """
+    nameserver = ','.join(str(ns) for ns in resolver.nameservers) + f"#{resolver.port}"
+    key = (str(qname).lower().rstrip('.'), rdtype.upper(), nameserver)
+
+    cached = DNS_CACHE.get(key)
+    if cached is not None:
+        if isinstance(cached, dns.exception.DNSException):
+            raise cached.__class__(**cached.kwargs)
+        return cached
+
+    server = str(resolver.nameservers[0]) if resolver.nameservers else 'none'
+    started = time.perf_counter()
+    try:
+        answer = await resolver.resolve(qname, rdtype, lifetime=lifetime)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        observe_dns_query(server, started, _dns_outcome(e))
+        DNS_CACHE.put(key, e, _negative_ttl(e))
+        raise
+    except dns.exception.DNSException as e:
+        observe_dns_query(server, started, _dns_outcome(e))
+        raise
+
+    observe_dns_query(server, started, 'ok')
+    DNS_CACHE.put(key, answer, answer.expiration - time.time())
+    return answer
+
+# --- Result Models ---
+# Each diagnostic produces one of these; text output is rendered from them by the format_* functions,
+# and the API returns them directly for format=json.
+
+# Slotted dataclasses need Python 3.10+; older interpreters get regular dataclasses
+DATACLASS_OPTIONS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+class ResultModel:
+    """Base class for result models. Provides a JSON-friendly to_dict()."""
+    __slots__ = ()
+
+    def to_dict(self):
+        data = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if isinstance(value, ResultModel):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, ResultModel) else item for item in value]
+            data[f.name] = value
+        return data
+
+@dataclass(**DATACLASS_OPTIONS)
+class NSLookupResult(ResultModel):
+    """
+    Result of a forward or reverse nslookup. addresses lists IPv4 before IPv6; cname_chain runs
+    from the target to the canonical name. raw_output is set when the system nslookup fallback was used.
+    failure is 'timeout' or 'error' when the DNS server gave no usable answer (NXDOMAIN is an answer).
+    """
+    target: str
+    dns_server: Optional[str]
+    name: Optional[str] = None
+    addresses: list = field(default_factory=list)
+    aliases: list = field(default_factory=list)
+    cname_chain: list = field(default_factory=list)
+    notes: str = ""
+    status: Optional[str] = None
+    error: Optional[str] = None
+    raw_output: Optional[str] = None
+    failure: Optional[str] = None
+
+@dataclass(**DATACLASS_OPTIONS)
+class PingResult(ResultModel):
+    """Result of pinging a target: resolution notes plus the PingStats of the pinged address."""
+    target: str
+    stats: Optional['PingStats'] = None
+    notes: str = ""
+    error: Optional[str] = None
+
+@dataclass(**DATACLASS_OPTIONS)
+class DigMessage(ResultModel):
+    """One DNS response received by dig: header, sections as record dicts, EDNS info and timing."""
+    server: str
+    port: int
+    protocol: str
+    id: int
+    opcode: str
+    status: str
+    flags: list
+    question: list
+    answer: list
+    authority: list
+    additional: list
+    edns: Optional[dict]
+    query_time_ms: float
+    msg_size: int
+    server_name: Optional[str] = None
+
+@dataclass(**DATACLASS_OPTIONS)
+class DigResult(ResultModel):
+    """Result of a dig query: the response, or one response per step for +trace."""
+    target: str
+    record_type: str
+    dns_server: Optional[str]
+    options: dict = field(default_factory=dict)
+    response: Optional[DigMessage] = None
+    trace: list = field(default_factory=list)
+    when: Optional[str] = None
+    error: Optional[str] = None
+
+@dataclass(**DATACLASS_OPTIONS)
+class ResolverAnswer(ResultModel):
+    """One resolver's answer in a resolver comparison."""
+    server: str
+    status: Optional[str] = None
+    answers: list = field(default_factory=list)
+    ttl: Optional[int] = None
+    latency_ms: Optional[float] = None
+    matches_majority: bool = False
+    error: Optional[str] = None
+
+@dataclass(**DATACLASS_OPTIONS)
+class ResolverComparison(ResultModel):
+    """
+    The same query sent to several resolvers. groups lists each distinct (status, answers)
+    combination with the resolvers that returned it, largest group first.
+    """
+    target: str
+    record_type: str
+    servers: list
+    results: list = field(default_factory=list)
+    groups: list = field(default_factory=list)
+    consistent: bool = False
+    all_responded: bool = False
+    ttl_min: Optional[int] = None
+    ttl_max: Optional[int] = None
+    elapsed_ms: Optional[float] = None
+    error: Optional[str] = None
+
+@dataclass(**DATACLASS_OPTIONS)
+class TracerouteHop(ResultModel):
+    """
+    One hop of a traceroute. address is the router that answered (None if no probe was
+    answered), rtts holds one entry per probe in ms, None for a lost probe.
+    """
+    ttl: int
+    address: Optional[str] = None
+    name: Optional[str] = None
+    rtts: list = field(default_factory=list)
+    reached: bool = False
+
+@dataclass(**DATACLASS_OPTIONS)
+class TracerouteResult(ResultModel):
+    """Result of a traceroute. hops are ordered by TTL and end at the destination when it was reached."""
+    target: str
+    address: Optional[str] = None
+    engine: Optional[str] = None
+    max_hops: Optional[int] = None
+    probes: Optional[int] = None
+    hops: list = field(default_factory=list)
+    reached: bool = False
+    elapsed_ms: Optional[float] = None
+    error: Optional[str] = None
+
+@dataclass(**DATACLASS_OPTIONS)
+class PortTestResult(ResultModel):
+    """
+    Result of a port test. state is 'open', 'closed', 'unresolved' or 'error' for single-port
+    tests; scan holds the scan_tcp_ports_async() report in scan mode.
+    """
+    target: str
+    port: Optional[str]
+    protocol: str
+    state: Optional[str] = None
+    error_code: Optional[str] = None
+    scan: Optional[dict] = None
+    error: Optional[str] = None
+
+def _cname_chain(qname, response):
+    """Follows the CNAME records for qname in a response's answer section. Returns [qname, ..., canonical_name]."""
+    chain = [qname.rstrip('.')]
+    if response is None:
+        return chain
+    cnames = {rrset.name.to_text().rstrip('.').lower(): str(rrset[0].target).rstrip('.')
+              for rrset in response.answer if rrset.rdtype == dns.rdatatype.CNAME}
+    while chain[-1].lower() in cnames and len(chain) <= len(cnames):
+        chain.append(cnames[chain[-1].lower()])
+    return chain
+
+async def _resolve_hostname_with_fallback_async(target, dns_server):
+    """
+    Internal helper to resolve a hostname with all custom logic. A and AAAA are queried in
+    parallel, and any CNAME chain is read from the answer section of those responses.
+    Returns a tuple: (list_of_ips, notes_string, canonical_name, list_of_aliases, failure) where the
+    IPv4 addresses come first and aliases lists every name in the chain before the canonical one.
+    failure is 'timeout' or 'error' when nothing resolved because no usable answer came back.
     """
     try:
         logging.info(f"Resolving hostname '{target}' using DNS server '{dns_server}'")
@@ -141,219 +1293,1334 @@ def _resolve_hostname_with_fallback(target, dns_server):
             lines.append(f"Note: Appending {DEFAULT_DOMAIN} to single-label hostname '{target}'.\n")
             target = f"{target}.{DEFAULT_DOMAIN}"
         
-        resolver = dns.resolver.Resolver()
-        if dns_server and dns_server != 'System Default':
-            if not is_ip_address(dns_server):
-                try:
-                    dns_server_ip = socket.gethostbyname(dns_server)
-                    resolver.nameservers = [dns_server_ip]
-                except socket.gaierror:
-                    return [], f"Error: Could not resolve DNS server hostname '{dns_server}'", None, []
-            else:
-                resolver.nameservers = [dns_server]
-
-        canonical = None
-        aliases = []
-        addresses = []
-
-        # Perform forward lookup, first checking for a CNAME record
         try:
-            cname_answers = resolver.resolve(target, 'CNAME', lifetime=5)
-            for c in cname_answers:
-                cname = str(c.target).rstrip('.')
-                canonical = cname
-                if target not in aliases:
-                    aliases.append(target)
-        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-            pass
-        except Exception as e:
-            logging.warning(f"Unexpected error during CNAME lookup for {target}: {e}")
-            pass
-
-        to_resolve = canonical or target
+            resolver = await RESOLVERS.get(dns_server)
+        except socket.gaierror:
+            return [], f"Error: Could not resolve DNS server hostname '{dns_server}'", None, [], 'error'
+        except ValueError as e:
+            return [], f"Error: {e}", None, [], 'error'
 
-        try:
-            a_answers = resolver.resolve(to_resolve, 'A', lifetime=5)
-            for a in a_answers:
-                ip = str(a)
-                if ip not in addresses:
-                    addresses.append(ip)
-        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-            pass
-        except Exception as e:
-            logging.warning(f"Unexpected error during A record lookup for {to_resolve}: {e}")
-            pass
+        addresses = []
+        chain = [target]
+        failure = None
+        results = await asyncio.gather(resolve_cached(resolver, target, 'A', lifetime=5),
+                                       resolve_cached(resolver, target, 'AAAA', lifetime=5), return_exceptions=True)
+        for rdtype, result in zip(('A', 'AAAA'), results):
+            if isinstance(result, dns.resolver.Answer):
+                addresses.extend(str(rdata) for rdata in result if str(rdata) not in addresses)
+                responses = [result.response]
+            elif isinstance(result, dns.resolver.NoAnswer):
+                responses = [result.kwargs.get('response')]
+            elif isinstance(result, dns.resolver.NXDOMAIN):
+                responses = list(result.kwargs.get('responses', {}).values())
+            else:
+                logging.warning(f"Unexpected error during {rdtype} record lookup for {target}: {result}")
+                failure = failure or _dns_failure(result)
+                continue
+            for response in responses:
+                found = _cname_chain(target, response)
+                if len(found) > len(chain):
+                    chain = found
 
-        return addresses, "\n".join(lines), canonical, aliases
+        canonical = chain[-1] if len(chain) > 1 else None
+        aliases = chain[:-1] if canonical else []
+        return addresses, "\n".join(lines), canonical, aliases, None if addresses else failure
 
     except Exception as e:
         logging.exception(f"Error in _resolve_hostname_with_fallback for {target}")
-        return [], f"Error during DNS resolution: {e}", None, []
+        return [], f"Error during DNS resolution: {e}", None, [], 'error'
 
-def run_nslookup(target, dns_server):
+def _resolve_hostname_with_fallback(target, dns_server):
+    """Synchronous wrapper around _resolve_hostname_with_fallback_async()."""
+    return run_async(_resolve_hostname_with_fallback_async(target, dns_server))
+
+@instrument_tool('nslookup')
+async def nslookup_result_async(target, dns_server):
     """
-    Main function to perform an nslookup. It uses the internal helper for forward lookups
-    and handles reverse (PTR) lookups directly. It formats the final output string.
+    Performs an nslookup and returns an NSLookupResult. Forward lookups use the internal
+    resolver helper; IP targets get a reverse (PTR) lookup. Falls back to the system
+    nslookup binary if the programmatic lookup fails unexpectedly.
     """
     try:
         logging.info(f"Running programmatic DNS lookup for {target} using {dns_server}")
         if not target or not is_valid_target(target):
-            return "Invalid input."
+            return NSLookupResult(target=target, dns_server=dns_server, error="Invalid input.")
 
         if is_ip_address(target):
-            resolver = dns.resolver.Resolver()
-            if dns_server and dns_server != 'System Default':
-                resolver.nameservers = [dns_server]
+            resolver = await RESOLVERS.get(dns_server)
             reversed_ip = ipaddress.ip_address(target).reverse_pointer
             try:
-                ptr_answers = resolver.resolve(reversed_ip, 'PTR', lifetime=5)
+                ptr_answers = await resolve_cached(resolver, reversed_ip, 'PTR', lifetime=5)
                 canonical = str(ptr_answers[0].target).rstrip('.')
-                return f"Name: {canonical}\nAddress: {target}"
+                return NSLookupResult(target=target, dns_server=dns_server, name=canonical, addresses=[target])
             except Exception as e:
-                return f"Name: {target}\nAddress: {target}\nStatus: No reverse DNS (PTR) record found for this IP. ({e})"
-
-        addresses, notes, canonical, aliases = _resolve_hostname_with_fallback(target, dns_server)
-        lines = [notes] if notes else []
-        display_name = canonical or target
-        lines.append(f"Name: {display_name}")
-        for ip in addresses:
-            lines.append(f"Address: {ip}")
-
-        if aliases:
-            lines.append(f"Aliases: {', '.join(aliases)}")
+                return NSLookupResult(target=target, dns_server=dns_server, name=target, addresses=[target],
+                                      status=f"No reverse DNS (PTR) record found for this IP. ({e})",
+                                      failure=_dns_failure(e))
 
+        addresses, notes, canonical, aliases, failure = await _resolve_hostname_with_fallback_async(target, dns_server)
+        result = NSLookupResult(target=target, dns_server=dns_server, name=canonical or target,
+                                addresses=addresses, aliases=aliases, cname_chain=aliases + [canonical] if canonical else [],
+                                notes=notes, failure=failure)
         if not addresses and not canonical:
-            lines.append("Status: Hostname does not exist or could not be resolved.")
-
-        return "\n".join(lines)
+            result.status = "Hostname does not exist or could not be resolved."
+        return result
 
     except Exception:
         logging.exception("Programmatic DNS lookup failed, falling back to system nslookup.")
         try:
             logging.info(f"Falling back to system nslookup for target: {target} using DNS server: {dns_server}")
-            if not target or not is_valid_target(target):
-                return "Invalid input."
-
             command = ['nslookup', target]
             if dns_server and dns_server != "System Default":
                 command.append(dns_server)
 
-            return run_subprocess(command, timeout=10)
+            output = await run_subprocess_async(command, timeout=10)
+            # Only addresses after the first "Name:" belong to the target; earlier ones are the server's
+            answer = output.split('Name:', 1)[1] if 'Name:' in output else ''
+            return NSLookupResult(target=target, dns_server=dns_server, raw_output=output,
+                                  addresses=re.findall(r'Address(?:es)?:\s*([0-9A-Fa-f:.]+)', answer))
 
         except Exception as e:
-            return f"An error occurred in fallback nslookup: {str(e)}"
-
-def format_nslookup_output(nslookup_text, query_name=None):
-    return nslookup_text
-
-def run_ping(target, count=4):
-    """
-    Runs a ping command. If the target is a hostname, it first resolves it and then pings the resulting IP.
-    """
-    PING_TIMEOUT = 5 
-    try:
-        logging.info(f"Running ping for {target}")
-        if not target or not is_valid_target(target):
-            return "Invalid input."
-
-        ping_target = target
-        resolution_notes = ""
-
-        if not is_ip_address(target):
-            addresses, notes, _, _ = _resolve_hostname_with_fallback(target, DNS_SERVERS[0])
-            if notes:
-                resolution_notes = notes + "\n"
-            if addresses:
-                ping_target = addresses[0]
-                resolution_notes += f"Pinging resolved IP: {ping_target}\n\n"
-            else:
-                return f"{notes}\nCould not resolve '{target}' to an IP address to ping."
+            return NSLookupResult(target=target, dns_server=dns_server,
+                                  error=f"An error occurred in fallback nslookup: {str(e)}")
 
-        if platform.system().lower() == "windows":
-            command = ['ping', '-n', str(count), ping_target]
-        else:
-            command = ['ping', '-c', str(count), ping_target]
+def format_nslookup_output(result):
+    """Formats an NSLookupResult in the style of the nslookup utility."""
+    if result.error:
+        return result.error
+    if result.raw_output is not None:
+        return result.raw_output
+    lines = [result.notes] if result.notes else []
+    lines.append(f"Name: {result.name}")
+    for ip in result.addresses:
+        lines.append(f"Address: {ip}")
+    if result.aliases:
+        lines.append(f"Aliases: {', '.join(result.aliases)}")
+    if len(result.cname_chain) > 2:
+        lines.append(f"CNAME chain: {' -> '.join(result.cname_chain)}")
+    if result.status:
+        lines.append(f"Status: {result.status}")
+    return "\n".join(lines)
 
-        ping_output = run_subprocess(command, timeout=PING_TIMEOUT)
-        return resolution_notes + ping_output
+async def run_nslookup_async(target, dns_server):
+    """Performs an nslookup and returns the formatted text output."""
+    return format_nslookup_output(await nslookup_result_async(target, dns_server))
 
-    except subprocess.TimeoutExpired:
-        return f"Ping to {target} timed out after {PING_TIMEOUT} seconds."
-    except Exception as e:
-        return f"An error occurred in ping: {str(e)}"
+def run_nslookup(target, dns_server):
+    """Synchronous wrapper around run_nslookup_async()."""
+    return run_async(run_nslookup_async(target, dns_server))
 
-def run_dig(target, dig_type='A', dns_server=None):
-    """Wrapper for the 'dig' command-line utility."""
-    try:
-        logging.info(f"Running dig for {target}, type {dig_type}, server {dns_server}")
-        if not target or not is_valid_target(target):
-            return "Invalid input."
+@dataclass(**DATACLASS_OPTIONS)
+class PingStats(ResultModel):
+    """Structured result of pinging one address: per-echo RTTs (None = lost) and summary statistics."""
+    host: str
+    address: str
+    method: str
+    replies: list = field(default_factory=list)
+    ttl: Optional[int] = None
+    error: Optional[str] = None
 
-        command = ['dig', target, dig_type]
-        if dns_server and dns_server not in ("System Default", "8.8.8.8"):
-            command.append(f"@{dns_server}")
+    @property
+    def sent(self):
+        return len(self.replies)
 
-        return run_subprocess(command, timeout=10)
+    @property
+    def received(self):
+        return sum(1 for rtt in self.replies if rtt is not None)
 
-    except Exception as e:
-        return f"An error occurred in dig: {str(e)}"
+    @property
+    def loss_pct(self):
+        return round(100.0 * (self.sent - self.received) / self.sent, 1) if self.sent else 100.0
 
-def run_traceroute(target):
-    """Wrapper for the 'traceroute' or 'tracert' command-line utility."""
-    try:
-        logging.info(f"Running traceroute for {target}")
-        if not target or not is_valid_target(target):
-            return "Invalid input."
+    @property
+    def rtts(self):
+        return [rtt for rtt in self.replies if rtt is not None]
 
-        note = "Note: This traceroute originates from the application server.\nThe network path shown may differ from the path taken from your local machine or other locations.\n\n"
+    def to_dict(self):
+        rtts = self.rtts
+        return {
+            'host': self.host,
+            'address': self.address,
+            'method': self.method,
+            'sent': self.sent,
+            'received': self.received,
+            'loss_pct': self.loss_pct,
+            'rtt_min_ms': round(min(rtts), 3) if rtts else None,
+            'rtt_avg_ms': round(statistics.mean(rtts), 3) if rtts else None,
+            'rtt_max_ms': round(max(rtts), 3) if rtts else None,
+            'rtt_stddev_ms': round(statistics.pstdev(rtts), 3) if rtts else None,
+            'ttl': self.ttl,
+            'error': self.error
+        }
 
-        if platform.system().lower() == "windows":
-            command = ['tracert', target]
+def format_ping_stats(stats):
+    """Formats PingStats in the style of the ping utility."""
+    if stats.error and not stats.sent:
+        return f"Ping {stats.address} failed: {stats.error}"
+    method = {'icmp': 'ICMP echo', 'tcp': 'TCP connect', 'system': 'system ping'}.get(stats.method, stats.method)
+    lines = [f"PING {stats.host} ({stats.address}) using {method}:"]
+    for seq, rtt in enumerate(stats.replies, start=1):
+        if rtt is None:
+            lines.append(f"Request timed out: seq={seq}")
         else:
-            command = ['traceroute', target]
-
-        traceroute_output = run_subprocess(command, timeout=30)
-        return note + traceroute_output
+            ttl = f" ttl={stats.ttl}" if stats.ttl is not None else ""
+            lines.append(f"Reply from {stats.address}: seq={seq}{ttl} time={rtt:.2f} ms")
+    summary = stats.to_dict()
+    lines.append("")
+    lines.append(f"--- {stats.host} ping statistics ---")
+    lines.append(f"{summary['sent']} packets transmitted, {summary['received']} received, {summary['loss_pct']:g}% packet loss")
+    if summary['received']:
+        lines.append(f"rtt min/avg/max/stddev = {summary['rtt_min_ms']:.3f}/{summary['rtt_avg_ms']:.3f}/"
+                     f"{summary['rtt_max_ms']:.3f}/{summary['rtt_stddev_ms']:.3f} ms")
+    return "\n".join(lines)
 
-    except Exception as e:
-        return f"An error occurred in traceroute: {str(e)}"
+def _icmp_checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
 
-def run_test_netconnection(target, port, protocol='tcp'):
+class ICMPPinger:
     """
-    Simulates a port check, similar to Test-NetConnection or nc.
-    Currently only supports TCP.
+    Sends ICMP echo requests for any number of hosts over one socket and matches replies by
+    source address and sequence number. Uses an unprivileged ICMP datagram socket where the
+    kernel allows it (Linux net.ipv4.ping_group_range, macOS), otherwise a raw socket, which
+    needs root/CAP_NET_RAW. Must be created and used on the diagnostics loop.
     """
-    if protocol.lower() == 'tcp':
-        result = run_tcp_connect_test(target, port)
-        note = "\n\nNote: Network segmentation or firewalls may cause a port to appear closed (a \"false negative\") even if the service is running."
-        return result + note
-    elif protocol.lower() == 'udp':
-        return "UDP connection test is not easily implemented with standard utilities or Python's socket library in a non-interactive way."
-    else:
-        return "Unsupported protocol."
 
-def run_tcp_connect_test(target, port):
-    """Performs a TCP connection test to a given host and port using a socket."""
-    port = int(port)
-    logging.info(f"Testing TCP connection to {target}:{port}")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(3)
+    def __init__(self, family):
+        self.family = family
+        proto = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+        try:
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+            self.raw = False
+        except OSError:
+            self.sock = socket.socket(family, socket.SOCK_RAW, proto)
+            self.raw = True
+        self.sock.setblocking(False)
+        # Replies for many hosts can arrive in bursts; a larger buffer avoids dropping them
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        except OSError:
+            pass
+        self.request_type, self.reply_type = (8, 0) if family == socket.AF_INET else (128, 129)
+        self.identifier = os.getpid() & 0xFFFF
+        self._sequence = random.randint(0, 0xFFFF)
+        self._pending = {}
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._loop.add_reader(self.sock.fileno(), self._on_readable)
+        except NotImplementedError:
+            self.sock.close()
+            raise
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            ttl = None
+            # Raw IPv4 sockets (and macOS datagram sockets) deliver the IP header as well
+            if self.family == socket.AF_INET and data and data[0] >> 4 == 4:
+                ttl = data[8]
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+            if icmp_type != self.reply_type or (self.raw and identifier != self.identifier):
+                continue
+            pending = self._pending.get(sequence)
+            if pending is None or pending[0] != ipaddress.ip_address(addr[0].split('%')[0]):
+                continue
+            _, future, sent_at = self._pending.pop(sequence)
+            if not future.done():
+                future.set_result(((time.perf_counter() - sent_at) * 1000, ttl))
+
+    async def echo(self, address, timeout):
+        """Sends one echo request. Returns (rtt_ms, ttl), or None if no reply arrived within timeout."""
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        sequence = self._sequence
+        payload = struct.pack('!d', time.time()) + bytes(48)
+        header = struct.pack('!BBHHH', self.request_type, 0, 0, self.identifier, sequence)
+        if self.family == socket.AF_INET:
+            header = struct.pack('!BBHHH', self.request_type, 0, _icmp_checksum(header + payload), self.identifier, sequence)
+
+        future = self._loop.create_future()
+        self._pending[sequence] = (ipaddress.ip_address(address), future, time.perf_counter())
+        try:
+            self.sock.sendto(header + payload, (address, 0))
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._pending.pop(sequence, None)
+
+_icmp_pingers = {}
+
+def _get_icmp_pinger(family):
+    """Returns the shared ICMPPinger for an address family, or None if ICMP sockets are unavailable here."""
+    if family not in _icmp_pingers:
+        try:
+            _icmp_pingers[family] = ICMPPinger(family)
+        except (OSError, NotImplementedError) as e:
+            logging.info(f"ICMP sockets unavailable ({e}); falling back to TCP ping")
+            _icmp_pingers[family] = None
+    return _icmp_pingers[family]
+
+async def _tcp_ping_echo(family, address, timeout):
+    """
+    One TCP "ping": a connect to the first PING_TCP_PORTS port that answers. Both an accepted
+    connection and a refusal (RST) prove the host is up. Returns (rtt_ms, None) or None.
+    """
+    for port in PING_TCP_PORTS:
+        sockaddr = (address, port, 0, 0) if family == socket.AF_INET6 else (address, port)
+        state, latency_ms, _ = await _probe_tcp_port(family, sockaddr, timeout, retries=0)
+        if state != 'filtered':
+            return latency_ms, None
+    return None
+
+async def _system_ping(address, count, host):
+    """Runs the system ping binary and parses its output into PingStats."""
+    if platform.system().lower() == "windows":
+        command = ['ping', '-n', str(count), address]
+    else:
+        command = ['ping', '-c', str(count), address]
+    output = await run_subprocess_async(command, timeout=count * (PING_TIMEOUT + PING_INTERVAL) + 1)
+    replies = [float(rtt) for rtt in re.findall(r'time[=<]([\d.]+)', output, re.IGNORECASE)]
+    ttl_match = re.search(r'ttl=(\d+)', output, re.IGNORECASE)
+    replies += [None] * max(0, count - len(replies))
+    lines = output.strip().splitlines()
+    return PingStats(host=host, address=address, method='system', replies=replies,
+                     ttl=int(ttl_match.group(1)) if ttl_match else None,
+                     error=lines[-1] if lines and not any(r is not None for r in replies) else None)
+
+async def ping_address_async(address, count=4, host=None, timeout=None, interval=None):
+    """
+    Pings an IP address in-process and returns PingStats. Echo requests for the same address are
+    spaced by `interval`; calls for different addresses run concurrently and share one ICMP socket.
+    The engine is chosen by PING_ENGINE: 'auto' (ICMP, then TCP), 'icmp', 'tcp' or 'system'.
+    """
+    timeout = PING_TIMEOUT if timeout is None else timeout
+    interval = PING_INTERVAL if interval is None else interval
+    host = host or address
+    if PING_ENGINE == 'system':
+        return await _system_ping(address, count, host)
+
+    family = socket.AF_INET6 if ipaddress.ip_address(address).version == 6 else socket.AF_INET
+    pinger = _get_icmp_pinger(family) if PING_ENGINE in ('auto', 'icmp') else None
+    if pinger is None and PING_ENGINE == 'icmp':
+        return PingStats(host=host, address=address, method='icmp', error="ICMP sockets are not permitted on this host")
+
+    async def echo(delay):
+        await asyncio.sleep(delay)
+        if pinger is not None:
+            return await pinger.echo(address, timeout)
+        return await _tcp_ping_echo(family, address, timeout)
+
+    try:
+        results = await asyncio.gather(*(echo(i * interval) for i in range(count)))
+    except OSError as e:
+        return PingStats(host=host, address=address, method='icmp' if pinger else 'tcp', error=str(e))
+    ttls = [result[1] for result in results if result is not None and result[1] is not None]
+    return PingStats(host=host, address=address, method='icmp' if pinger else 'tcp',
+                     replies=[round(result[0], 3) if result is not None else None for result in results],
+                     ttl=ttls[-1] if ttls else None)
+
+async def ping_host_async(target, count=4, dns_server=None):
+    """
+    Resolves target if it is a hostname, then pings the first address.
+    Returns (PingStats or None, notes) where notes holds any resolution messages.
+    """
+    if is_ip_address(target):
+        return await ping_address_async(target, count=count), ""
+
+    addresses, notes, _, _, _ = await _resolve_hostname_with_fallback_async(target, dns_server or DNS_SERVERS[0])
+    if not addresses:
+        return None, f"{notes}\nCould not resolve '{target}' to an IP address to ping."
+    resolution_notes = (notes + "\n" if notes else "") + f"Pinging resolved IP: {addresses[0]}\n\n"
+    return await ping_address_async(addresses[0], count=count, host=target), resolution_notes
+
+@instrument_tool('ping')
+async def ping_result_async(target, count=4):
+    """
+    Pings a target with the in-process ping engine and returns a PingResult. If the target is a
+    hostname, it first resolves it and then pings the resulting IP.
+    """
+    try:
+        logging.info(f"Running ping for {target}")
+        if not target or not is_valid_target(target):
+            return PingResult(target=target, error="Invalid input.")
+
+        stats, notes = await ping_host_async(target, count=count)
+        return PingResult(target=target, stats=stats, notes=notes)
+
+    except Exception as e:
+        return PingResult(target=target, error=f"An error occurred in ping: {str(e)}")
+
+def format_ping_result(result):
+    """Formats a PingResult: resolution notes followed by the ping statistics."""
+    if result.error:
+        return result.error
+    if result.stats is None:
+        return result.notes
+    return result.notes + format_ping_stats(result.stats)
+
+async def run_ping_async(target, count=4):
+    """Pings a target and returns the formatted text output."""
+    return format_ping_result(await ping_result_async(target, count=count))
+
+def run_ping(target, count=4):
+    """Synchronous wrapper around run_ping_async()."""
+    return run_async(run_ping_async(target, count=count))
+
+def _dig_records(section):
+    """Flattens a message section into record dicts (name, ttl, class, type, data)."""
+    records = []
+    for rrset in section:
+        for rdata in rrset:
+            records.append({
+                'name': rrset.name.to_text(),
+                'ttl': rrset.ttl,
+                'class': dns.rdataclass.to_text(rrset.rdclass),
+                'type': dns.rdatatype.to_text(rrset.rdtype),
+                'data': rdata.to_text()
+            })
+    return records
+
+def _dig_message(response, server, protocol, query_time_ms, server_name=None, port=53):
+    """Converts a dnspython response into a DigMessage."""
+    return DigMessage(
+        server=server,
+        port=port,
+        server_name=server_name,
+        protocol=protocol,
+        id=response.id,
+        opcode=dns.opcode.to_text(response.opcode()),
+        status=dns.rcode.to_text(response.rcode()),
+        flags=dns.flags.to_text(response.flags).lower().split(),
+        question=[{'name': rrset.name.to_text(), 'class': dns.rdataclass.to_text(rrset.rdclass),
+                   'type': dns.rdatatype.to_text(rrset.rdtype)} for rrset in response.question],
+        answer=_dig_records(response.answer),
+        authority=_dig_records(response.authority),
+        additional=_dig_records(response.additional),
+        edns={'version': response.edns, 'udp_size': response.payload,
+              'do': bool(response.ednsflags & dns.flags.DO)} if response.edns >= 0 else None,
+        query_time_ms=round(query_time_ms, 3),
+        msg_size=len(response.to_wire())
+    )
+
+async def _dig_exchange(qname, rdtype, server, recurse=True, dnssec=False, cd=False, tcp=False, bufsize=None,
+                        timeout=DIG_TIMEOUT, server_name=None, port=53):
+    """
+    Sends one query to server over UDP (retrying over TCP when the answer is truncated, like dig)
+    or TCP. Returns a DigMessage.
+    """
+    query = dns.message.make_query(qname, rdtype, use_edns=0, want_dnssec=dnssec, payload=bufsize or DIG_DEFAULT_BUFSIZE)
+    if not recurse:
+        query.flags &= ~dns.flags.RD
+    if cd:
+        query.flags |= dns.flags.CD
+
+    started = time.perf_counter()
     try:
-        result = s.connect_ex((target, port))
-        if result == 0:
-            return f"TCP Connection to {target}:{port} is OPEN."
+        if tcp:
+            response = await dns.asyncquery.tcp(query, server, timeout=timeout, port=port)
         else:
-            return f"TCP Connection to {target}:{port} is CLOSED or filtered. Error code: {result}"
+            response = await dns.asyncquery.udp(query, server, timeout=timeout, port=port, ignore_trailing=True)
+            if response.flags & dns.flags.TC:
+                tcp = True
+                response = await dns.asyncquery.tcp(query, server, timeout=timeout, port=port)
+    except (dns.exception.DNSException, OSError) as e:
+        observe_dns_query(server, started, _dns_outcome(e))
+        raise
+    observe_dns_query(server, started, 'ok')
+    return _dig_message(response, server, 'TCP' if tcp else 'UDP', (time.perf_counter() - started) * 1000,
+                        server_name, port)
+
+async def _dig_trace(qname, rdtype, dns_server, dnssec, cd, tcp, bufsize):
+    """
+    Iterative resolution in the style of dig +trace: fetches the root servers from `server`, then
+    follows referrals with non-recursive queries until an answer (or error) is returned.
+    Nameserver names without glue are resolved through `dns_server`.
+    """
+    server, port = await RESOLVERS.nameserver_address(dns_server)
+    hops = [await _dig_exchange('.', dns.rdatatype.NS, server, dnssec=dnssec, cd=cd, tcp=tcp, bufsize=bufsize, port=port)]
+    nameservers = [r['data'] for r in hops[0].answer if r['type'] == 'NS']
+    glue = {}
+    resolver = await RESOLVERS.get(dns_server)
+
+    for _ in range(DIG_TRACE_MAX_STEPS):
+        response = None
+        for ns_name in random.sample(nameservers, len(nameservers)):
+            try:
+                if ns_name in glue:
+                    address = glue[ns_name]
+                else:
+                    address = str((await resolve_cached(resolver, ns_name, 'A', lifetime=DIG_TIMEOUT))[0])
+                response = await _dig_exchange(qname, rdtype, address, recurse=False, dnssec=dnssec, cd=cd, tcp=tcp,
+                                               bufsize=bufsize, server_name=ns_name.rstrip('.'))
+                break
+            except (dns.exception.DNSException, OSError) as e:
+                logging.info(f"dig +trace: nameserver {ns_name} failed: {e}")
+        if response is None:
+            raise dns.exception.Timeout()
+        hops.append(response)
+
+        referral = [r['data'] for r in response.authority if r['type'] == 'NS']
+        if response.answer or response.status != 'NOERROR' or not referral:
+            break
+        nameservers = referral
+        glue = {r['name']: r['data'] for r in response.additional if r['type'] == 'A'}
+    return hops
+
+@instrument_tool('dig')
+async def dig_result_async(target, dig_type='A', dns_server=None, dnssec=False, cd=False, trace=False, tcp=False, bufsize=None):
+    """
+    In-process dig built on dnspython. Supports every record type, +dnssec/+cd, +trace style
+    iterative resolution, TCP or UDP transport and the EDNS buffer size. PTR queries for an IP
+    target are sent for its reverse name. Returns a DigResult.
+    """
+    options = {'dnssec': dnssec, 'cd': cd, 'trace': trace, 'tcp': tcp, 'bufsize': bufsize or DIG_DEFAULT_BUFSIZE}
+    result = DigResult(target=target, record_type=dig_type, dns_server=dns_server, options=options,
+                       when=datetime.datetime.utcnow().isoformat() + 'Z')
+    try:
+        logging.info(f"Running dig for {target}, type {dig_type}, server {dns_server}")
+        if not target or not is_valid_target(target):
+            result.error = "Invalid input."
+            return result
+
+        rdtype = dns.rdatatype.from_text(dig_type)
+        qname = target
+        if rdtype == dns.rdatatype.PTR and is_ip_address(target):
+            qname = ipaddress.ip_address(target).reverse_pointer
+
+        if trace:
+            result.trace = await _dig_trace(qname, rdtype, dns_server, dnssec, cd, tcp, bufsize)
+        else:
+            server, port = await RESOLVERS.nameserver_address(dns_server)
+            result.response = await _dig_exchange(qname, rdtype, server, dnssec=dnssec, cd=cd, tcp=tcp, bufsize=bufsize,
+                                                  port=port)
+        return result
+
+    except dns.rdatatype.UnknownRdatatype:
+        result.error = f"Unsupported record type '{dig_type}'"
+    except dns.exception.Timeout:
+        result.error = ";; connection timed out; no servers could be reached"
     except socket.gaierror:
-        return f"Hostname {target} could not be resolved."
-    except socket.error as e:
-        return f"An error occurred during TCP connection test: {e}"
+        result.error = f"Error: Could not resolve DNS server hostname '{dns_server}'"
+    except Exception as e:
+        result.error = f"An error occurred in dig: {str(e)}"
+    return result
+
+def _format_dig_record(record):
+    return f"{record['name']:<24}{record['ttl']:<8}{record['class']:<4}{record['type']:<8}{record['data']}"
+
+def format_dig_result(result):
+    """Formats a DigResult like the output of the dig utility."""
+    if result.error:
+        return result.error
+    flags = [name for name in ('dnssec', 'cd', 'trace', 'tcp') if result.options.get(name)]
+    command = f"{result.target} {result.record_type}"
+    if result.dns_server and result.dns_server != 'System Default':
+        command += f" @{result.dns_server}"
+    if flags:
+        command += " " + " ".join(f"+{name}" for name in flags)
+    lines = [f"; <<>> DiG (dnspython {dns.version.version}) <<>> {command}", ";; global options: +cmd"]
+
+    if result.trace:
+        for hop in result.trace:
+            lines.extend(_format_dig_record(r) for r in hop.answer + hop.authority)
+            lines.append(f";; Received {hop.msg_size} bytes from {hop.server}#{hop.port}({hop.server_name or hop.server}) "
+                         f"in {hop.query_time_ms:.0f} ms")
+            lines.append("")
+        return "\n".join(lines)
+
+    response = result.response
+    lines.append(";; Got answer:")
+    lines.append(f";; ->>HEADER<<- opcode: {response.opcode}, status: {response.status}, id: {response.id}")
+    lines.append(f";; flags: {' '.join(response.flags)}; QUERY: {len(response.question)}, ANSWER: {len(response.answer)}, "
+                 f"AUTHORITY: {len(response.authority)}, ADDITIONAL: {len(response.additional) + (1 if response.edns else 0)}")
+    if response.edns:
+        lines.append("")
+        lines.append(";; OPT PSEUDOSECTION:")
+        lines.append(f"; EDNS: version: {response.edns['version']}, flags:{' do' if response.edns['do'] else ''}; "
+                     f"udp: {response.edns['udp_size']}")
+    lines.append(";; QUESTION SECTION:")
+    lines.extend(f";{q['name']:<31}{q['class']:<4}{q['type']}" for q in response.question)
+    for title, records in (('ANSWER', response.answer), ('AUTHORITY', response.authority), ('ADDITIONAL', response.additional)):
+        if records:
+            lines.append("")
+            lines.append(f";; {title} SECTION:")
+            lines.extend(_format_dig_record(r) for r in records)
+    lines.append("")
+    lines.append(f";; Query time: {response.query_time_ms:.0f} msec")
+    lines.append(f";; SERVER: {response.server}#{response.port}({response.server}) ({response.protocol})")
+    lines.append(f";; WHEN: {result.when}")
+    lines.append(f";; MSG SIZE  rcvd: {response.msg_size}")
+    return "\n".join(lines)
+
+async def run_dig_async(target, dig_type='A', dns_server=None, dnssec=False, cd=False, trace=False, tcp=False, bufsize=None):
+    """Runs a dig query and returns the formatted text output."""
+    return format_dig_result(await dig_result_async(target, dig_type=dig_type, dns_server=dns_server, dnssec=dnssec,
+                                                    cd=cd, trace=trace, tcp=tcp, bufsize=bufsize))
+
+def run_dig(target, dig_type='A', dns_server=None, dnssec=False, cd=False, trace=False, tcp=False, bufsize=None):
+    """Synchronous wrapper around run_dig_async()."""
+    return run_async(run_dig_async(target, dig_type=dig_type, dns_server=dns_server, dnssec=dnssec, cd=cd,
+                                   trace=trace, tcp=tcp, bufsize=bufsize))
+
+class DNSQueryMultiplexer:
+    """
+    Sends DNS queries to any number of servers over one UDP socket per address family and
+    matches responses by server address and message ID. Used by the resolver comparison so a
+    fan-out to N servers costs one socket instead of N. Must be created and used on the
+    diagnostics loop.
+    """
+
+    def __init__(self, family):
+        self.family = family
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(('::' if family == socket.AF_INET6 else '0.0.0.0', 0))
+        # Answers from many resolvers arrive in bursts; a larger buffer avoids dropping them
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        except OSError:
+            pass
+        self._pending = {}
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if len(data) < 2:
+                continue
+            key = (int.from_bytes(data[:2], 'big'), ipaddress.ip_address(addr[0].split('%')[0]))
+            pending = self._pending.get(key)
+            if pending is None:
+                continue
+            query, future = pending
+            try:
+                response = dns.message.from_wire(data, ignore_trailing=True)
+            except dns.exception.DNSException:
+                continue
+            if query.is_response(response) and not future.done():
+                future.set_result(response)
+
+    async def query(self, query, server, timeout, port=53):
+        """Sends query to server and returns the response message. Raises dns.exception.Timeout."""
+        server_ip = ipaddress.ip_address(server)
+        while (query.id, server_ip) in self._pending:
+            query.id = random.randint(0, 0xFFFF)
+        key = (query.id, server_ip)
+        future = self._loop.create_future()
+        self._pending[key] = (query, future)
+        try:
+            self.sock.sendto(query.to_wire(), (server, port))
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+        finally:
+            self._pending.pop(key, None)
+
+_dns_multiplexers = {}
+
+def _get_dns_multiplexer(family):
+    """Returns the shared DNSQueryMultiplexer for an address family, creating it on first use."""
+    if family not in _dns_multiplexers:
+        _dns_multiplexers[family] = DNSQueryMultiplexer(family)
+    return _dns_multiplexers[family]
+
+async def _compare_query(qname, rdtype, server, timeout):
+    """Queries one resolver for the comparison. Returns a ResolverAnswer; never raises."""
+    answer = ResolverAnswer(server=server)
+    started = time.perf_counter()
+    try:
+        address, port = await RESOLVERS.nameserver_address(server)
+        family = socket.AF_INET6 if ipaddress.ip_address(address).version == 6 else socket.AF_INET
+        query = dns.message.make_query(qname, rdtype, use_edns=0, payload=DIG_DEFAULT_BUFSIZE)
+        response = await _get_dns_multiplexer(family).query(query, address, timeout, port=port)
+        if response.flags & dns.flags.TC:
+            response = await dns.asyncquery.tcp(query, address, timeout=timeout, port=port)
+        answer.latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        observe_dns_query(address, started, 'ok')
+        answer.status = dns.rcode.to_text(response.rcode())
+        rrsets = [rrset for rrset in response.answer if rrset.rdtype == rdtype]
+        answer.answers = sorted(rdata.to_text() for rrset in rrsets for rdata in rrset)
+        answer.ttl = min(rrset.ttl for rrset in rrsets) if rrsets else None
+    except dns.exception.Timeout:
+        answer.status, answer.error = 'TIMEOUT', f"No response within {timeout}s"
+        observe_dns_query(address, started, 'timeout')
+    except socket.gaierror:
+        answer.status, answer.error = 'ERROR', f"Could not resolve DNS server hostname '{server}'"
+    except (dns.exception.DNSException, OSError, ValueError) as e:
+        answer.status, answer.error = 'ERROR', str(e)
+    return answer
+
+@instrument_tool('compare')
+async def compare_resolvers_async(target, record_type='A', servers=None, timeout=None):
+    """
+    Queries the same name and record type against every resolver in `servers` (default: DNS_SERVERS)
+    at once, sharing one UDP socket per address family. The comparison takes about as long as the
+    slowest resolver. Returns a ResolverComparison with per-resolver answers, TTL and latency, and
+    consistency flags: resolvers agree when they return the same status and answer set.
+    """
+    timeout = DIG_TIMEOUT if timeout is None else float(timeout)
+    servers = list(dict.fromkeys(servers or DNS_SERVERS))
+    comparison = ResolverComparison(target=target, record_type=record_type, servers=servers)
+    if not target or not is_valid_target(target):
+        comparison.error = "Invalid input."
+        return comparison
+    try:
+        rdtype = dns.rdatatype.from_text(record_type)
+    except dns.exception.DNSException:
+        comparison.error = f"Unsupported record type '{record_type}'"
+        return comparison
+    qname = ipaddress.ip_address(target).reverse_pointer if rdtype == dns.rdatatype.PTR and is_ip_address(target) else target
+
+    logging.info(f"Comparing {target} {record_type} across {len(servers)} resolvers")
+    started = time.perf_counter()
+    comparison.results = list(await asyncio.gather(*(_compare_query(qname, rdtype, server, timeout) for server in servers)))
+    comparison.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    groups = {}
+    for answer in comparison.results:
+        if answer.status in ('TIMEOUT', 'ERROR'):
+            continue
+        groups.setdefault((answer.status, tuple(answer.answers)), []).append(answer.server)
+    comparison.groups = [{'status': status, 'answers': list(answers), 'servers': members}
+                         for (status, answers), members in sorted(groups.items(), key=lambda item: -len(item[1]))]
+    majority = comparison.groups[0] if comparison.groups else None
+    for answer in comparison.results:
+        answer.matches_majority = majority is not None and answer.server in majority['servers']
+
+    ttls = [answer.ttl for answer in comparison.results if answer.ttl is not None]
+    comparison.all_responded = all(answer.status not in ('TIMEOUT', 'ERROR') for answer in comparison.results)
+    comparison.consistent = comparison.all_responded and len(comparison.groups) == 1
+    comparison.ttl_min = min(ttls) if ttls else None
+    comparison.ttl_max = max(ttls) if ttls else None
+    return comparison
+
+def format_resolver_comparison(comparison):
+    """Formats a ResolverComparison as a per-resolver table followed by the consistency verdict."""
+    if comparison.error:
+        return comparison.error
+    lines = [f"DNS comparison for {comparison.target} {comparison.record_type} across {len(comparison.results)} "
+             f"resolver(s) ({comparison.elapsed_ms / 1000:.2f}s)", ""]
+    lines.append(f"{'Resolver':<24}{'Status':<10}{'Latency':<12}{'TTL':<8}Answers")
+    for answer in comparison.results:
+        latency = f"{answer.latency_ms} ms" if answer.latency_ms is not None else "-"
+        ttl = str(answer.ttl) if answer.ttl is not None else "-"
+        marker = "" if answer.matches_majority or answer.error else "  (differs)"
+        values = ", ".join(answer.answers) or answer.error or "-"
+        lines.append(f"{answer.server:<24}{answer.status:<10}{latency:<12}{ttl:<8}{values}{marker}")
+    lines.append("")
+    if comparison.consistent:
+        lines.append("Result: CONSISTENT - all resolvers returned the same answer.")
+    else:
+        silent = sum(1 for answer in comparison.results if answer.error)
+        verdict = f"Result: INCONSISTENT - {len(comparison.groups)} distinct answer(s)"
+        if silent:
+            verdict += f", {silent} resolver(s) did not respond"
+        lines.append(verdict + ".")
+    if comparison.ttl_min is not None and comparison.ttl_min != comparison.ttl_max:
+        lines.append(f"TTLs range from {comparison.ttl_min}s to {comparison.ttl_max}s (cached copies of differing age).")
+    return "\n".join(lines)
+
+async def run_dns_compare_async(target, record_type='A', servers=None):
+    """Compares resolvers and returns the formatted text output."""
+    return format_resolver_comparison(await compare_resolvers_async(target, record_type, servers))
+
+def run_dns_compare(target, record_type='A', servers=None):
+    """Synchronous wrapper around run_dns_compare_async()."""
+    return run_async(run_dns_compare_async(target, record_type, servers))
+
+# Not exported by the socket module; values from <linux/in.h> and <linux/in6.h>
+_IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+_IPV6_RECVERR = getattr(socket, 'IPV6_RECVERR', 25)
+_SO_EE_ORIGIN_ICMP, _SO_EE_ORIGIN_ICMP6 = 2, 3
+
+class TracerouteProber:
+    """
+    Sends UDP traceroute probes for any number of traces over one socket and matches the ICMP
+    time-exceeded and unreachable replies by destination address and port. Replies are read from
+    the socket error queue (IP_RECVERR), so no raw socket or root is needed; Linux only.
+    Must be created and used on the diagnostics loop.
+    """
+
+    BASE_PORT = 33434
+
+    def __init__(self, family):
+        if not sys.platform.startswith('linux'):
+            raise OSError("socket error queues are only available on Linux")
+        self.family = family
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_IP, _IP_RECVERR, 1)
+            self._ttl_option = (socket.IPPROTO_IP, socket.IP_TTL)
+        else:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, _IPV6_RECVERR, 1)
+            self._ttl_option = (socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        except OSError:
+            pass
+        self._next_port = 0
+        self._pending = {}
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._loop.add_reader(self.sock.fileno(), self._on_readable)
+        except NotImplementedError:
+            self.sock.close()
+            raise
+
+    def _on_readable(self):
+        while True:
+            try:
+                _, ancdata, _, addr = self.sock.recvmsg(512, 512, socket.MSG_ERRQUEUE)
+            except OSError:
+                break
+            for level, kind, data in ancdata:
+                if (level, kind) not in ((socket.IPPROTO_IP, _IP_RECVERR), (socket.IPPROTO_IPV6, _IPV6_RECVERR)) or len(data) < 16:
+                    continue
+                # struct sock_extended_err, followed by the address of the router that sent the ICMP error
+                _, origin, icmp_type, _, _, _, _ = struct.unpack('=IBBBBII', data[:16])
+                if origin == _SO_EE_ORIGIN_ICMP:
+                    responder = socket.inet_ntop(socket.AF_INET, data[20:24])
+                    unreachable = icmp_type == 3
+                elif origin == _SO_EE_ORIGIN_ICMP6:
+                    responder = socket.inet_ntop(socket.AF_INET6, data[24:40])
+                    unreachable = icmp_type == 1
+                else:
+                    continue
+                pending = self._pending.pop((ipaddress.ip_address(addr[0].split('%')[0]), addr[1]), None)
+                if pending is not None and not pending[0].done():
+                    pending[0].set_result((responder, (time.perf_counter() - pending[1]) * 1000, unreachable))
+        # Discard anything a destination actually answered with
+        while True:
+            try:
+                self.sock.recv(2048)
+            except OSError:
+                return
+
+    def _allocate_port(self, address):
+        for _ in range(65536 - self.BASE_PORT):
+            port = self.BASE_PORT + self._next_port
+            self._next_port = (self._next_port + 1) % (65536 - self.BASE_PORT)
+            if (address, port) not in self._pending:
+                return port
+        raise OSError("too many traceroute probes in flight")
+
+    async def probe(self, address, ttl, timeout):
+        """
+        Sends one probe with the given TTL. Returns (responder, rtt_ms, unreachable), where unreachable
+        means the path ends at responder, or None if nothing answered within timeout.
+        """
+        key_address = ipaddress.ip_address(address)
+        port = self._allocate_port(key_address)
+        future = self._loop.create_future()
+        self._pending[(key_address, port)] = (future, time.perf_counter())
+        try:
+            self.sock.setsockopt(*self._ttl_option, ttl)
+            try:
+                self.sock.sendto(b'network-diagnostics', (address, port))
+            except OSError:
+                # An earlier ICMP error can be reported on the next send; clear it and retry once
+                self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                self.sock.sendto(b'network-diagnostics', (address, port))
+            return await asyncio.wait_for(future, timeout=timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self._pending.pop((key_address, port), None)
+
+_traceroute_probers = {}
+
+def _get_traceroute_prober(family):
+    """Returns the shared TracerouteProber for an address family, or None if it cannot be used here."""
+    if family not in _traceroute_probers:
+        try:
+            _traceroute_probers[family] = TracerouteProber(family)
+        except (OSError, NotImplementedError) as e:
+            logging.info(f"In-process traceroute unavailable ({e}); falling back to the system binary")
+            _traceroute_probers[family] = None
+    return _traceroute_probers[family]
+
+async def _hop_name(address):
+    """Returns the PTR name of a hop address, or None. Bounded by TRACEROUTE_TIMEOUT so names never stall a trace."""
+    try:
+        answer = await resolve_cached(RESOLVERS.system_resolver(), ipaddress.ip_address(address).reverse_pointer,
+                                      'PTR', lifetime=TRACEROUTE_TIMEOUT)
+        for ptr in answer:
+            return str(ptr.target).rstrip('.')
+    except Exception:
+        pass
+    return None
+
+async def _udp_trace_hops(result, timeout, names=True):
+    """
+    Probes every TTL up to result.max_hops at once and yields TracerouteHops as they complete.
+    The hop that ends the path is held back until all lower hops are known, and hops beyond
+    it are dropped, so the last hop yielded is always the destination (or the last router).
+    """
+    prober = _get_traceroute_prober(socket.AF_INET6 if ':' in result.address else socket.AF_INET)
+
+    async def trace_hop(ttl):
+        async def send(probe):
+            await asyncio.sleep(probe * TRACEROUTE_PROBE_INTERVAL)
+            return await prober.probe(result.address, ttl, timeout)
+
+        replies = await asyncio.gather(*(send(probe) for probe in range(result.probes)))
+        hop = TracerouteHop(ttl=ttl, rtts=[round(reply[1], 3) if reply else None for reply in replies])
+        answered = [reply for reply in replies if reply]
+        if answered:
+            hop.address = answered[0][0]
+            hop.reached = ipaddress.ip_address(hop.address) == ipaddress.ip_address(result.address)
+            hop.name = await _hop_name(hop.address) if names else None
+        return hop, any(reply[2] for reply in answered)
+
+    tasks = {asyncio.ensure_future(trace_hop(ttl)): ttl for ttl in range(1, result.max_hops + 1)}
+    end_hop = None
+    silent = []
+    last_answered = 0
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                ttl = tasks.pop(task, None)
+                if ttl is None or task.cancelled():
+                    continue
+                hop, terminal = task.result()
+                if end_hop is not None and ttl > end_hop.ttl:
+                    continue
+                if terminal or hop.reached:
+                    end_hop = hop
+                    for other, other_ttl in list(tasks.items()):
+                        if other_ttl > ttl:
+                            other.cancel()
+                            del tasks[other]
+                elif hop.address is None:
+                    # Silent hops finish last; only those below an answering hop are worth reporting
+                    silent.append(hop)
+                else:
+                    last_answered = max(last_answered, ttl)
+                    yield hop
+        if end_hop is not None:
+            last_answered = end_hop.ttl
+        for hop in sorted(silent, key=lambda hop: hop.ttl):
+            if hop.ttl < last_answered:
+                yield hop
+        if end_hop is not None:
+            yield end_hop
     finally:
-        s.close()
+        for task in tasks:
+            task.cancel()
 
-def run_subprocess(command, timeout=10):
+_TRACEROUTE_LINE = re.compile(r'^\s*(\d+)\s+(.*)$')
+_TRACEROUTE_RTT = re.compile(r'(\*|<?([\d.]+)\s*ms)')
+_TRACEROUTE_ADDRESS = re.compile(r'\b(\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F]{0,4}(?::[0-9a-fA-F]{0,4}){2,7})\b')
+
+async def _system_trace_hops(result, timeout, names=True):
+    """Runs the system traceroute/tracert binary and yields a TracerouteHop for each hop line as it is printed."""
+    if platform.system().lower() == "windows":
+        command = ['tracert', '-d', '-h', str(result.max_hops), '-w', str(int(timeout * 1000)), result.address]
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+    else:
+        command = ['traceroute', '-n', '-m', str(result.max_hops), '-q', str(result.probes), '-w', str(timeout), result.address]
+        startupinfo = None
+    try:
+        SUBPROCESS_SPAWNS.inc((command[0],))
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT, startupinfo=startupinfo)
+    except FileNotFoundError:
+        result.error = f"Error: Command '{command[0]}' not found on the system."
+        return
+
+    deadline = time.monotonic() + result.max_hops * result.probes * timeout + 5
+    other_lines = []
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                result.error = "Traceroute timed out."
+                break
+            if not line:
+                break
+            line = line.decode(errors='replace').rstrip()
+            match = _TRACEROUTE_LINE.match(line)
+            if not match:
+                other_lines.append(line)
+                continue
+            rtts = [float(rtt) if rtt else None for _, rtt in _TRACEROUTE_RTT.findall(match.group(2))]
+            address = _TRACEROUTE_ADDRESS.search(match.group(2))
+            hop = TracerouteHop(ttl=int(match.group(1)), rtts=rtts)
+            if address and is_ip_address(address.group(1)):
+                hop.address = address.group(1)
+                hop.reached = ipaddress.ip_address(hop.address) == ipaddress.ip_address(result.address)
+                hop.name = await _hop_name(hop.address) if names else None
+            yield hop
+    finally:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        await process.wait()
+    if process.returncode not in (0, None) and not result.hops and not result.error:
+        logging.warning(f"Traceroute failed: {' '.join(other_lines)}")
+        result.error = "Command failed:\n" + "\n".join(other_lines).strip()
+
+async def _prepare_traceroute(target, max_hops=None, probes=None):
+    """Validates and resolves a traceroute target and picks the engine. Returns a TracerouteResult to trace into."""
+    result = TracerouteResult(target=target, max_hops=max_hops or TRACEROUTE_MAX_HOPS, probes=probes or TRACEROUTE_PROBES)
+    if not target or not is_valid_target(target):
+        result.error = "Invalid input."
+        return result
+    try:
+        family, result.address = await _resolve_scan_host(target)
+    except (OSError, UnicodeError):
+        result.error = f"Could not resolve {target}."
+        return result
+
+    if TRACEROUTE_ENGINE in ('auto', 'udp') and _get_traceroute_prober(family) is not None:
+        result.engine = 'udp'
+    elif TRACEROUTE_ENGINE == 'udp':
+        result.error = "In-process traceroute probes are not supported on this host."
+    else:
+        result.engine = 'system'
+    return result
+
+async def _trace_into(result, timeout=None, names=True):
+    """
+    Runs a prepared traceroute, appending hops to result as they are discovered and yielding each one.
+    names=False skips the reverse lookups of hop addresses.
+    """
+    timeout = TRACEROUTE_TIMEOUT if timeout is None else timeout
+    started = time.perf_counter()
+    trace_hops = _udp_trace_hops if result.engine == 'udp' else _system_trace_hops
+    hops = trace_hops(result, timeout, names)
+    try:
+        async for hop in hops:
+            result.hops.append(hop)
+            yield hop
+    finally:
+        await hops.aclose()
+    result.hops.sort(key=lambda hop: hop.ttl)
+    while len(result.hops) > 1 and result.hops[-1].address is None:
+        result.hops.pop()
+    result.reached = any(hop.reached for hop in result.hops)
+    result.elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+
+@instrument_tool('traceroute')
+async def traceroute_events_async(target, max_hops=None, probes=None, timeout=None):
+    """
+    Runs a traceroute and yields its progress as dicts: a 'start' event, a 'hop' event for each hop
+    as soon as it is discovered (in discovery order, not TTL order), and a final 'done' event holding
+    the complete TracerouteResult, or an 'error' event.
+    """
+    logging.info(f"Running traceroute for {target}")
+    result = await _prepare_traceroute(target, max_hops, probes)
+    if result.error:
+        yield {"event": "error", "target": target, "error": result.error}
+        return
+    yield {"event": "start", "target": target, "address": result.address, "engine": result.engine,
+           "max_hops": result.max_hops, "probes": result.probes}
+    try:
+        async for hop in _trace_into(result, timeout):
+            yield {"event": "hop", **hop.to_dict()}
+    except Exception as e:
+        logging.exception(f"Traceroute for {target} failed")
+        result.error = f"An error occurred in traceroute: {str(e)}"
+    yield {"event": "error" if result.error else "done", **result.to_dict()}
+
+@instrument_tool('traceroute')
+async def traceroute_result_async(target, max_hops=None, probes=None, timeout=None):
+    """
+    Traces the path to target, probing all hops at once with the in-process UDP prober where the
+    platform allows it, otherwise with the 'traceroute' or 'tracert' utility. Returns a TracerouteResult.
+    """
+    try:
+        logging.info(f"Running traceroute for {target}")
+        result = await _prepare_traceroute(target, max_hops, probes)
+        if not result.error:
+            async for _ in _trace_into(result, timeout):
+                pass
+        return result
+
+    except Exception as e:
+        return TracerouteResult(target=target, error=f"An error occurred in traceroute: {str(e)}")
+
+def format_traceroute_hop(hop):
+    """Formats one hop the way traceroute prints it."""
+    if hop.address is None:
+        return f"{hop.ttl:>2}  " + " ".join("*" for _ in hop.rtts)
+    rtts = "  ".join(f"{rtt:.3f} ms" if rtt is not None else "*" for rtt in hop.rtts)
+    return f"{hop.ttl:>2}  {hop.name or hop.address} ({hop.address})  {rtts}"
+
+def format_traceroute_result(result):
+    """Formats a TracerouteResult, prefixed with a note about where the trace originates."""
+    if result.error:
+        return result.error
+    note = "Note: This traceroute originates from the application server.\nThe network path shown may differ from the path taken from your local machine or other locations.\n\n"
+    lines = [f"traceroute to {result.target} ({result.address}), {result.max_hops} hops max, {result.probes} probes per hop"]
+    lines.extend(format_traceroute_hop(hop) for hop in result.hops)
+    lines.append("")
+    if result.reached:
+        lines.append(f"Destination reached in {len(result.hops)} hop(s); traced in {result.elapsed_ms / 1000:.2f}s ({result.engine} engine).")
+    else:
+        lines.append(f"Destination not reached within {result.max_hops} hops; traced in {result.elapsed_ms / 1000:.2f}s ({result.engine} engine).")
+    return note + "\n".join(lines)
+
+async def run_traceroute_async(target):
+    """Runs a traceroute and returns the formatted text output."""
+    return format_traceroute_result(await traceroute_result_async(target))
+
+def run_traceroute(target):
+    """Synchronous wrapper around run_traceroute_async()."""
+    return run_async(run_traceroute_async(target))
+
+@instrument_tool('netconnection')
+async def netconnection_result_async(target, port, protocol='tcp', scan=False, timeout=None, retries=None, parallelism=None):
+    """
+    Simulates a port check, similar to Test-NetConnection or nc, and returns a PortTestResult.
+    Currently only supports TCP. In scan mode, target may be a comma-separated host list
+    and port a port specification such as "22,80,8000-8100".
+    """
+    protocol = protocol.lower()
+    if protocol == 'tcp':
+        if not scan:
+            return await tcp_connect_result_async(target, port)
+        try:
+            scan_result = await scan_tcp_ports_async(parse_host_list(target), parse_port_spec(port),
+                                                     timeout=timeout, retries=retries, parallelism=parallelism)
+        except ValueError as e:
+            return PortTestResult(target=target, port=str(port), protocol=protocol, error=f"Error: {e}")
+        return PortTestResult(target=target, port=str(port), protocol=protocol, scan=scan_result)
+    elif protocol == 'udp':
+        return PortTestResult(target=target, port=str(port), protocol=protocol,
+                              error="UDP connection test is not easily implemented with standard utilities or Python's socket library in a non-interactive way.")
+    else:
+        return PortTestResult(target=target, port=str(port), protocol=protocol, error="Unsupported protocol.")
+
+def format_port_test(result):
+    """Formats a single-port PortTestResult as a one-line verdict."""
+    if result.error:
+        return result.error
+    if result.state == 'open':
+        return f"TCP Connection to {result.target}:{result.port} is OPEN."
+    if result.state == 'unresolved':
+        return f"Hostname {result.target} could not be resolved."
+    return f"TCP Connection to {result.target}:{result.port} is CLOSED or filtered. Error code: {result.error_code}"
+
+def format_netconnection_result(result):
+    """Formats a PortTestResult (single port or scan) with the firewall caveat appended."""
+    if result.state is None and result.scan is None:
+        return result.error
+    text = format_port_scan(result.scan) if result.scan is not None else format_port_test(result)
+    note = "\n\nNote: Network segmentation or firewalls may cause a port to appear closed (a \"false negative\") even if the service is running."
+    return text + note
+
+async def run_test_netconnection_async(target, port, protocol='tcp', scan=False, timeout=None, retries=None, parallelism=None):
+    """Runs a port test or scan and returns the formatted text output."""
+    return format_netconnection_result(await netconnection_result_async(target, port, protocol, scan=scan, timeout=timeout,
+                                                                        retries=retries, parallelism=parallelism))
+
+def run_test_netconnection(target, port, protocol='tcp', scan=False, timeout=None, retries=None, parallelism=None):
+    """Synchronous wrapper around run_test_netconnection_async()."""
+    return run_async(run_test_netconnection_async(target, port, protocol, scan=scan, timeout=timeout,
+                                                  retries=retries, parallelism=parallelism))
+
+@instrument_tool('tcp_connect')
+async def tcp_connect_result_async(target, port):
+    """Performs a TCP connection test to a given host and port using an asyncio socket. Returns a PortTestResult."""
+    logging.info(f"Testing TCP connection to {target}:{port}")
+    result = PortTestResult(target=target, port=str(port), protocol='tcp')
+    writer = None
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(target, int(port)), timeout=3)
+        result.state = 'open'
+    except socket.gaierror:
+        result.state = 'unresolved'
+    except asyncio.TimeoutError:
+        result.state, result.error_code = 'closed', 'timed out'
+    except OSError as e:
+        if e.errno is None:
+            result.state, result.error = 'error', f"An error occurred during TCP connection test: {e}"
+        else:
+            result.state, result.error_code = 'closed', str(e.errno)
+    finally:
+        if writer is not None:
+            writer.close()
+    return result
+
+async def run_tcp_connect_test_async(target, port):
+    """Performs a TCP connection test and returns the formatted verdict."""
+    return format_port_test(await tcp_connect_result_async(target, port))
+
+def run_tcp_connect_test(target, port):
+    """Synchronous wrapper around run_tcp_connect_test_async()."""
+    return run_async(run_tcp_connect_test_async(target, port))
+
+def parse_port_spec(spec):
+    """
+    Parses a port specification such as "22,80,8000-8100" into a sorted list of unique ports.
+    Raises ValueError for malformed specifications or ports outside 1-65535.
     """
-    A centralized and safe way to run external command-line utilities.
+    ports = set()
+    for part in re.split(r'[,\s]+', str(spec).strip()):
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        if not start.isdigit() or (end and not end.isdigit()):
+            raise ValueError(f"Invalid port specification '{part}'")
+        first, last = int(start), int(end or start)
+        if not (1 <= first <= last <= 65535):
+            raise ValueError(f"Port range '{part}' must be within 1-65535")
+        ports.update(range(first, last + 1))
+    if not ports:
+        raise ValueError("No ports specified")
+    return sorted(ports)
+
+def parse_host_list(value):
+    """Splits a comma/whitespace-separated host list, rejecting invalid entries with ValueError."""
+    hosts = value if isinstance(value, (list, tuple)) else re.split(r'[,\s]+', str(value))
+    hosts = [str(h).strip() for h in hosts if str(h).strip()]
+    for host in hosts:
+        if not is_valid_target(host):
+            raise ValueError(f"Invalid host '{host}'")
+    if not hosts:
+        raise ValueError("No hosts specified")
+    return hosts
+
+async def _probe_tcp_port(family, sockaddr, timeout, retries):
+    """
+    Attempts a non-blocking TCP connect, retrying attempts that time out.
+    Returns (state, latency_ms, attempts) where state is 'open', 'closed' or 'filtered'.
+    """
+    loop = asyncio.get_running_loop()
+    attempts = 0
+    while True:
+        attempts += 1
+        sock = None
+        started = time.perf_counter()
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            await asyncio.wait_for(loop.sock_connect(sock, sockaddr), timeout=timeout)
+            return 'open', round((time.perf_counter() - started) * 1000, 2), attempts
+        except ConnectionRefusedError:
+            return 'closed', round((time.perf_counter() - started) * 1000, 2), attempts
+        except (asyncio.TimeoutError, OSError):
+            if attempts > retries:
+                return 'filtered', None, attempts
+        finally:
+            if sock is not None:
+                sock.close()
+
+async def _resolve_scan_host(host):
+    """Returns (family, address) for a scan target, preferring the first address the system resolver returns."""
+    if is_ip_address(host):
+        address = ipaddress.ip_address(host)
+        return (socket.AF_INET6 if address.version == 6 else socket.AF_INET), host
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    family, _, _, _, sockaddr = infos[0]
+    return family, sockaddr[0]
+
+async def scan_tcp_ports_async(hosts, ports, timeout=None, retries=None, parallelism=None):
+    """
+    Scans every (host, port) pair with non-blocking connects multiplexed on the event loop.
+    Supports IPv4 and IPv6. Returns a dict with per-host resolution results, per-port
+    open/closed/filtered states with connect latency, and a summary.
+    """
+    timeout = float(timeout if timeout is not None else SCAN_DEFAULT_TIMEOUT)
+    if not math.isfinite(timeout) or timeout <= 0:
+        timeout = SCAN_DEFAULT_TIMEOUT
+    timeout = min(timeout, SCAN_MAX_TIMEOUT)
+    retries = max(0, min(int(retries if retries is not None else SCAN_DEFAULT_RETRIES), SCAN_MAX_RETRIES))
+    parallelism = max(1, min(int(parallelism or SCAN_DEFAULT_PARALLELISM), SCAN_MAX_PARALLELISM))
+    if len(hosts) * len(ports) > SCAN_MAX_PROBES:
+        raise ValueError(f"Scan too large: {len(hosts)} host(s) x {len(ports)} port(s) exceeds {SCAN_MAX_PROBES} probes")
+
+    logging.info(f"Scanning {len(hosts)} host(s) x {len(ports)} port(s)")
+    started = time.perf_counter()
+    resolved = await asyncio.gather(*(_resolve_scan_host(host) for host in hosts), return_exceptions=True)
+
+    host_results = []
+    targets = []
+    for host, resolution in zip(hosts, resolved):
+        if isinstance(resolution, Exception):
+            host_results.append({'host': host, 'address': None, 'error': 'Hostname could not be resolved'})
+            continue
+        family, address = resolution
+        host_results.append({'host': host, 'address': address, 'error': None})
+        targets.append((host, family, address))
+
+    def probes():
+        for host_index, (host, family, address) in enumerate(targets):
+            for port in ports:
+                sockaddr = (address, port, 0, 0) if family == socket.AF_INET6 else (address, port)
+                yield host_index, host, family, address, port, sockaddr
+
+    async def probe(item):
+        host_index, host, family, address, port, sockaddr = item
+        state, latency_ms, attempts = await _probe_tcp_port(family, sockaddr, timeout, retries)
+        return (host_index, port), {'host': host, 'address': address, 'port': port, 'state': state,
+                                    'latency_ms': latency_ms, 'attempts': attempts}
+
+    results = [result async for result in iterate_bounded(probe, probes(), parallelism)]
+    results = [result for _, result in sorted(results, key=lambda item: item[0])]
+
+    summary = {state: sum(1 for r in results if r['state'] == state) for state in ('open', 'closed', 'filtered')}
+    summary['probes'] = len(results)
+    summary['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return {
+        'hosts': host_results,
+        'results': results,
+        'summary': summary,
+        'timeout': timeout,
+        'retries': retries,
+        'parallelism': parallelism
+    }
+
+def format_port_scan(scan):
+    """Formats the output of scan_tcp_ports_async() as a text report."""
+    ports = sorted({r['port'] for r in scan['results']})
+    lines = [f"TCP port scan of {len(scan['hosts'])} host(s) x {len(ports)} port(s) "
+             f"(timeout {scan['timeout']}s, retries {scan['retries']}, parallelism {scan['parallelism']})"]
+    for host in scan['hosts']:
+        lines.append("")
+        if host['error']:
+            lines.append(f"{host['host']}: {host['error']}")
+            continue
+        lines.append(f"{host['host']} ({host['address']})")
+        for r in scan['results']:
+            if r['host'] == host['host']:
+                latency = f"{r['latency_ms']} ms" if r['latency_ms'] is not None else ""
+                lines.append(f"  {str(r['port']) + '/tcp':<12}{r['state']:<10}{latency}")
+    summary = scan['summary']
+    lines.append("")
+    lines.append(f"Scanned {summary['probes']} port(s) in {summary['elapsed_ms'] / 1000:.2f}s: "
+                 f"{summary['open']} open, {summary['closed']} closed, {summary['filtered']} filtered")
+    return "\n".join(lines)
+
+async def run_subprocess_async(command, timeout=10):
+    """
+    A centralized and safe way to run external command-line utilities as asyncio subprocesses.
     Captures output, handles timeouts, and provides clear error messages.
     Hides the command window on Windows.
     """
@@ -364,41 +2631,49 @@ def run_subprocess(command, timeout=10):
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
             startupinfo.wShowWindow = subprocess.SW_HIDE
 
-        result = subprocess.check_output(
-            command,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            timeout=timeout,
+        SUBPROCESS_SPAWNS.inc((command[0],))
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
             startupinfo=startupinfo
         )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return f"Command timed out after {timeout} seconds."
+
+        result = stdout.decode(errors='replace').replace('\r\n', '\n')
+        if process.returncode != 0:
+            logging.warning(f"Subprocess failed: {result.strip()}")
+            return f"Command failed:\n{result.strip()}"
         return result
     except FileNotFoundError:
         return f"Error: Command '{command[0]}' not found on the system."
-    except subprocess.CalledProcessError as e:
-        logging.warning(f"Subprocess failed: {e.output.strip()}")
-        return f"Command failed:\n{e.output.strip()}"
-    except subprocess.TimeoutExpired:
-        return f"Command timed out after {timeout} seconds."
     except Exception as e:
         logging.exception(f"Unexpected error running subprocess: {' '.join(command)}")
         return f"An unexpected error occurred: {str(e)}"
 
-def run_reverse_lookup(ip_address, dns_server):
+def run_subprocess(command, timeout=10):
+    """Synchronous wrapper around run_subprocess_async()."""
+    return run_async(run_subprocess_async(command, timeout=timeout))
+
+async def run_reverse_lookup_async(ip_address, dns_server):
     """
     Performs a reverse DNS (PTR) lookup for a given IP address.
     Used by the bulk lookup tool.
     """
     try:
-        resolver = dns.resolver.Resolver()
-        if dns_server and dns_server != 'System Default':
-            resolver.nameservers = [dns_server]
+        resolver = await RESOLVERS.get(dns_server)
 
         if ipaddress.ip_address(ip_address).version == 4:
             reversed_ip = '.'.join(ip_address.split('.')[::-1]) + '.in-addr.arpa'
         else:
             reversed_ip = ipaddress.ip_address(ip_address).reverse_pointer
 
-        ptr_answers = resolver.resolve(reversed_ip, 'PTR', lifetime=5)
+        ptr_answers = await resolve_cached(resolver, reversed_ip, 'PTR', lifetime=5)
         for ptr in ptr_answers:
             return str(ptr.target).rstrip('.')
         return "No PTR record"
@@ -408,70 +2683,1479 @@ def run_reverse_lookup(ip_address, dns_server):
         logging.warning(f"Reverse lookup for {ip_address} failed: {e}")
         return "Error"
 
-def run_bulk_nslookup(file_storage, dns_server, should_ping, should_reverse_lookup):
-    """
-    Processes an uploaded CSV file of hostnames.
-    Performs nslookup on each, with optional ping and reverse lookup,
-    and returns the results as a CSV-formatted string.
-    """
-    results = []
-    temp_path = None
-    try:
-        temp_filename = str(uuid.uuid4()) + '.csv'
-        temp_path = os.path.join(BULK_RESULTS_DIR, temp_filename)
-        file_storage.save(temp_path)
+def run_reverse_lookup(ip_address, dns_server):
+    """Synchronous wrapper around run_reverse_lookup_async()."""
+    return run_async(run_reverse_lookup_async(ip_address, dns_server))
+
+class RateLimiter:
+    """
+    Thread-safe token bucket. Used to cap how many DNS queries per second a bulk run
+    sends to a single DNS server, regardless of how many worker threads are active.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Takes a token if one is available and returns 0, otherwise returns the seconds until the next one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` tokens have been taken. A rate of 0 or less disables limiting."""
+        if self.rate <= 0:
+            return
+        for _ in range(tokens):
+            while True:
+                wait = self._take()
+                if not wait:
+                    break
+                time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """Like acquire(), but waits without blocking the event loop."""
+        if self.rate <= 0:
+            return
+        for _ in range(tokens):
+            while True:
+                wait = self._take()
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+
+_server_rate_limiters = OrderedDict()
+_server_rate_limiters_lock = threading.Lock()
+
+async def get_server_rate_limiter_async(dns_server):
+    """
+    Returns the process-wide rate limiter for a DNS server, creating it on first use. Limiters
+    are keyed by the server's (address, port), so every spelling of a server shares one bucket;
+    at most RESOLVER_REGISTRY_MAX_ENTRIES are kept, the least recently used being dropped.
+    """
+    try:
+        key = await RESOLVERS.nameserver_address(dns_server)
+    except (OSError, ValueError):
+        # The lookups will fail the same way; the raw name still gets a bucket of its own
+        key = (str(dns_server), None)
+    with _server_rate_limiters_lock:
+        limiter = _server_rate_limiters.get(key)
+        if limiter is None:
+            limiter = _server_rate_limiters[key] = RateLimiter(BULK_RATE_LIMIT_PER_SERVER)
+        _server_rate_limiters.move_to_end(key)
+        while len(_server_rate_limiters) > RESOLVER_REGISTRY_MAX_ENTRIES:
+            _server_rate_limiters.popitem(last=False)
+        return limiter
+
+def get_server_rate_limiter(dns_server):
+    """Synchronous wrapper around get_server_rate_limiter_async()."""
+    return run_async(get_server_rate_limiter_async(dns_server))
+
+BULK_CSV_HEADER = "Target,Resolved_Name,Resolved_IP,Ping_Result,Reverse_Lookup_PTR"
+
+def normalize_bulk_target(target):
+    """Canonical form of a bulk target used for deduplication: trimmed, lower case, without a trailing dot."""
+    return target.strip().rstrip('.').lower()
+
+class BulkWorkMemo:
+    """
+    Work shared between the rows of one bulk NSLookup run. Each unique (normalized) name is
+    resolved once and each unique address is pinged and PTR-looked-up once; later rows reuse the
+    result, waiting for it if another worker is still computing it. Up to max_entries results of
+    each kind are kept, least recently used first out, so memory stays bounded on huge inputs.
+    """
+
+    KINDS = ('lookup', 'ping', 'ptr')
+
+    def __init__(self, max_entries=BULK_DEDUP_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._results = {kind: OrderedDict() for kind in self.KINDS}
+        self._lock = threading.Lock()
+        self.performed = dict.fromkeys(self.KINDS, 0)
+        self.reused = dict.fromkeys(self.KINDS, 0)
+
+    def get(self, kind, key, compute):
+        """Returns compute() for key, computing it only for the first row that needs it."""
+        with self._lock:
+            results = self._results[kind]
+            future = results.get(key)
+            owner = future is None
+            if owner:
+                self.performed[kind] += 1
+                if self.max_entries > 0:
+                    future = results[key] = Future()
+                    while len(results) > self.max_entries:
+                        results.popitem(last=False)
+            else:
+                results.move_to_end(key)
+                self.reused[kind] += 1
+        BULK_WORK.inc((kind, 'performed' if owner else 'reused'))
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            if future is not None:
+                future.set_exception(e)
+            raise
+        if future is not None:
+            future.set_result(value)
+        return value
+
+    def stats(self):
+        """Returns the rows processed and, per kind, the work performed and the work saved by reuse."""
+        with self._lock:
+            # Every row resolves its target exactly once, directly or through reuse
+            stats = {'rows': self.performed['lookup'] + self.reused['lookup']}
+            for kind in self.KINDS:
+                stats[f"{kind}s_performed"] = self.performed[kind]
+                stats[f"{kind}s_reused"] = self.reused[kind]
+            stats['saved'] = sum(self.reused.values())
+            return stats
+
+def _bulk_lookup_row(target, dns_server, should_ping, should_reverse_lookup, rate_limiter, memo):
+    """Resolves a single bulk target, reusing work already done in the run, and returns its result row as a dict."""
+    def resolve(name):
+        # An nslookup sends an A and an AAAA query
+        rate_limiter.acquire(2)
+        return run_async(nslookup_result_async(name, dns_server))
+
+    def ping(address):
+        stats = run_async(ping_address_async(address, count=1))
+        return 'Success' if stats.received else 'Failed'
+
+    def reverse_lookup(address):
+        rate_limiter.acquire()
+        return run_reverse_lookup(address, dns_server)
+
+    name = normalize_bulk_target(target)
+    lookup = memo.get('lookup', name, lambda: resolve(name))
+    first_ip = lookup.addresses[0] if lookup.addresses else 'N/A'
+
+    ping_result = 'N/A'
+    if should_ping and first_ip != 'N/A':
+        ping_result = memo.get('ping', first_ip, lambda: ping(first_ip))
+
+    ptr_record = 'N/A'
+    if should_reverse_lookup and first_ip != 'N/A':
+        ptr_record = memo.get('ptr', first_ip, lambda: reverse_lookup(first_ip))
+
+    return {
+        'target': target,
+        'resolved_name': lookup.name or 'N/A',
+        'resolved_ips': lookup.addresses,
+        'ping_result': ping_result,
+        'reverse_lookup_ptr': ptr_record
+    }
+
+def format_bulk_row_csv(row):
+    """Formats a bulk result row as a line of the bulk CSV output."""
+    ips_str = '; '.join(row['resolved_ips']) if row['resolved_ips'] else 'N/A'
+    return f'"{row["target"]}","{row["resolved_name"]}","{ips_str}","{row["ping_result"]}","{row["reverse_lookup_ptr"]}"'
+
+def iter_bulk_targets(stream, chunk_size=65536):
+    """
+    Yields valid targets from a binary stream of comma/whitespace-separated hostnames.
+    The stream is read in chunks, so the upload is never held in memory as a whole.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    remainder = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        text = remainder + decoder.decode(chunk or b'', final=not chunk)
+        tokens = re.split(r'[,\s]+', text)
+        # The last token may continue in the next chunk
+        remainder = tokens.pop() if chunk else ''
+        for token in tokens:
+            if token and is_valid_target(token):
+                yield token
+        if not chunk:
+            return
+
+def iter_bulk_targets_from_file(path, remove=False):
+    """Yields valid targets from a file on disk, optionally deleting it once it has been read."""
+    try:
+        with open(path, 'rb') as f:
+            yield from iter_bulk_targets(f)
+    finally:
+        if remove and os.path.exists(path):
+            os.remove(path)
+
+def iterate_ordered_bounded(executor, func, items, window):
+    """
+    Submits func(item) to executor for each item with at most `window` calls in flight and
+    yields the results in input order. Items are consumed lazily.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+@instrument_tool('bulk_nslookup')
+def iter_bulk_nslookup(targets, dns_server, should_ping, should_reverse_lookup, concurrency=None, memo=None):
+    """
+    Generator behind every bulk NSLookup path. Resolves targets (any iterable, consumed lazily)
+    with a bounded worker pool and yields one result row per target, in input order. Duplicate
+    names and addresses are looked up once per run; pass a BulkWorkMemo to read the savings.
+    """
+    max_workers = max(1, concurrency or BULK_CONCURRENCY)
+    rate_limiter = get_server_rate_limiter(dns_server)
+    memo = memo if memo is not None else BulkWorkMemo()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bulk-nslookup') as executor:
+        for row in iterate_ordered_bounded(
+            executor,
+            lambda target: _bulk_lookup_row(target, dns_server, should_ping, should_reverse_lookup, rate_limiter, memo),
+            targets,
+            max_workers * 2
+        ):
+            BULK_WORK.inc(('row', 'resolved' if row['resolved_ips'] else 'unresolved'))
+            yield row
+
+def stream_file(path, chunk_size=65536, remove=False):
+    """Yields a file in chunks, optionally deleting it once it has been fully read."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove and os.path.exists(path):
+            os.remove(path)
+
+# --- Subnet Sweeps ---
+
+@dataclass(**DATACLASS_OPTIONS)
+class SweepResult(ResultModel):
+    """One address of a subnet sweep: its PTR record and, when a liveness probe was requested, whether it answered."""
+    address: str
+    ptr: Optional[str] = None
+    alive: Optional[bool] = None
+    latency_ms: Optional[float] = None
+    method: Optional[str] = None
+    error: Optional[str] = None
+
+SWEEP_CSV_HEADER = "Address,PTR,Alive,Latency_ms"
+
+def parse_sweep_networks(value):
+    """
+    Parses comma/whitespace-separated CIDR blocks (IPv4 or IPv6; a bare address is a single host)
+    into ip_network objects. Host bits are ignored and overlapping blocks are merged. Raises
+    ValueError for invalid blocks or when the blocks cover more than SWEEP_MAX_ADDRESSES addresses.
+    """
+    items = value if isinstance(value, (list, tuple)) else re.split(r'[,\s]+', str(value))
+    parsed = []
+    for item in (str(i).strip() for i in items):
+        if not item:
+            continue
+        try:
+            parsed.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            raise ValueError(f"Invalid network '{item}'") from None
+    if not parsed:
+        raise ValueError("No networks specified")
+
+    networks = []
+    for version in (4, 6):
+        networks.extend(ipaddress.collapse_addresses(n for n in parsed if n.version == version))
+    total = sum(network.num_addresses for network in networks)
+    if total > SWEEP_MAX_ADDRESSES:
+        raise ValueError(f"Sweep too large: {total} addresses exceeds {SWEEP_MAX_ADDRESSES}")
+    return networks
+
+def iter_sweep_addresses(networks):
+    """
+    Yields the host addresses of each network in order (without the IPv4 network and broadcast
+    addresses), one at a time, so even a /16 never exists as a list.
+    """
+    for network in networks:
+        yield from network.hosts()
+
+async def _sweep_liveness(address, liveness, ports, timeout):
+    """Probes one address. Returns (alive, latency_ms, method, error)."""
+    if liveness == 'icmp':
+        stats = await ping_address_async(address, count=1, timeout=timeout)
+        return stats.received > 0, stats.replies[0] if stats.replies else None, stats.method, stats.error
+
+    # Any answer, including a refused connection, shows the host is up
+    family = socket.AF_INET6 if ipaddress.ip_address(address).version == 6 else socket.AF_INET
+    probes = await asyncio.gather(*(
+        _probe_tcp_port(family, (address, port, 0, 0) if family == socket.AF_INET6 else (address, port), timeout, 0)
+        for port in ports
+    ))
+    answered = [latency_ms for state, latency_ms, _ in probes if state != 'filtered']
+    return bool(answered), min(answered) if answered else None, 'tcp', None
+
+async def sweep_address_async(address, dns_server, liveness=None, ports=None, timeout=None, rate_limiter=None):
+    """
+    Runs the PTR lookup and, with liveness 'icmp' or 'tcp', a liveness probe for one address
+    concurrently. Returns a SweepResult.
+    """
+    address = str(address)
+    timeout = SWEEP_TIMEOUT if timeout is None else timeout
+
+    async def lookup_ptr():
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async()
+        return await run_reverse_lookup_async(address, dns_server)
+
+    if not liveness:
+        return SweepResult(address=address, ptr=await lookup_ptr())
+    ptr, (alive, latency_ms, method, error) = await asyncio.gather(
+        lookup_ptr(), _sweep_liveness(address, liveness, ports or PING_TCP_PORTS, timeout))
+    return SweepResult(address=address, ptr=ptr, alive=alive, latency_ms=latency_ms, method=method, error=error)
+
+async def sweep_async(networks, dns_server, liveness=None, ports=None, timeout=None, concurrency=None):
+    """
+    Async generator sweeping every host address of the networks, yielding one SweepResult per
+    address in completion order. Addresses are generated lazily with at most `concurrency` in
+    flight, so memory use depends on the concurrency, not on the size of the networks. PTR
+    lookups share the per-server rate limit of bulk NSLookup. With TCP liveness, the concurrency
+    is lowered so that at most SCAN_MAX_PARALLELISM connects are open at once.
+    """
+    concurrency = max(1, min(int(concurrency or SWEEP_CONCURRENCY), SCAN_MAX_PARALLELISM))
+    if liveness == 'tcp':
+        concurrency = max(1, min(concurrency, SCAN_MAX_PARALLELISM // len(ports or PING_TCP_PORTS)))
+    rate_limiter = await get_server_rate_limiter_async(dns_server)
+    logging.info(f"Sweeping {', '.join(str(n) for n in networks)} (liveness: {liveness or 'none'})")
+
+    def sweep(address):
+        return sweep_address_async(address, dns_server, liveness, ports, timeout, rate_limiter)
+
+    async for result in iterate_bounded(sweep, iter_sweep_addresses(networks), concurrency):
+        yield result
+
+def format_sweep_result_csv(result):
+    """Formats a SweepResult as a line of the sweep CSV output."""
+    alive = '' if result.alive is None else ('Yes' if result.alive else 'No')
+    latency = '' if result.latency_ms is None else result.latency_ms
+    return f'"{result.address}","{result.ptr}","{alive}","{latency}"'
+
+# --- Background Bulk Jobs ---
+
+class BulkJobManager:
+    """
+    Runs bulk NSLookup jobs on a local worker pool. All job state lives on disk under
+    BULK_JOBS_DIR/<job_id>/ (job.json, input.csv, results.csv), so progress can be polled
+    from any request and unfinished jobs are resumed from their last completed row after a restart.
+    Finished jobs are deleted retention_hours after they end, checked at startup and on each submit.
+    """
+
+    FINISHED = ('completed', 'failed', 'cancelled')
+
+    def __init__(self, jobs_dir, workers, retention_hours=BULK_JOB_RETENTION_HOURS):
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.retention_hours = retention_hours
+        # In worker processes, jobs are run (and cancelled) by the supervisor's manager
+        self.remote = None
+        self._executor = None
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Recovers unfinished jobs (see recover) once; later calls, and calls in worker processes, are no-ops."""
+        if self._started or self.remote is not None:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.recover()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix='bulk-job')
+            return self._executor
+
+    def _job_dir(self, job_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            return None
+        path = os.path.join(self.jobs_dir, job_id)
+        return path if os.path.isdir(path) else None
+
+    def _load(self, job_id):
+        job_dir = self._job_dir(job_id)
+        if not job_dir:
+            return None
+        try:
+            with open(os.path.join(job_dir, 'job.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, job):
+        """Writes job.json atomically so pollers never read a half-written file."""
+        job_dir = os.path.join(self.jobs_dir, job['id'])
+        temp_path = os.path.join(job_dir, 'job.json.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(temp_path, os.path.join(job_dir, 'job.json'))
+
+    def results_path(self, job_id):
+        job_dir = self._job_dir(job_id)
+        return os.path.join(job_dir, 'results.csv') if job_dir else None
+
+    def submit(self, stream, dns_server, should_ping, should_reverse_lookup, filename=None):
+        """Stores an uploaded target list as a new job and queues it. Returns the job status."""
+        self.expire()
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        input_path = os.path.join(job_dir, 'input.csv')
+        with open(input_path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'filename': filename,
+            'dns_server': dns_server,
+            'ping': bool(should_ping),
+            'reverse': bool(should_reverse_lookup),
+            'total': sum(1 for _ in iter_bulk_targets_from_file(input_path)),
+            'done': 0,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'run_started_at': None,
+            'run_started_done': 0,
+            'work': None,
+            'error': None
+        }
+        self._save(job)
+        (self.remote or self).enqueue(job_id)
+        return self.status(job_id)
+
+    def enqueue(self, job_id):
+        """Queues a stored job on this process's job workers."""
+        self._get_executor().submit(self._run, job_id)
+
+    def status(self, job_id):
+        """Returns the job state with derived progress figures (percent, throughput, ETA), or None."""
+        job = self._load(job_id)
+        if job is None:
+            return None
+        job['percent'] = round(100.0 * job['done'] / job['total'], 1) if job['total'] else 100.0
+        job['throughput'] = None
+        job['eta_seconds'] = None
+        if job['run_started_at']:
+            end = job['finished_at'] or time.time()
+            elapsed = max(end - job['run_started_at'], 1e-6)
+            throughput = (job['done'] - job['run_started_done']) / elapsed
+            job['throughput'] = round(throughput, 2)
+            if job['status'] == 'running' and throughput > 0:
+                job['eta_seconds'] = round((job['total'] - job['done']) / throughput, 1)
+        return job
+
+    def cancel(self, job_id):
+        """Requests cancellation. Running jobs stop after their in-flight rows finish."""
+        if self.remote is not None:
+            return self.remote.cancel(job_id)
+        with self._lock:
+            job = self._load(job_id)
+            if job is None or job['status'] in self.FINISHED:
+                return job
+            self._cancel_events.setdefault(job_id, threading.Event()).set()
+            if job['status'] == 'queued':
+                job['status'] = 'cancelled'
+                job['finished_at'] = time.time()
+                self._save(job)
+        return self.status(job_id)
+
+    def read_results(self, job_id, offset=0, limit=100):
+        """Returns up to `limit` completed result rows starting at `offset`, as dicts."""
+        path = self.results_path(job_id)
+        if not path or not os.path.exists(path):
+            return []
+        rows = []
+        with open(path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for index, columns in enumerate(reader):
+                if index < offset:
+                    continue
+                if len(rows) >= limit:
+                    break
+                if len(columns) == 5:
+                    rows.append({
+                        'target': columns[0],
+                        'resolved_name': columns[1],
+                        'resolved_ips': [] if columns[2] == 'N/A' else columns[2].split('; '),
+                        'ping_result': columns[3],
+                        'reverse_lookup_ptr': columns[4]
+                    })
+        return rows
+
+    @staticmethod
+    def _completed_rows(results_path, chunk_size=65536):
+        """
+        Counts complete result rows, dropping a partially written last line left by a crash.
+        The file is read in chunks: backwards from the end to find the last newline, then
+        forwards to count lines, so a large job is never held in memory.
+        """
+        if not os.path.exists(results_path):
+            return 0
+        with open(results_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            complete = end
+            while complete > 0:
+                start = max(0, complete - chunk_size)
+                f.seek(start)
+                newline = f.read(complete - start).rfind(b'\n')
+                if newline >= 0:
+                    complete = start + newline + 1
+                    break
+                complete = start
+            if complete != end:
+                f.truncate(complete)
+            f.seek(0)
+            lines = 0
+            while f.tell() < complete:
+                lines += f.read(min(chunk_size, complete - f.tell())).count(b'\n')
+        return max(0, lines - 1)
+
+    def _run(self, job_id):
+        cancel_event = self._cancel_events.setdefault(job_id, threading.Event())
+        with self._lock:
+            job = self._load(job_id)
+            if job is None or job['status'] in self.FINISHED:
+                return
+            if cancel_event.is_set():
+                job.update(status='cancelled', finished_at=time.time())
+                self._save(job)
+                return
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            results_path = os.path.join(job_dir, 'results.csv')
+            done = self._completed_rows(results_path)
+            job.update(status='running', done=done, started_at=job['started_at'] or time.time(),
+                       run_started_at=time.time(), run_started_done=done)
+            self._save(job)
+
+        try:
+            targets = itertools.islice(iter_bulk_targets_from_file(os.path.join(job_dir, 'input.csv')), done, None)
+            memo = BulkWorkMemo()
+            rows = iter_bulk_nslookup(targets, job['dns_server'], job['ping'], job['reverse'], memo=memo)
+            with open(results_path, 'a') as f:
+                if done == 0 and f.tell() == 0:
+                    f.write(BULK_CSV_HEADER + '\n')
+                last_saved = time.monotonic()
+                for row in rows:
+                    if cancel_event.is_set():
+                        rows.close()
+                        break
+                    f.write(format_bulk_row_csv(row) + '\n')
+                    job['done'] += 1
+                    if time.monotonic() - last_saved >= 1:
+                        f.flush()
+                        job['work'] = memo.stats()
+                        with self._lock:
+                            self._save(job)
+                        last_saved = time.monotonic()
+            job['work'] = memo.stats()
+            job['status'] = 'cancelled' if cancel_event.is_set() else 'completed'
+        except Exception as e:
+            logging.exception(f"Bulk job {job_id} failed")
+            job.update(status='failed', error=str(e))
+        finally:
+            job['finished_at'] = time.time()
+            with self._lock:
+                self._save(job)
+                self._cancel_events.pop(job_id, None)
+
+    def expire(self):
+        """Deletes the directories of jobs that finished more than retention_hours ago."""
+        if not os.path.isdir(self.jobs_dir):
+            return
+        cutoff = time.time() - self.retention_hours * 3600
+        for job_id in os.listdir(self.jobs_dir):
+            job = self._load(job_id)
+            if job is not None and job['status'] in self.FINISHED and job['finished_at'] and job['finished_at'] < cutoff:
+                logging.info(f"Deleting expired bulk job {job_id}")
+                shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+
+    def recover(self):
+        """Removes expired jobs and re-queues jobs that were queued or running when the process stopped."""
+        self.expire()
+        if not os.path.isdir(self.jobs_dir):
+            return
+        for job_id in os.listdir(self.jobs_dir):
+            job = self._load(job_id)
+            if job is None or job['status'] in self.FINISHED:
+                continue
+            logging.info(f"Resuming bulk job {job_id} at row {job['done']} of {job['total']}")
+            self._get_executor().submit(self._run, job_id)
+
+BULK_JOBS = BulkJobManager(BULK_JOBS_DIR, BULK_JOB_WORKERS)
+
+# --- Status Monitor ---
+
+class StatusMonitor:
+    """
+    Background thread that pings STATUS_CHECK_HOST (and, if enabled, every DNS server) once per
+    STATUS_CHECK_INTERVAL and keeps a rolling history of the results. Requests read the latest
+    snapshot, which is rebuilt after each round, so /api/dns-status never waits on the network.
+    """
+
+    def __init__(self, hosts, interval, history_size):
+        self.hosts = list(dict.fromkeys(hosts))
+        self.interval = interval
+        self._history = {host: deque(maxlen=max(1, history_size)) for host in self.hosts}
+        self._snapshot = self._build_snapshot()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the monitor thread once; later calls are no-ops."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='status-monitor', daemon=True)
+                self._thread.start()
+
+    def snapshot(self, history=False):
+        """Returns the latest shared status, optionally including the per-host probe history."""
+        return self._snapshot['with_history' if history else 'summary']
+
+    def _loop(self):
+        while True:
+            try:
+                run_async(self._probe_all())
+            except Exception:
+                logging.exception("Status monitor round failed")
+            time.sleep(self.interval)
+
+    async def _probe_all(self):
+        results = await asyncio.gather(*(self._probe(host) for host in self.hosts))
+        checked_at = time.time()
+        for host, (online, latency_ms) in zip(self.hosts, results):
+            self._history[host].append({'checked_at': checked_at, 'online': online, 'latency_ms': latency_ms})
+        self._snapshot = self._build_snapshot()
+
+    async def _probe(self, host):
+        try:
+            stats, _ = await ping_host_async(host, count=1)
+        except Exception:
+            logging.exception(f"Status check for {host} failed")
+            return False, None
+        if stats is None or not stats.received:
+            return False, None
+        return True, round(stats.rtts[0], 2)
+
+    def _host_status(self, host, history):
+        samples = self._history[host]
+        if not samples:
+            return {'host': host, 'online': False, 'message': "Checking status...", 'last_checked': 0,
+                    'latency_ms': None, 'availability_pct': None, 'avg_latency_ms': None, 'samples': 0}
+        latest = samples[-1]
+        latencies = [s['latency_ms'] for s in samples if s['latency_ms'] is not None]
+        status = {
+            'host': host,
+            'online': latest['online'],
+            'message': f"✅ {host} is ONLINE" if latest['online'] else f"❌ {host} is OFFLINE or unreachable",
+            'last_checked': latest['checked_at'],
+            'latency_ms': latest['latency_ms'],
+            'availability_pct': round(100.0 * sum(1 for s in samples if s['online']) / len(samples), 1),
+            'avg_latency_ms': round(statistics.mean(latencies), 2) if latencies else None,
+            'samples': len(samples)
+        }
+        if history:
+            status['history'] = list(samples)
+        return status
+
+    def _build_snapshot(self):
+        snapshot = {}
+        for key, history in (('summary', False), ('with_history', True)):
+            hosts = [self._host_status(host, history) for host in self.hosts]
+            primary = hosts[0]
+            snapshot[key] = {
+                'online': primary['online'],
+                'message': primary['message'],
+                'last_checked': primary['last_checked'],
+                'interval': self.interval,
+                'hosts': hosts
+            }
+        return snapshot
+
+STATUS_MONITOR = StatusMonitor(
+    [STATUS_CHECK_HOST] + (DNS_SERVERS if STATUS_CHECK_DNS_SERVERS else []),
+    STATUS_CHECK_INTERVAL,
+    STATUS_HISTORY_SIZE
+)
+
+# --- Path Monitors ---
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list, or None if it is empty."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class PathSeries:
+    """
+    Fixed-memory ring buffer of the traceroute rounds of one monitored target. Each round stores
+    one float32 RTT per hop (NaN = lost), its timestamp, path length and whether the destination
+    answered, so memory stays at capacity x max_hops x 4 bytes however long the monitor runs.
+    """
+
+    __slots__ = ('max_hops', 'capacity', 'rtts', 'times', 'lengths', 'reached', 'rounds', 'addresses', 'names',
+                 '_empty_round', '_lock')
+
+    def __init__(self, max_hops, capacity):
+        self.max_hops = max_hops
+        self.capacity = capacity
+        self._empty_round = array('f', [math.nan]) * max_hops
+        self.rtts = self._empty_round * capacity
+        self.times = array('d', [0.0]) * capacity
+        self.lengths = array('B', [0]) * capacity
+        self.reached = array('B', [0]) * capacity
+        self.rounds = 0
+        self.addresses = [None] * max_hops  # Most recent responder of each hop
+        self.names = {}  # Reverse names of hop addresses, looked up once per new address
+        self._lock = threading.Lock()
+
+    @property
+    def memory_bytes(self):
+        return sum(buffer.itemsize * len(buffer) for buffer in (self.rtts, self.times, self.lengths, self.reached))
+
+    def record(self, timestamp, hops, reached):
+        """Stores one round; hops are TracerouteHops, each contributing its best RTT."""
+        slot = self.rounds % self.capacity
+        base = slot * self.max_hops
+        with self._lock:
+            self.rtts[base:base + self.max_hops] = self._empty_round
+            for hop in hops:
+                rtts = [rtt for rtt in hop.rtts if rtt is not None]
+                if rtts:
+                    self.rtts[base + hop.ttl - 1] = min(rtts)
+                if hop.address:
+                    self.addresses[hop.ttl - 1] = hop.address
+            self.times[slot] = timestamp
+            self.lengths[slot] = max((hop.ttl for hop in hops), default=0)
+            self.reached[slot] = 1 if reached else 0
+            self.rounds += 1
+
+    def window(self, since=0.0):
+        """Returns (timestamp, path_length, reached, rtts) for each stored round newer than since, oldest first."""
+        with self._lock:
+            count = min(self.rounds, self.capacity)
+            rows = []
+            for i in range(self.rounds - count, self.rounds):
+                slot = i % self.capacity
+                if self.times[slot] > since:
+                    base = slot * self.max_hops
+                    rows.append((self.times[slot], self.lengths[slot], self.reached[slot],
+                                 self.rtts[base:base + self.max_hops]))
+        return rows
+
+    def aggregate(self, since=0.0, percentiles=(50, 90, 99)):
+        """Returns MTR-style per-hop loss and latency statistics over the rounds newer than since."""
+        rows = self.window(since)
+        hops = []
+        for ttl in range(1, max((row[1] for row in rows), default=0) + 1):
+            # A hop only counts as probed in rounds whose path reached at least that far
+            samples = [row[3][ttl - 1] for row in rows if row[1] >= ttl]
+            rtts = sorted(rtt for rtt in samples if not math.isnan(rtt))
+            address = self.addresses[ttl - 1]
+            hops.append({
+                'ttl': ttl,
+                'address': address,
+                'name': self.names.get(address),
+                'sent': len(samples),
+                'received': len(rtts),
+                'loss_pct': round(100.0 * (len(samples) - len(rtts)) / len(samples), 1) if samples else None,
+                'last_ms': round(samples[-1], 3) if samples and not math.isnan(samples[-1]) else None,
+                'best_ms': round(rtts[0], 3) if rtts else None,
+                'avg_ms': round(statistics.mean(rtts), 3) if rtts else None,
+                'worst_ms': round(rtts[-1], 3) if rtts else None,
+                'stddev_ms': round(statistics.pstdev(rtts), 3) if rtts else None,
+                'percentiles_ms': {f"p{pct:g}": round(_percentile(rtts, pct), 3) if rtts else None for pct in percentiles}
+            })
+        return {
+            'rounds': len(rows),
+            'first_round_at': rows[0][0] if rows else None,
+            'last_round_at': rows[-1][0] if rows else None,
+            'destination_loss_pct': round(100.0 * sum(1 for row in rows if not row[2]) / len(rows), 1) if rows else None,
+            'hops': hops
+        }
+
+class PathMonitor:
+    """One registered target of the PathMonitorManager."""
+
+    __slots__ = ('target', 'interval', 'max_hops', 'series', 'created_at', 'address', 'engine', 'last_error',
+                 'path_length', 'future')
+
+    def __init__(self, target, interval, max_hops, history_size):
+        self.target = target
+        self.interval = interval
+        self.max_hops = max_hops
+        self.series = PathSeries(max_hops, history_size)
+        self.created_at = time.time()
+        self.address = None
+        self.engine = None
+        self.last_error = None
+        self.path_length = None
+        self.future = None
+
+    def info(self):
+        return {
+            'target': self.target,
+            'address': self.address,
+            'engine': self.engine,
+            'interval': self.interval,
+            'max_hops': self.max_hops,
+            'history_size': self.series.capacity,
+            'rounds': self.series.rounds,
+            'created_at': self.created_at,
+            'last_error': self.last_error,
+            'memory_bytes': self.series.memory_bytes
+        }
+
+class PathMonitorManager:
+    """
+    MTR-style continuous path monitoring. Each registered target is traced once per interval with
+    one probe per hop, and the rounds are kept in a fixed-size PathSeries. All monitors run as
+    tasks on the diagnostics loop and share the traceroute prober socket; at most `concurrency`
+    rounds are in flight at once, and starts are spread over the interval to avoid bursts.
+    """
+
+    def __init__(self, targets, interval, history_size, max_targets, concurrency):
+        self.initial_targets = targets
+        self.interval = interval
+        self.history_size = max(1, history_size)
+        self.max_targets = max_targets
+        self.concurrency = max(1, concurrency)
+        self._monitors = {}
+        self._semaphore = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Registers the configured PATH_MONITOR_TARGETS once; later calls are no-ops."""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for target in self.initial_targets:
+            _, error = self.add(target)
+            if error:
+                logging.warning(f"Path monitor for {target} not started: {error}")
+
+    def add(self, target, interval=None, max_hops=None):
+        """
+        Registers a target, or updates the interval of an existing monitor (its history is kept).
+        Returns (monitor info, error message).
+        """
+        if not target or not is_valid_target(target):
+            return None, "Invalid target format"
+        interval = float(interval or self.interval)
+        if not math.isfinite(interval) or not PATH_MONITOR_MIN_INTERVAL <= interval <= PATH_MONITOR_MAX_INTERVAL:
+            return None, (f"interval must be between {PATH_MONITOR_MIN_INTERVAL:g} and "
+                          f"{PATH_MONITOR_MAX_INTERVAL:g} seconds")
+        max_hops = int(max_hops or TRACEROUTE_MAX_HOPS)
+        if not 1 <= max_hops <= 64:
+            return None, "max_hops must be between 1 and 64"
+
+        with self._lock:
+            monitor = self._monitors.get(target)
+            if monitor is not None:
+                monitor.interval = interval
+                return monitor.info(), None
+            if len(self._monitors) >= self.max_targets:
+                return None, f"Too many path monitors (maximum {self.max_targets})"
+            monitor = PathMonitor(target, interval, max_hops, self.history_size)
+            self._monitors[target] = monitor
+        monitor.future = asyncio.run_coroutine_threadsafe(self._run(monitor), get_async_loop())
+        logging.info(f"Path monitor started for {target} every {interval:g}s")
+        return monitor.info(), None
+
+    def remove(self, target):
+        """Stops and forgets a monitor. Returns False if the target was not monitored."""
+        with self._lock:
+            monitor = self._monitors.pop(target, None)
+        if monitor is None:
+            return False
+        monitor.future.cancel()
+        logging.info(f"Path monitor stopped for {target}")
+        return True
+
+    def list(self):
+        with self._lock:
+            monitors = list(self._monitors.values())
+        return [monitor.info() for monitor in monitors]
+
+    def query(self, target, window=None, percentiles=(50, 90, 99)):
+        """Returns the monitor info with aggregated per-hop statistics, or None if target is not monitored."""
+        monitor = self._monitors.get(target)
+        if monitor is None:
+            return None
+        since = time.time() - window if window else 0.0
+        return {**monitor.info(), 'window': window, **monitor.series.aggregate(since, percentiles)}
+
+    def samples(self, target, limit=60):
+        """Returns the most recent raw rounds of a monitor (RTTs per hop, None = lost), or None."""
+        monitor = self._monitors.get(target)
+        if monitor is None:
+            return None
+        rows = monitor.series.window()[-limit:]
+        return [{
+            'at': at,
+            'reached': bool(reached),
+            'rtts': [None if math.isnan(rtt) else round(rtt, 3) for rtt in rtts[:length]]
+        } for at, length, reached, rtts in rows]
+
+    def stats(self):
+        with self._lock:
+            monitors = list(self._monitors.values())
+        return {
+            'monitors': len(monitors),
+            'max_targets': self.max_targets,
+            'concurrency': self.concurrency,
+            'memory_bytes': sum(monitor.series.memory_bytes for monitor in monitors)
+        }
+
+    async def _run(self, monitor):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.sleep(random.uniform(0, monitor.interval))
+        while True:
+            started = time.monotonic()
+            async with self._semaphore:
+                await self._round(monitor)
+            await asyncio.sleep(max(0.0, monitor.interval - (time.monotonic() - started)))
+
+    async def _round(self, monitor):
+        try:
+            # Like mtr, stop probing a few hops past a destination that answered in the previous round
+            max_hops = monitor.max_hops
+            if monitor.path_length:
+                max_hops = min(max_hops, monitor.path_length + 2)
+            result = await _prepare_traceroute(monitor.target, max_hops, probes=1)
+            if not result.error:
+                async for _ in _trace_into(result, names=False):
+                    pass
+            monitor.address, monitor.engine, monitor.last_error = result.address, result.engine, result.error
+            monitor.series.record(time.time(), result.hops, result.reached)
+            monitor.path_length = result.hops[-1].ttl if result.reached else None
+            for hop in result.hops:
+                if hop.address and hop.address not in monitor.series.names:
+                    if len(monitor.series.names) >= 4 * monitor.max_hops:
+                        monitor.series.names.clear()
+                    monitor.series.names[hop.address] = await _hop_name(hop.address)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(f"Path monitor round for {monitor.target} failed")
+            monitor.last_error = str(e)
+
+PATH_MONITORS = PathMonitorManager(
+    PATH_MONITOR_TARGETS,
+    PATH_MONITOR_INTERVAL,
+    PATH_MONITOR_HISTORY_SIZE,
+    PATH_MONITOR_MAX_TARGETS,
+    PATH_MONITOR_CONCURRENCY
+)
+
+# --- API Tool Handlers (shared by the Flask routes and the ASGI application) ---
+
+def _api_target(params):
+    """Extracts and validates the target parameter. Returns (target, error_response)."""
+    target = str(params.get('target') or '').strip()
+    if not target:
+        return target, ({"error": "Target parameter required"}, 400)
+    if not is_valid_target(target):
+        return target, ({"error": "Invalid target format"}, 400)
+    return target, None
+
+def _api_format(params):
+    """Extracts the output format parameter ('text' or 'json'). Returns (format, error_response)."""
+    output_format = str(params.get('format') or 'text').strip().lower()
+    if output_format not in ('text', 'json'):
+        return output_format, ({"error": "format must be 'text' or 'json'"}, 400)
+    return output_format, None
+
+def _api_flag(params, name):
+    """Reads a boolean API parameter; accepts JSON booleans and 1/true/on/yes strings."""
+    return str(params.get(name, '')).lower() in ('1', 'true', 'on', 'yes')
+
+def _api_result(payload, result, formatter, output_format):
+    """
+    Adds a tool result to an API payload: the structured fields under "data" for format=json,
+    otherwise the formatted text under "result".
+    """
+    if output_format == 'json':
+        payload['data'] = result.to_dict()
+    else:
+        payload['result'] = formatter(result)
+    payload['timestamp'] = datetime.datetime.utcnow().isoformat() + 'Z'
+    return payload, 200
+
+async def _api_nslookup(params):
+    target, error = _api_target(params)
+    output_format, format_error = _api_format(params)
+    if error or format_error:
+        return error or format_error
+    dns_server = str(params.get('dns_server') or DNS_SERVERS[0]).strip()
+    result = await nslookup_result_async(target, dns_server)
+    return _api_result({
+        "success": True,
+        "target": target,
+        "dns_server": dns_server
+    }, result, format_nslookup_output, output_format)
+
+async def _api_ping(params):
+    target, error = _api_target(params)
+    output_format, format_error = _api_format(params)
+    if error or format_error:
+        return error or format_error
+    try:
+        count = int(params.get('count', 4))
+    except (TypeError, ValueError):
+        return {"error": "Invalid count"}, 400
+    if not 1 <= count <= 100:
+        return {"error": "Count must be between 1 and 100"}, 400
+    result = await ping_result_async(target, count=count)
+    return _api_result({
+        "success": True,
+        "target": target,
+        "count": count,
+        "stats": result.stats.to_dict() if result.stats else None
+    }, result, format_ping_result, output_format)
+
+async def _api_dig(params):
+    target, error = _api_target(params)
+    output_format, format_error = _api_format(params)
+    if error or format_error:
+        return error or format_error
+    dig_type = str(params.get('type') or 'A').strip().upper()
+    dns_server = params.get('dns_server') or None
+    try:
+        dns.rdatatype.from_text(dig_type)
+    except dns.exception.DNSException:
+        return {"error": f"Unsupported record type '{dig_type}'"}, 400
+    try:
+        bufsize = int(params['bufsize']) if params.get('bufsize') else None
+    except (TypeError, ValueError):
+        return {"error": "Invalid bufsize"}, 400
+    if bufsize is not None and not 512 <= bufsize <= 65535:
+        return {"error": "bufsize must be between 512 and 65535"}, 400
+    result = await dig_result_async(target, dig_type=dig_type, dns_server=dns_server, dnssec=_api_flag(params, 'dnssec'),
+                                    cd=_api_flag(params, 'cd'), trace=_api_flag(params, 'trace'),
+                                    tcp=_api_flag(params, 'tcp'), bufsize=bufsize)
+    return _api_result({
+        "success": True,
+        "target": target,
+        "type": dig_type,
+        "dns_server": dns_server or "System Default"
+    }, result, format_dig_result, output_format)
+
+def _traceroute_options(params):
+    """Parses the optional max_hops, probes and timeout traceroute parameters. Returns (options, error)."""
+    try:
+        options = {
+            'max_hops': int(params['max_hops']) if params.get('max_hops') else None,
+            'probes': int(params['probes']) if params.get('probes') else None,
+            'timeout': float(params['timeout']) if params.get('timeout') else None
+        }
+    except (TypeError, ValueError):
+        return None, ({"error": "max_hops, probes and timeout must be numbers"}, 400)
+    if options['max_hops'] is not None and not 1 <= options['max_hops'] <= 64:
+        return None, ({"error": "max_hops must be between 1 and 64"}, 400)
+    if options['probes'] is not None and not 1 <= options['probes'] <= 10:
+        return None, ({"error": "probes must be between 1 and 10"}, 400)
+    if options['timeout'] is not None and not 0 < options['timeout'] <= 10:
+        return None, ({"error": "timeout must be between 0 and 10 seconds"}, 400)
+    return options, None
+
+async def _api_traceroute(params):
+    target, error = _api_target(params)
+    output_format, format_error = _api_format(params)
+    options, options_error = _traceroute_options(params)
+    if error or format_error or options_error:
+        return error or format_error or options_error
+    result = await traceroute_result_async(target, **options)
+    return _api_result({
+        "success": True,
+        "target": target
+    }, result, format_traceroute_result, output_format)
+
+async def _api_netconnection(params):
+    protocol = str(params.get('protocol') or 'tcp').lower()
+    if str(params.get('mode') or '').lower() == 'scan':
+        return await _api_port_scan(params, protocol)
+
+    target, error = _api_target(params)
+    output_format, format_error = _api_format(params)
+    if error or format_error:
+        return error or format_error
+    try:
+        port = int(params.get('port', 443))
+    except (TypeError, ValueError):
+        return {"error": "Invalid port"}, 400
+    if not 1 <= port <= 65535:
+        return {"error": "Port number must be between 1 and 65535"}, 400
+    result = await netconnection_result_async(target, port, protocol)
+    return _api_result({
+        "success": True,
+        "target": target,
+        "port": port,
+        "protocol": protocol
+    }, result, format_netconnection_result, output_format)
+
+async def _api_port_scan(params, protocol):
+    if protocol != 'tcp':
+        return {"error": "Port scans only support the tcp protocol"}, 400
+    output_format, format_error = _api_format(params)
+    if format_error:
+        return format_error
+    try:
+        timeout = float(params['timeout']) if params.get('timeout') not in (None, '') else None
+        retries = int(params['retries']) if params.get('retries') not in (None, '') else None
+    except (TypeError, ValueError):
+        return {"error": "timeout and retries must be numbers"}, 400
+    if timeout is not None and not 0 < timeout <= SCAN_MAX_TIMEOUT:
+        return {"error": f"timeout must be between 0 and {SCAN_MAX_TIMEOUT:g} seconds"}, 400
+    if retries is not None and not 0 <= retries <= SCAN_MAX_RETRIES:
+        return {"error": f"retries must be between 0 and {SCAN_MAX_RETRIES}"}, 400
+    try:
+        hosts = parse_host_list(params.get('hosts') or params.get('target') or '')
+        ports = parse_port_spec(params.get('ports') or params.get('port') or '')
+        scan = await scan_tcp_ports_async(hosts, ports, timeout=timeout, retries=retries,
+                                          parallelism=params.get('parallelism'))
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}, 400
+    payload = {
+        "success": True,
+        "mode": "scan",
+        "hosts": hosts,
+        "protocol": protocol,
+        "scan": scan
+    }
+    if output_format == 'text':
+        payload['result'] = format_port_scan(scan)
+    payload['timestamp'] = datetime.datetime.utcnow().isoformat() + 'Z'
+    return payload, 200
+
+async def _api_compare(params):
+    target, error = _api_target(params)
+    output_format, format_error = _api_format(params)
+    if error or format_error:
+        return error or format_error
+    record_type = str(params.get('type') or 'A').strip().upper()
+    try:
+        dns.rdatatype.from_text(record_type)
+    except dns.exception.DNSException:
+        return {"error": f"Unsupported record type '{record_type}'"}, 400
+    try:
+        servers = parse_host_list(params['servers']) if params.get('servers') else None
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    try:
+        timeout = float(params['timeout']) if params.get('timeout') else None
+    except (TypeError, ValueError):
+        return {"error": "Invalid timeout"}, 400
+    if servers is not None and len(servers) > COMPARE_MAX_SERVERS:
+        return {"error": f"Too many servers (maximum {COMPARE_MAX_SERVERS})"}, 400
+    if timeout is not None and not 0 < timeout <= 30:
+        return {"error": "timeout must be between 0 and 30 seconds"}, 400
+    result = await compare_resolvers_async(target, record_type, servers, timeout=timeout)
+    return _api_result({
+        "success": True,
+        "target": target,
+        "type": record_type,
+        "servers": result.servers
+    }, result, format_resolver_comparison, output_format)
+
+def parse_traceroute_stream(params, accept=''):
+    """
+    Validates a streamed traceroute request. Returns ((mimetype, event generator), None),
+    or (None, (payload, status)) for an invalid request.
+    """
+    target, error = _api_target(params)
+    options, options_error = _traceroute_options(params)
+    if error or options_error:
+        return None, error or options_error
+    stream_format = str(params.get('format') or ('sse' if 'text/event-stream' in accept else 'ndjson')).lower()
+    if stream_format not in ('ndjson', 'sse'):
+        return None, ({"error": "format must be ndjson or sse"}, 400)
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    return (mimetype, traceroute_events_async(target, **options)), None
+
+def format_traceroute_event(event, mimetype):
+    """Encodes one traceroute event as an NDJSON line or a Server-Sent Event."""
+    if mimetype == 'text/event-stream':
+        return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    return json.dumps(event) + '\n'
+
+def parse_sweep_request(params):
+    """
+    Validates a subnet sweep request. Returns ((mimetype, line generator), None),
+    or (None, (payload, status)) for an invalid request.
+    """
+    try:
+        networks = parse_sweep_networks(params.get('networks') or params.get('target') or '')
+        ports = parse_port_spec(params['ports']) if params.get('ports') else None
+        timeout = float(params['timeout']) if params.get('timeout') else None
+        concurrency = int(params['concurrency']) if params.get('concurrency') else None
+    except (TypeError, ValueError) as e:
+        return None, ({"error": str(e)}, 400)
+    liveness = str(params.get('liveness') or 'none').lower()
+    output_format = str(params.get('format') or 'ndjson').lower()
+    if liveness not in ('none', 'icmp', 'tcp'):
+        return None, ({"error": "liveness must be none, icmp or tcp"}, 400)
+    if output_format not in ('ndjson', 'csv'):
+        return None, ({"error": "format must be ndjson or csv"}, 400)
+    if timeout is not None and not 0 < timeout <= 10:
+        return None, ({"error": "timeout must be between 0 and 10 seconds"}, 400)
+    if ports is not None and len(ports) > SWEEP_MAX_PORTS:
+        return None, ({"error": f"Too many liveness ports (maximum {SWEEP_MAX_PORTS})"}, 400)
+    dns_server = str(params.get('dns_server') or DNS_SERVERS[0]).strip()
+
+    results = sweep_async(networks, dns_server, None if liveness == 'none' else liveness, ports, timeout, concurrency)
+
+    async def lines():
+        if output_format == 'csv':
+            yield SWEEP_CSV_HEADER + '\n'
+        try:
+            async for result in results:
+                yield (format_sweep_result_csv(result) if output_format == 'csv' else json.dumps(result.to_dict())) + '\n'
+        finally:
+            await results.aclose()
+
+    return ('text/csv' if output_format == 'csv' else 'application/x-ndjson', lines()), None
+
+API_TOOLS = {
+    'nslookup': _api_nslookup,
+    'ping': _api_ping,
+    'dig': _api_dig,
+    'traceroute': _api_traceroute,
+    'netconnection': _api_netconnection,
+    'compare': _api_compare,
+}
+
+class ApiResponseCache:
+    """
+    Short-lived cache of API tool responses keyed by (tool, normalized parameters), for dashboards
+    that poll the same targets from many clients. Concurrent identical requests share a single
+    in-flight computation. Only 200 responses are kept, for the tool's freshness window; cached
+    payloads are shared between requests and must not be modified.
+    """
+
+    CACHED_TOOLS = ('nslookup', 'dig', 'compare', 'netconnection')
+    CONTROL_PARAMS = ('cache',)
+
+    def __init__(self, enabled=API_CACHE_ENABLED, default_ttl=API_CACHE_TTL, tool_ttls=None, max_entries=API_CACHE_MAX_ENTRIES):
+        self.enabled = enabled
+        self.ttls = {tool: default_ttl for tool in self.CACHED_TOOLS}
+        self.ttls.update(API_CACHE_TOOL_TTLS if tool_ttls is None else tool_ttls)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    def ttl(self, tool):
+        """Freshness window for a tool in seconds; 0 when its responses are not cached."""
+        if not self.enabled or self.max_entries <= 0:
+            return 0
+        return max(0.0, self.ttls.get(tool, 0))
+
+    @classmethod
+    def key(cls, tool, params):
+        """
+        Cache key for a request. Parameter names and scalar values are compared case-insensitively
+        and as strings, so ?count=4 and {"count": 4} share an entry; empty parameters are ignored.
+        """
+        normalized = {}
+        for name, value in params.items():
+            name = str(name).strip().lower()
+            if name in cls.CONTROL_PARAMS or value is None or value == '':
+                continue
+            if not isinstance(value, (list, dict)):
+                value = str(value).strip().lower()
+            normalized[name] = value
+        return tool, json.dumps(normalized, sort_keys=True, default=str)
+
+    async def get_or_compute(self, tool, params, compute, bypass=False):
+        """
+        Returns (payload, status, headers) for a request, awaiting compute() only when there is no
+        fresh entry and no identical computation already in flight. bypass skips the stored entry
+        (the fresh result still replaces it). headers carries Cache-Control and Age for cached tools.
+        """
+        ttl = self.ttl(tool)
+        if ttl <= 0:
+            payload, status = await compute()
+            return payload, status, {}
+
+        key = self.key(tool, params)
+        with self._lock:
+            entry = None if bypass else self._entries.get(key)
+            if entry is not None and entry[2] + ttl > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                task = self._inflight.get(key)
+                if task is not None:
+                    self.coalesced += 1
+                else:
+                    if bypass:
+                        self.bypassed += 1
+                    else:
+                        self.misses += 1
+                    task = asyncio.ensure_future(self._compute(key, ttl, compute))
+                    self._inflight[key] = task
+        if entry is None:
+            # Shielded so a disconnecting client does not cancel the result others are waiting for
+            entry = await asyncio.shield(task)
+
+        payload, status, stored = entry
+        if status != 200:
+            return payload, status, {}
+        age = max(0.0, time.monotonic() - stored)
+        return payload, status, {'Cache-Control': f"max-age={math.ceil(ttl)}", 'Age': str(int(age))}
 
-        with open(temp_path, 'r') as f:
-            content = f.read()
+    async def _compute(self, key, ttl, compute):
+        try:
+            payload, status = await compute()
+            entry = (payload, status, time.monotonic())
+            if status == 200:
+                with self._lock:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return entry
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
-        targets = []
-        for line in content.splitlines():
-            targets.extend([t.strip() for t in re.split(r'[,\s]+', line) if t.strip()])
+    def stats(self):
+        """Returns a snapshot of the cache counters."""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'in_flight': len(self._inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'bypassed': self.bypassed
+            }
 
-        targets = [t for t in targets if is_valid_target(t)]
+API_CACHE = ApiResponseCache()
 
-        output_data = []
-        output_data.append("Target,Resolved_Name,Resolved_IP,Ping_Result,Reverse_Lookup_PTR")
+async def api_tool_response_async(tool, params, bypass_cache=False):
+    """
+    Validates the parameters for an API tool and returns (payload, status_code, headers), answering
+    from the response cache when the tool is cached. A "cache" parameter of 0/false also bypasses it.
+    """
+    handler = API_TOOLS.get(tool)
+    if handler is None:
+        return {"error": f"Unknown tool '{tool}'"}, 400, {}
+    bypass_cache = bypass_cache or str(params.get('cache', '')).lower() in ('0', 'false', 'no', 'off')
+    return await API_CACHE.get_or_compute(tool, params, lambda: handler(params), bypass=bypass_cache)
 
-        for target in targets:
-            ns_result_text = run_nslookup(target, dns_server)
-            ip_matches = re.findall(r'Address: ([\d\.]+)', ns_result_text)
-            
-            ips_str = '; '.join(ip_matches) if ip_matches else 'N/A'
-            first_ip = ip_matches[0] if ip_matches else 'N/A'
+async def run_api_tool_async(tool, params):
+    """
+    Validates the parameters for an API tool, runs it and returns (payload, status_code).
+    """
+    payload, status, _ = await api_tool_response_async(tool, params)
+    return payload, status
 
-            name_match = re.search(r'Name: (.+)', ns_result_text)
-            name = name_match.group(1).strip() if name_match else 'N/A'
+async def run_batch_async(jobs, concurrency):
+    """
+    Runs a list of (tool, target, options) API jobs with at most `concurrency` in flight.
+    Yields one result per job in completion order; each result carries the job's index.
+    """
+    async def run_job(indexed_job):
+        index, job = indexed_job
+        params = dict(job.get('options') or {})
+        params['target'] = job.get('target', '')
+        payload, status = await run_api_tool_async(job.get('tool'), params)
+        return {"index": index, "tool": job.get('tool'), "status": status, **payload}
 
-            ping_result = 'N/A'
-            if should_ping and first_ip != 'N/A':
-                ping_output = run_ping(first_ip, count=1)
-                ping_match = re.search(r'TTL=\d+', ping_output)
-                ping_result = 'Success' if ping_match else 'Failed'
-            
-            ptr_record = 'N/A'
-            if should_reverse_lookup and first_ip != 'N/A':
-                ptr_record = run_reverse_lookup(first_ip, dns_server)
+    async for result in iterate_bounded(run_job, enumerate(jobs), concurrency):
+        yield result
 
-            output_data.append(f'"{target}","{name}","{ips_str}","{ping_result}","{ptr_record}"')
+async def collect_batch_async(jobs, concurrency):
+    """Runs a batch to completion and returns the results in job order."""
+    results = [result async for result in run_batch_async(jobs, concurrency)]
+    return sorted(results, key=lambda result: result['index'])
 
-        bulk_output = "\n".join(output_data)
+def is_valid_batch_job(job):
+    """True for a job object with a string tool, a string or numeric target and an optional options object."""
+    if not isinstance(job, dict) or not isinstance(job.get('tool'), str):
+        return False
+    target = job.get('target', '')
+    if isinstance(target, bool) or not isinstance(target, (str, int, float)):
+        return False
+    return isinstance(job.get('options') or {}, dict)
 
-        output_filename = 'bulk_nslookup_result_' + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.csv'
-        session['bulk_file'] = output_filename
+def parse_batch_request(data):
+    """
+    Validates a batch request body.
+    Returns (jobs, concurrency, error_response); error_response is None when the request is valid.
+    """
+    jobs = data.get('jobs') if isinstance(data, dict) else None
+    if not isinstance(jobs, list) or not jobs:
+        return None, None, ({"error": "A non-empty 'jobs' list is required"}, 400)
+    if len(jobs) > BATCH_MAX_JOBS:
+        return None, None, ({"error": f"Too many jobs (maximum {BATCH_MAX_JOBS})"}, 400)
+    if not all(is_valid_batch_job(job) for job in jobs):
+        return None, None, ({"error": "Each job must be an object with 'tool', 'target' and optional 'options'"}, 400)
+    try:
+        concurrency = int(data.get('concurrency') or BATCH_MAX_CONCURRENCY)
+    except (TypeError, ValueError):
+        return None, None, ({"error": "Invalid concurrency"}, 400)
+    return jobs, max(1, min(concurrency, BATCH_MAX_CONCURRENCY)), None
 
-        final_path = os.path.join(BULK_RESULTS_DIR, output_filename)
-        with open(final_path, 'w') as f:
-            f.write(bulk_output)
+def _request_params():
+    """Returns the API parameters of the current Flask request (JSON body for POST, query string for GET)."""
+    if request.method == 'POST':
+        return request.get_json(silent=True) or {}
+    return request.args.to_dict()
 
-        return bulk_output
+def _bypasses_cache(cache_control):
+    """True when a request's Cache-Control header asks for a fresh response."""
+    directives = {part.strip().lower() for part in (cache_control or '').split(',')}
+    return bool(directives & {'no-cache', 'no-store', 'max-age=0'})
 
-    except Exception as e:
-        logging.exception("Error during bulk NSLookup processing")
-        return f"An error occurred during bulk processing: {str(e)}"
-    finally:
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
+def _api_tool_response(tool):
+    """Runs an API tool for the current Flask request and returns its JSON response with the cache headers."""
+    payload, status, headers = run_async(api_tool_response_async(
+        tool, _request_params(), _bypasses_cache(request.headers.get('Cache-Control'))))
+    return jsonify(payload), status, headers
 
 # --- API Routes for Programmatic Access ---
 
@@ -482,29 +4166,7 @@ def api_nslookup():
     GET: ?target=hostname&dns_server=8.8.8.8 (dns_server optional)
     POST: {"target": "hostname", "dns_server": "8.8.8.8"} (dns_server optional)
     """
-    if request.method == 'POST':
-        data = request.get_json() or {}
-        target = data.get('target', '').strip()
-        dns_server = data.get('dns_server', DNS_SERVERS[0]).strip()
-    else:
-        target = request.args.get('target', '').strip()
-        dns_server = request.args.get('dns_server', DNS_SERVERS[0]).strip()
-    
-    if not target:
-        return jsonify({"error": "Target parameter required"}), 400
-    
-    if not is_valid_target(target):
-        return jsonify({"error": "Invalid target format"}), 400
-    
-    result = run_nslookup(target, dns_server)
-    
-    return jsonify({
-        "success": True,
-        "target": target,
-        "dns_server": dns_server,
-        "result": result,
-        "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'
-    })
+    return _api_tool_response('nslookup')
 
 @app.route('/api/ping', methods=['GET', 'POST'])
 def api_ping():
@@ -513,91 +4175,59 @@ def api_ping():
     GET: ?target=hostname&count=4
     POST: {"target": "hostname", "count": 4}
     """
-    if request.method == 'POST':
-        data = request.get_json() or {}
-        target = data.get('target', '').strip()
-        count = int(data.get('count', 4))
-    else:
-        target = request.args.get('target', '').strip()
-        count = int(request.args.get('count', 4))
-    
-    if not target:
-        return jsonify({"error": "Target parameter required"}), 400
-    
-    if not is_valid_target(target):
-        return jsonify({"error": "Invalid target format"}), 400
-    
-    result = run_ping(target, count=count)
-    
-    return jsonify({
-        "success": True,
-        "target": target,
-        "count": count,
-        "result": result,
-        "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'
-    })
+    return _api_tool_response('ping')
 
 @app.route('/api/dig', methods=['GET', 'POST'])
 def api_dig():
     """
     API endpoint for Dig queries.
-    GET: ?target=hostname&type=A&dns_server=8.8.8.8
-    POST: {"target": "hostname", "type": "A", "dns_server": "8.8.8.8"}
+    GET: ?target=hostname&type=A&dns_server=8.8.8.8 (optional: dnssec=1, cd=1, trace=1, tcp=1, bufsize=4096)
+    POST: {"target": "hostname", "type": "A", "dns_server": "8.8.8.8", "dnssec": true}
     """
-    if request.method == 'POST':
-        data = request.get_json() or {}
-        target = data.get('target', '').strip()
-        dig_type = data.get('type', 'A').strip().upper()
-        dns_server = data.get('dns_server', None)
-    else:
-        target = request.args.get('target', '').strip()
-        dig_type = request.args.get('type', 'A').strip().upper()
-        dns_server = request.args.get('dns_server', None)
-    
-    if not target:
-        return jsonify({"error": "Target parameter required"}), 400
-    
-    if not is_valid_target(target):
-        return jsonify({"error": "Invalid target format"}), 400
-    
-    result = run_dig(target, dig_type=dig_type, dns_server=dns_server)
-    
-    return jsonify({
-        "success": True,
-        "target": target,
-        "type": dig_type,
-        "dns_server": dns_server or "System Default",
-        "result": result,
-        "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'
-    })
+    return _api_tool_response('dig')
 
 @app.route('/api/traceroute', methods=['GET', 'POST'])
 def api_traceroute():
     """
     API endpoint for Traceroute queries.
-    GET: ?target=hostname
+    GET: ?target=hostname (optional: max_hops=30, probes=3, timeout=3)
     POST: {"target": "hostname"}
     """
-    if request.method == 'POST':
-        data = request.get_json() or {}
-        target = data.get('target', '').strip()
-    else:
-        target = request.args.get('target', '').strip()
-    
-    if not target:
-        return jsonify({"error": "Target parameter required"}), 400
-    
-    if not is_valid_target(target):
-        return jsonify({"error": "Invalid target format"}), 400
-    
-    result = run_traceroute(target)
-    
-    return jsonify({
-        "success": True,
-        "target": target,
-        "result": result,
-        "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'
-    })
+    return _api_tool_response('traceroute')
+
+@app.route('/api/traceroute/stream', methods=['GET', 'POST'])
+def api_traceroute_stream():
+    """
+    Streams a traceroute hop by hop as each hop is discovered.
+    GET: ?target=hostname (optional: max_hops=30, probes=3, timeout=3, format=ndjson|sse)
+    POST: {"target": "hostname", "max_hops": 30}
+    Emits NDJSON events by default, or Server-Sent Events with format=sse or Accept: text/event-stream.
+    """
+    params = _request_params()
+    events, error = parse_traceroute_stream(params, request.headers.get('Accept', ''))
+    if error:
+        return jsonify(error[0]), error[1]
+    mimetype, agen = events
+    return Response((format_traceroute_event(event, mimetype) for event in iterate_async(agen)),
+                    mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/sweep', methods=['GET', 'POST'])
+def api_sweep():
+    """
+    Streams a subnet sweep: a PTR lookup, and optionally a liveness probe, for every address of the given CIDR blocks.
+    GET: ?networks=192.0.2.0/24,2001:db8::/120 (optional: dns_server, liveness=none|icmp|tcp, ports=22,443,
+         timeout=1, concurrency=256, format=ndjson|csv)
+    POST: {"networks": ["10.1.0.0/16"], "liveness": "tcp", "ports": "22,443"}
+    Results are streamed in completion order as soon as each address is done.
+    """
+    lines, error = parse_sweep_request(_request_params())
+    if error:
+        return jsonify(error[0]), error[1]
+    mimetype, agen = lines
+    headers = {'X-Accel-Buffering': 'no'}
+    if mimetype == 'text/csv':
+        headers['Content-Disposition'] = 'attachment;filename=sweep_result.csv'
+    return Response(iterate_async(agen), mimetype=mimetype, headers=headers)
 
 @app.route('/api/netconnection', methods=['GET', 'POST'])
 def api_netconnection():
@@ -605,34 +4235,162 @@ def api_netconnection():
     API endpoint for Network Connection testing.
     GET: ?target=hostname&port=443&protocol=tcp
     POST: {"target": "hostname", "port": 443, "protocol": "tcp"}
+    Scan mode: ?mode=scan&hosts=host1,host2&ports=22,80,8000-8100&timeout=1&retries=1&parallelism=256
     """
-    if request.method == 'POST':
-        data = request.get_json() or {}
-        target = data.get('target', '').strip()
-        port = int(data.get('port', 443))
-        protocol = data.get('protocol', 'tcp').lower()
-    else:
-        target = request.args.get('target', '').strip()
-        port = int(request.args.get('port', 443))
-        protocol = request.args.get('protocol', 'tcp').lower()
-    
-    if not target:
-        return jsonify({"error": "Target parameter required"}), 400
-    
-    if not is_valid_target(target):
-        return jsonify({"error": "Invalid target format"}), 400
-    
-    result = run_test_netconnection(target, port, protocol)
-    
+    return _api_tool_response('netconnection')
+
+@app.route('/api/compare', methods=['GET', 'POST'])
+def api_compare():
+    """
+    API endpoint comparing the answers of several resolvers for the same query, all queried at once.
+    GET: ?target=hostname&type=A&servers=8.8.8.8,1.1.1.1 (servers defaults to the configured DNS servers)
+    POST: {"target": "hostname", "type": "A", "servers": ["8.8.8.8", "1.1.1.1"], "timeout": 2}
+    """
+    return _api_tool_response('compare')
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """
+    API endpoint for running many diagnostics in a single request.
+    POST: {"jobs": [{"tool": "nslookup", "target": "hostname", "options": {"dns_server": "8.8.8.8"}}, ...],
+           "concurrency": 20, "stream": false}
+    tool is one of nslookup, ping, dig, traceroute, netconnection; options are the tool's API parameters.
+    With "stream": true (or Accept: application/x-ndjson) results are streamed as NDJSON in completion order.
+    """
+    data = request.get_json(silent=True) or {}
+    jobs, concurrency, error = parse_batch_request(data)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    if data.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        lines = (json.dumps(result) + '\n' for result in iterate_async(run_batch_async(jobs, concurrency)))
+        return Response(lines, mimetype='application/x-ndjson')
+
+    results = run_async(collect_batch_async(jobs, concurrency))
     return jsonify({
         "success": True,
-        "target": target,
-        "port": port,
-        "protocol": protocol,
-        "result": result,
+        "count": len(results),
+        "results": results,
         "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'
     })
 
+@app.route('/api/bulk-nslookup', methods=['POST'])
+def api_bulk_nslookup():
+    """
+    API endpoint for streamed bulk NSLookup.
+    POST multipart/form-data with a 'csvfile' upload, or a raw text/csv body of hostnames.
+    Query/form parameters: dns_server, ping=1, reverse=1, format=csv|ndjson.
+    Rows are streamed back in input order as soon as they are resolved.
+    """
+    options = request.values
+    dns_server = options.get('dns_server', DNS_SERVERS[0]).strip()
+    should_ping = options.get('ping', '').lower() in ('1', 'true', 'on', 'yes')
+    should_reverse_lookup = options.get('reverse', '').lower() in ('1', 'true', 'on', 'yes')
+    output_format = options.get('format', 'csv').lower()
+    if output_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    upload = request.files.get('csvfile')
+    if upload:
+        # Uploaded files are closed with the request, before a streamed response finishes
+        os.makedirs(BULK_RESULTS_DIR, exist_ok=True)
+        temp_path = os.path.join(BULK_RESULTS_DIR, str(uuid.uuid4()) + '.csv')
+        upload.save(temp_path)
+        targets = iter_bulk_targets_from_file(temp_path, remove=True)
+    else:
+        targets = iter_bulk_targets(request.stream)
+    rows = iter_bulk_nslookup(targets, dns_server, should_ping, should_reverse_lookup)
+
+    if output_format == 'ndjson':
+        body = (json.dumps(row) + '\n' for row in rows)
+        return Response(stream_with_context(body), mimetype='application/x-ndjson')
+
+    def csv_lines():
+        yield BULK_CSV_HEADER + '\n'
+        for row in rows:
+            yield format_bulk_row_csv(row) + '\n'
+
+    return Response(stream_with_context(csv_lines()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment;filename=bulk_nslookup_result.csv'})
+
+@app.route('/api/bulk-jobs', methods=['POST'])
+def api_bulk_jobs_submit():
+    """
+    Submits a bulk NSLookup job to the background worker pool.
+    POST multipart/form-data with a 'csvfile' upload (or a raw text/csv body of hostnames).
+    Query/form parameters: dns_server, ping=1, reverse=1.
+    Returns the job status, including its id, with HTTP 202.
+    """
+    BULK_JOBS.start()
+    options = request.values
+    upload = request.files.get('csvfile')
+    job = BULK_JOBS.submit(
+        upload.stream if upload else request.stream,
+        options.get('dns_server', DNS_SERVERS[0]).strip(),
+        options.get('ping', '').lower() in ('1', 'true', 'on', 'yes'),
+        options.get('reverse', '').lower() in ('1', 'true', 'on', 'yes'),
+        filename=upload.filename if upload else None
+    )
+    return jsonify(job), 202
+
+@app.route('/api/bulk-jobs/<job_id>')
+def api_bulk_job_status(job_id):
+    """Returns job progress: status, done/total, percent, throughput (rows/s) and eta_seconds."""
+    BULK_JOBS.start()
+    job = BULK_JOBS.status(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/bulk-jobs/<job_id>/results')
+def api_bulk_job_results(job_id):
+    """
+    Returns completed rows of a job, including partial results while it is still running.
+    GET: ?offset=0&limit=100 (limit at most 1000)
+    """
+    if BULK_JOBS.status(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+    rows = BULK_JOBS.read_results(job_id, offset, limit)
+    return jsonify({"job_id": job_id, "offset": offset, "count": len(rows), "results": rows})
+
+@app.route('/api/bulk-jobs/<job_id>/cancel', methods=['POST'])
+def api_bulk_job_cancel(job_id):
+    """Cancels a queued or running job. Rows completed so far are kept."""
+    job = BULK_JOBS.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/bulk-jobs/<job_id>/download')
+def api_bulk_job_download(job_id):
+    """Streams the finished result CSV of a job."""
+    job = BULK_JOBS.status(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job['status'] not in BulkJobManager.FINISHED:
+        return jsonify({"error": "Job has not finished yet", "status": job['status']}), 409
+    path = BULK_JOBS.results_path(job_id)
+    if not os.path.exists(path):
+        return jsonify({"error": "Job produced no results"}), 404
+    return Response(
+        stream_file(path),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment;filename=bulk_nslookup_result_{job_id}.csv'}
+    )
+
+@app.route('/api/dns-cache')
+def api_dns_cache():
+    """
+    API endpoint exposing the shared DNS answer cache counters.
+    GET: returns entries, hits, misses, hit_rate and evictions, plus the resolver registry counters.
+    """
+    return jsonify({**DNS_CACHE.stats(), 'resolver_registry': RESOLVERS.stats()})
+
 @app.route('/api/docs')
 def api_docs():
     """API documentation page."""
@@ -655,8 +4413,7 @@ def index():
         'port': '443',
         'port_protocol': 'tcp',
         'nslookup_then_ping': False,
-        'result': None,
-        'bulk_results': None
+        'result': None
     }
 
     if request.method == 'POST':
@@ -687,10 +4444,10 @@ def index():
                 result = "Error: Invalid characters in target name."
             else:
                 if tool == 'nslookup':
-                    result = run_nslookup(target, dns_server)
+                    lookup = run_async(nslookup_result_async(target, dns_server))
+                    result = format_nslookup_output(lookup)
                     if nslookup_then_ping:
-                        ip_match = re.search(r'Address: ([\d\.]+)', result)
-                        ip_to_ping = ip_match.group(1) if ip_match else None
+                        ip_to_ping = lookup.addresses[0] if lookup.addresses else None
 
                         ping_result = "Ping skipped (No IP found)."
                         if ip_to_ping:
@@ -703,10 +4460,14 @@ def index():
                     result = run_ping(target)
                 elif tool == 'dig':
                     result = run_dig(target, dig_type, dns_server)
+                elif tool == 'dns-compare':
+                    result = run_dns_compare(target, dig_type)
                 elif tool == 'traceroute':
                     result = run_traceroute(target)
                 elif tool == 'test-netconnection':
-                    if not port.isdigit() or not (1 <= int(port) <= 65535):
+                    if port_protocol == 'tcp' and any(c in port for c in ',-'):
+                        result = run_test_netconnection(target, port, port_protocol, scan=True)
+                    elif not port.isdigit() or not (1 <= int(port) <= 65535):
                         result = "Error: Port number must be between 1 and 65535."
                     else:
                         result = run_test_netconnection(target, port, port_protocol)
@@ -730,7 +4491,7 @@ def index():
 
 @app.route('/bulk-nslookup', methods=['POST'])
 def bulk_nslookup_route():
-    """Route specifically for handling the bulk nslookup file upload."""
+    """Route for the bulk nslookup file upload. Submits the file as a background job and shows its progress."""
     file_storage = request.files.get('csvfile')    
     bulk_dns_server = request.form.get('bulk-dns-server', DNS_SERVERS[0])
     bulk_then_ping = request.form.get('bulk-ping') == 'on'
@@ -745,12 +4506,15 @@ def bulk_nslookup_route():
                              is_development=FLASK_ENV == 'development',
                              canonical_host=CANONICAL_HOST)
 
-    bulk_results = run_bulk_nslookup(file_storage, bulk_dns_server, bulk_then_ping, should_reverse_lookup)
+    BULK_JOBS.start()
+    bulk_job = BULK_JOBS.submit(file_storage.stream, bulk_dns_server, bulk_then_ping, should_reverse_lookup,
+                                filename=file_storage.filename)
+    session['bulk_job'] = bulk_job['id']
 
     return render_template(
         'index.html',
         tool='bulk-nslookup',
-        bulk_results=bulk_results,
+        bulk_job=bulk_job,
         dns_server=bulk_dns_server,
         dns_servers=DNS_SERVERS,
         status_check_host=STATUS_CHECK_HOST,
@@ -760,66 +4524,832 @@ def bulk_nslookup_route():
 
 @app.route('/download-bulk')
 def download_bulk():
+    """Provides the result file of the bulk job started from the web UI for download."""
+    job_id = session.get('bulk_job')
+    if not job_id:
+        return "No bulk result file found.", 404
+    return redirect(f'/api/bulk-jobs/{job_id}/download')
+
+@app.route('/api/dns-status')
+def dns_status():
+    """
+    An API endpoint reporting the status of STATUS_CHECK_HOST (and the DNS servers, when
+    STATUS_CHECK_DNS_SERVERS is enabled) from the shared background monitor.
+    GET: /api/dns-status?history=1 to include the rolling probe history of each host.
+    The frontend polls this endpoint to display the status.
+    """
+    STATUS_MONITOR.start()
+    history = request.args.get('history', '').lower() in ('1', 'true', 'yes')
+    return jsonify(STATUS_MONITOR.snapshot(history))
+
+@app.route('/api/path-monitors', methods=['GET', 'POST'])
+def api_path_monitors():
     """
-    Provides the generated bulk results file for download.
-    Retrieves the filename from the session, reads the file, and serves it as a download.
+    Lists the continuous path monitors (GET) or registers a target (POST).
+    POST: {"target": "hostname", "interval": 60, "max_hops": 30} (interval and max_hops optional)
+    Posting an already monitored target updates its interval and keeps its history.
     """
-    filename = session.get('bulk_file')
-    if not filename:
-        return "No bulk result file found.", 404
+    PATH_MONITORS.start()
+    if request.method == 'GET':
+        return jsonify({**PATH_MONITORS.stats(), "targets": PATH_MONITORS.list()})
+    params = _request_params()
+    try:
+        monitor, error = PATH_MONITORS.add(str(params.get('target') or '').strip(), params.get('interval'),
+                                           params.get('max_hops'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "interval and max_hops must be numbers"}), 400
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(monitor), 201
 
-    file_path = os.path.join(BULK_RESULTS_DIR, filename)
-    if not os.path.exists(file_path):
-        return "Bulk result file not found on disk.", 404
+@app.route('/api/path-monitors/<path:target>', methods=['GET', 'DELETE'])
+def api_path_monitor(target):
+    """
+    GET: per-hop loss, latency and percentiles of a monitored target, MTR-style.
+         ?window=3600 (seconds, default: all stored rounds)&percentiles=50,90,99&samples=60 (raw rounds)
+    DELETE: stops monitoring the target and discards its history.
+    """
+    PATH_MONITORS.start()
+    if request.method == 'DELETE':
+        if not PATH_MONITORS.remove(target):
+            return jsonify({"error": "Path monitor not found"}), 404
+        return jsonify({"target": target, "removed": True})
 
     try:
-        return Response(
-            open(file_path, 'rb').read(),
-            mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment;filename={filename}'}
-        )
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            if 'bulk_file' in session:
-                session.pop('bulk_file')
+        window = float(request.args['window']) if request.args.get('window') else None
+        percentiles = tuple(float(p) for p in request.args.get('percentiles', '50,90,99').split(',') if p.strip())
+        samples = int(request.args.get('samples', 0))
+    except ValueError:
+        return jsonify({"error": "window, percentiles and samples must be numbers"}), 400
+    if not all(0 < p <= 100 for p in percentiles) or len(percentiles) > 10:
+        return jsonify({"error": "percentiles must be up to 10 values between 0 and 100"}), 400
 
-@app.route('/api/dns-status')
-def dns_status():
+    report = PATH_MONITORS.query(target, window, percentiles)
+    if report is None:
+        return jsonify({"error": "Path monitor not found"}), 404
+    if samples > 0:
+        report['samples'] = PATH_MONITORS.samples(target, min(samples, PATH_MONITOR_HISTORY_SIZE))
+    return jsonify(report)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _collect_component_metrics():
+    """Metrics for counters the caches, log writer and monitors already keep."""
+    cache = DNS_CACHE.stats()
+    usage = API_USAGE.stats()
+    api_cache = API_CACHE.stats()
+    return [
+        ('netdiag_dns_cache_lookups_total', 'counter', 'DNS answer cache lookups by result.',
+         [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses'])]),
+        ('netdiag_dns_cache_entries', 'gauge', 'Answers held in the DNS answer cache.', [({}, cache['entries'])]),
+        ('netdiag_dns_cache_evictions_total', 'counter', 'Answers evicted from the full DNS answer cache.', [({}, cache['evictions'])]),
+        ('netdiag_api_usage_log_entries_total', 'counter', 'API usage log entries by result.',
+         [({'result': 'written'}, usage['written']), ({'result': 'dropped'}, usage['dropped'])]),
+        ('netdiag_api_usage_log_queued', 'gauge', 'API usage log entries waiting for the writer.', [({}, usage['queued'])]),
+        ('netdiag_api_cache_requests_total', 'counter', 'Cached API tool requests by result.',
+         [({'result': 'hit'}, api_cache['hits']), ({'result': 'miss'}, api_cache['misses']),
+          ({'result': 'coalesced'}, api_cache['coalesced']), ({'result': 'bypass'}, api_cache['bypassed'])]),
+        ('netdiag_api_cache_entries', 'gauge', 'Responses held in the API response cache.', [({}, api_cache['entries'])]),
+    ] + ([] if WEB_WORKER_FD is not None else [
+        # In worker processes the path monitors run in the supervisor, which reports them
+        ('netdiag_path_monitors', 'gauge', 'Registered path monitors.', [({}, PATH_MONITORS.stats()['monitors'])]),
+    ])
+
+METRICS.add_collector(_collect_component_metrics)
+
+def render_metrics():
+    """The /metrics body. A worker process pushes its own totals and returns the sum over all processes."""
+    if WEB_WORKER_FD is not None:
+        return METRICS_AGGREGATOR.render(os.getpid(), METRICS.families())
+    return METRICS.render()
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text-format metrics: tool and DNS server latency histograms, outcomes, in-flight calls and more."""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Not found"}), 404
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+# --- ASGI Application ---
+
+ASGI_API_ROUTES = {
+    '/api/nslookup': 'nslookup',
+    '/api/ping': 'ping',
+    '/api/dig': 'dig',
+    '/api/traceroute': 'traceroute',
+    '/api/netconnection': 'netconnection',
+    '/api/compare': 'compare',
+}
+
+class DiagnosticsASGIApp:
     """
-    An API endpoint to check the status of the configured STATUS_CHECK_HOST.
-    It caches the result in the user's session for the configured interval to avoid excessive checks.
-    The frontend polls this endpoint to display the status.
+    ASGI variant of the /api/* diagnostic routes. Each request is a coroutine on the
+    diagnostics loop, so thousands of in-flight diagnostics do not need an OS thread each.
+    Other paths are delegated to the Flask app when asgiref is installed.
+    Serve with any ASGI server, e.g. `uvicorn app:asgi_app --port 8080`.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self._wsgi_fallback = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        adopt_async_loop()
+        tool = ASGI_API_ROUTES.get(scope['path'])
+        handler = {
+            '/api/batch': self._batch,
+            '/api/traceroute/stream': self._traceroute_stream,
+            '/api/sweep': self._sweep,
+            '/metrics': self._metrics
+        }.get(scope['path'])
+        if tool is None and handler is None:
+            fallback = self._get_wsgi_fallback()
+            if fallback is not None:
+                # Flask logs API usage for the routes it serves
+                await fallback(scope, receive, send)
+                return
+
+        started = time.perf_counter()
+        response = {'status': None, 'latency_ms': None}
+
+        async def send_and_note_status(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['latency_ms'] = (time.perf_counter() - started) * 1000
+            await send(message)
+
+        try:
+            await (handler or self._tool)(scope, receive, send_and_note_status, tool)
+        finally:
+            route = scope['path'] if tool or handler else 'unmatched'
+            if response['latency_ms'] is not None:
+                HTTP_DURATION.observe(response['latency_ms'] / 1000, (route, scope['method']))
+            HTTP_RESPONSES.inc((route, str(response['status'])))
+            headers = dict(scope.get('headers') or [])
+            if scope['path'] == '/metrics' or not looks_like_api_request(
+                    scope['method'], headers.get(b'content-type', b'').decode('latin-1'), headers.get(b'authorization')):
+                return
+            API_USAGE.record((scope.get('client') or [None])[0], scope['path'], scope['method'],
+                             headers.get(b'user-agent', b'').decode('latin-1'), response['status'],
+                             response['latency_ms'], wait=False)
+
+    async def _tool(self, scope, receive, send, tool):
+        if tool is None:
+            await self._send_json(send, {"error": "Not found"}, 404)
+            return
+        if scope['method'] not in ('GET', 'POST'):
+            await self._send_json(send, {"error": "Method not allowed"}, 405)
+            return
+
+        params = await self._read_params(scope, receive)
+        headers = dict(scope.get('headers') or [])
+        bypass = _bypasses_cache(headers.get(b'cache-control', b'').decode('latin-1'))
+        payload, status, cache_headers = await run_on_async_loop(api_tool_response_async(tool, params, bypass))
+        await self._send_json(send, payload, status, cache_headers)
+
+    async def _batch(self, scope, receive, send, tool=None):
+        if scope['method'] != 'POST':
+            await self._send_json(send, {"error": "Method not allowed"}, 405)
+            return
+        data = await self._read_params(scope, receive)
+        jobs, concurrency, error = parse_batch_request(data)
+        if error:
+            await self._send_json(send, *error)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        if not (data.get('stream') or b'application/x-ndjson' in headers.get(b'accept', b'')):
+            results = await run_on_async_loop(collect_batch_async(jobs, concurrency))
+            await self._send_json(send, {
+                "success": True,
+                "count": len(results),
+                "results": results,
+                "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'
+            }, 200)
+            return
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/x-ndjson')]})
+        agen = run_batch_async(jobs, concurrency)
+        try:
+            while True:
+                try:
+                    result = await run_on_async_loop(_anext(agen))
+                except StopAsyncIteration:
+                    break
+                await send({'type': 'http.response.body', 'body': (json.dumps(result) + '\n').encode('utf-8'), 'more_body': True})
+        finally:
+            await run_on_async_loop(agen.aclose())
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _traceroute_stream(self, scope, receive, send, tool=None):
+        if scope['method'] not in ('GET', 'POST'):
+            await self._send_json(send, {"error": "Method not allowed"}, 405)
+            return
+        params = await self._read_params(scope, receive)
+        headers = dict(scope.get('headers') or [])
+        events, error = parse_traceroute_stream(params, headers.get(b'accept', b'').decode('latin-1'))
+        if error:
+            await self._send_json(send, *error)
+            return
+
+        mimetype, agen = events
+        await self._send_stream(send, mimetype, agen, lambda event: format_traceroute_event(event, mimetype), [(b'cache-control', b'no-cache')])
+
+    async def _sweep(self, scope, receive, send, tool=None):
+        if scope['method'] not in ('GET', 'POST'):
+            await self._send_json(send, {"error": "Method not allowed"}, 405)
+            return
+        lines, error = parse_sweep_request(await self._read_params(scope, receive))
+        if error:
+            await self._send_json(send, *error)
+            return
+        mimetype, agen = lines
+        headers = [(b'content-disposition', b'attachment;filename=sweep_result.csv')] if mimetype == 'text/csv' else []
+        await self._send_stream(send, mimetype, agen, lambda line: line, headers)
+
+    @staticmethod
+    async def _send_stream(send, mimetype, agen, encode, headers=()):
+        """Sends each item of an async generator on the diagnostics loop as a chunk of a streamed response."""
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', mimetype.encode()), *headers]})
+        try:
+            while True:
+                try:
+                    item = await run_on_async_loop(_anext(agen))
+                except StopAsyncIteration:
+                    break
+                await send({'type': 'http.response.body', 'body': encode(item).encode('utf-8'), 'more_body': True})
+        finally:
+            await run_on_async_loop(agen.aclose())
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _metrics(self, scope, receive, send, tool=None):
+        if not METRICS_ENABLED:
+            await self._send_json(send, {"error": "Not found"}, 404)
+            return
+        body = render_metrics().encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', METRICS_CONTENT_TYPE.encode()), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                adopt_async_loop()
+                STATUS_MONITOR.start()
+                PATH_MONITORS.start()
+                BULK_JOBS.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _get_wsgi_fallback(self):
+        if self._wsgi_fallback is None:
+            try:
+                from asgiref.wsgi import WsgiToAsgi
+            except ImportError:
+                return None
+            self._wsgi_fallback = WsgiToAsgi(self.wsgi_app)
+        return self._wsgi_fallback
+
+    @staticmethod
+    async def _read_params(scope, receive):
+        """Returns the request parameters (JSON body for POST, query string for GET)."""
+        if scope['method'] != 'POST':
+            query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+            return {key: values[0] for key, values in query.items()}
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    async def _send_json(send, payload, status, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                       + [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+asgi_app = DiagnosticsASGIApp(app)
+
+# --- Worker Processes ---
+
+def supervisor_manager(address, authkey):
+    """
+    Returns a multiprocessing manager that serves, from the supervisor, the objects whose state must
+    be shared by all worker processes: the status monitor, the path monitors, bulk job execution,
+    the API usage log and the metrics totals. multiprocessing is only imported once workers are in use.
+    """
+    from multiprocessing.managers import BaseManager
+
+    class SupervisorManager(BaseManager):
+        pass
+
+    SupervisorManager.register('status_monitor', callable=lambda: STATUS_MONITOR)
+    SupervisorManager.register('path_monitors', callable=lambda: PATH_MONITORS)
+    SupervisorManager.register('bulk_jobs', callable=lambda: BULK_JOBS)
+    SupervisorManager.register('api_usage_logger', callable=get_api_logger)
+    SupervisorManager.register('metrics', callable=lambda: METRICS_AGGREGATOR)
+    return SupervisorManager(address, authkey)
+
+class SupervisorService:
+    """
+    Stands in for a shared object in a worker process: method calls are forwarded to the
+    supervisor's instance. The connection is opened on first use; each thread gets its own.
+    """
+
+    _manager = None
+    _manager_lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = name
+        self._proxy = None
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return getattr(self._get_proxy(), method)
+
+    def _get_proxy(self):
+        with self._manager_lock:
+            if SupervisorService._manager is None:
+                address, port = os.environ['NETDIAG_SUPERVISOR_ADDRESS'].rsplit(':', 1)
+                manager = supervisor_manager((address, int(port)), bytes.fromhex(os.environ['NETDIAG_SUPERVISOR_AUTHKEY']))
+                manager.connect()
+                SupervisorService._manager = manager
+            if self._proxy is None:
+                self._proxy = getattr(SupervisorService._manager, self.name)()
+            return self._proxy
+
+if WEB_WORKER_FD is not None:
+    STATUS_MONITOR = SupervisorService('status_monitor')
+    PATH_MONITORS = SupervisorService('path_monitors')
+    BULK_JOBS.remote = SupervisorService('bulk_jobs')
+    API_USAGE.logger = SupervisorService('api_usage_logger')
+    METRICS_AGGREGATOR = SupervisorService('metrics')
+
+def serve_worker(fd, supervisor_pid):
+    """
+    Runs one Waitress worker on the listening socket inherited from the supervisor. On SIGTERM,
+    or when the supervisor has gone away, the worker stops accepting connections, lets in-flight
+    requests finish (at most WEB_GRACEFUL_TIMEOUT seconds) and exits.
+    """
+    from waitress import create_server
+
+    server = create_server(app, sockets=[socket.socket(fileno=fd)], threads=WEB_THREADS)
+    stopping = threading.Event()
+
+    def push_metrics():
+        if METRICS_ENABLED:
+            try:
+                METRICS_AGGREGATOR.push(os.getpid(), METRICS.families())
+            except Exception:
+                logging.exception("Pushing metrics to the supervisor failed")
+
+    def stop_accepting():
+        # Unlike server.close(), keeps the trigger (and so server.run()) alive while requests drain.
+        # Closing this process's copy of the socket leaves it open in the other workers.
+        server.accepting = False
+        server.del_channel()
+        server.socket.close()
+
+    def drain():
+        server.trigger.pull_trigger(stop_accepting)
+        deadline = time.monotonic() + WEB_GRACEFUL_TIMEOUT
+        while time.monotonic() < deadline:
+            channels = list(server.active_channels.values())
+            if not any(channel.requests or channel.total_outbufs_len for channel in channels):
+                break
+            time.sleep(0.1)
+        push_metrics()
+        # Ends server.run() in the main thread
+        os.kill(os.getpid(), signal.SIGINT)
+
+    def stop(*_):
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=drain, name='worker-drain', daemon=True).start()
+
+    def watch_supervisor():
+        while not stopping.wait(2):
+            if os.getppid() != supervisor_pid:
+                logging.warning("Supervisor exited; stopping worker")
+                stop()
+
+    def push_metrics_periodically():
+        while not stopping.wait(METRICS_PUSH_INTERVAL):
+            push_metrics()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    threading.Thread(target=watch_supervisor, name='worker-watch', daemon=True).start()
+    threading.Thread(target=push_metrics_periodically, name='worker-metrics', daemon=True).start()
+    logging.info(f"Worker {os.getpid()} serving with {WEB_THREADS} threads")
+    server.run()
+
+class WorkerSupervisor:
+    """
+    Runs `workers` Waitress processes that accept connections from one shared listening socket,
+    so requests are spread over all cores. The supervisor itself serves no requests: it runs the
+    status monitor, path monitors and bulk jobs, writes the API usage log and sums the metrics of
+    all workers (see supervisor_manager). Workers that die are replaced. SIGHUP replaces every
+    worker gracefully, starting the new ones before the old ones finish their in-flight requests;
+    SIGTERM or SIGINT stops all of them.
+    """
+
+    RESPAWN_DELAY = 5.0
+
+    def __init__(self, host, port, workers):
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self._processes = []
+        self._retiring = []
+        self._restart = threading.Event()
+        self._stop = threading.Event()
+        self._env = None
+        self._socket = None
+
+    def run(self):
+        import secrets
+
+        self._socket = socket.create_server((self.host, self.port), backlog=1024)
+        self._socket.set_inheritable(True)
+        authkey = secrets.token_bytes(32)
+        manager = supervisor_manager(('127.0.0.1', 0), authkey)
+        manager_server = manager.get_server()
+        threading.Thread(target=manager_server.serve_forever, name='supervisor-manager', daemon=True).start()
+        self._env = {
+            **os.environ,
+            'NETDIAG_WORKER_FD': str(self._socket.fileno()),
+            'NETDIAG_SUPERVISOR_ADDRESS': f"{manager_server.address[0]}:{manager_server.address[1]}",
+            'NETDIAG_SUPERVISOR_AUTHKEY': authkey.hex(),
+            # Every worker must sign sessions with the same key
+            'SECRET_KEY': os.getenv('SECRET_KEY') or secrets.token_hex(32)
+        }
+
+        STATUS_MONITOR.start()
+        PATH_MONITORS.start()
+        BULK_JOBS.start()
+        signal.signal(signal.SIGHUP, lambda *_: self._restart.set())
+        signal.signal(signal.SIGTERM, lambda *_: self._stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self._stop.set())
+
+        self._processes = [self._spawn() for _ in range(self.workers)]
+        logging.info(f"Supervisor {os.getpid()} started {self.workers} workers on {self.host}:{self.port}")
+        while not self._stop.wait(1):
+            if self._restart.is_set():
+                self._restart.clear()
+                self._replace_all()
+            self._reap()
+        self._shutdown()
+
+    def _spawn(self):
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=self._env,
+                                   pass_fds=(self._socket.fileno(),))
+        process.started_at = time.monotonic()
+        return process
+
+    def _replace_all(self):
+        logging.info("Replacing all workers")
+        old, self._processes = self._processes, [self._spawn() for _ in range(self.workers)]
+        for process in old:
+            process.terminate()
+            process.retire_by = time.monotonic() + WEB_GRACEFUL_TIMEOUT + 5
+        self._retiring.extend(old)
+
+    def _reap(self):
+        for index, process in enumerate(self._processes):
+            if process.poll() is None:
+                continue
+            if time.monotonic() - process.started_at < self.RESPAWN_DELAY:
+                # Crashing right after start: wait before trying again instead of spinning
+                if not hasattr(process, 'respawn_at'):
+                    logging.error(f"Worker {process.pid} exited with {process.returncode} during startup")
+                    process.respawn_at = time.monotonic() + self.RESPAWN_DELAY
+                if time.monotonic() < process.respawn_at:
+                    continue
+            else:
+                logging.warning(f"Worker {process.pid} exited with {process.returncode}; starting a new one")
+            METRICS_AGGREGATOR.retire(process.pid)
+            self._processes[index] = self._spawn()
+        for process in list(self._retiring):
+            if process.poll() is not None:
+                METRICS_AGGREGATOR.retire(process.pid)
+                self._retiring.remove(process)
+            elif time.monotonic() > process.retire_by:
+                process.kill()
+
+    def _shutdown(self):
+        logging.info("Stopping workers")
+        processes = self._processes + self._retiring
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + WEB_GRACEFUL_TIMEOUT + 5
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._socket.close()
+
+# --- Command Line Interface ---
+
+# Tool options of the CLI; each is passed to the API handler under its dest name
+CLI_TOOL_OPTIONS = {
+    'nslookup': (('--dns-server', {'dest': 'dns_server', 'help': 'DNS server (default: the first of DNS_SERVERS)'}),),
+    'ping': (('--count', {'type': int, 'help': 'echo requests per target (default: 4)'}),),
+    'dig': (
+        ('--type', {'help': 'record type (default: A)'}),
+        ('--dns-server', {'dest': 'dns_server', 'help': 'DNS server (default: the system resolver)'}),
+        ('--dnssec', {'action': 'store_true', 'help': 'request DNSSEC records'}),
+        ('--cd', {'action': 'store_true', 'help': 'set the checking disabled flag'}),
+        ('--trace', {'action': 'store_true', 'help': 'trace delegation from the root servers'}),
+        ('--tcp', {'action': 'store_true', 'help': 'query over TCP'}),
+        ('--bufsize', {'type': int, 'help': 'EDNS UDP buffer size'}),
+    ),
+    'traceroute': (
+        ('--max-hops', {'dest': 'max_hops', 'type': int, 'help': 'maximum TTL (1-64)'}),
+        ('--probes', {'type': int, 'help': 'probes per hop (1-10)'}),
+        ('--timeout', {'type': float, 'help': 'seconds to wait for each probe'}),
+    ),
+    'netconnection': (
+        ('--port', {'type': int, 'help': 'port to test (default: 443)'}),
+        ('--protocol', {'choices': ('tcp', 'udp'), 'help': 'default: tcp'}),
+        ('--scan', {'dest': 'mode', 'action': 'store_const', 'const': 'scan',
+                    'help': 'TCP port scan of each target (open, closed or filtered, with latency)'}),
+        ('--ports', {'help': 'ports to scan, e.g. 22,80,8000-8100 (implies --scan)'}),
+        ('--timeout', {'type': float, 'help': f"scan: seconds per connect attempt (default: {SCAN_DEFAULT_TIMEOUT:g})"}),
+        ('--retries', {'type': int, 'help': f"scan: extra attempts for ports that time out (default: {SCAN_DEFAULT_RETRIES})"}),
+        ('--parallelism', {'type': int, 'help': f"scan: connects in flight per target (default: {SCAN_DEFAULT_PARALLELISM})"}),
+    ),
+    'compare': (
+        ('--type', {'help': 'record type (default: A)'}),
+        ('--servers', {'help': 'comma-separated resolvers (default: DNS_SERVERS)'}),
+        ('--timeout', {'type': float, 'help': 'seconds to wait for each resolver'}),
+    ),
+}
+
+CLI_PARAM_NAMES = {kwargs.get('dest', flag.lstrip('-').replace('-', '_'))
+                   for options in CLI_TOOL_OPTIONS.values() for flag, kwargs in options}
+
+# CSV columns per tool: dotted paths into the "data" of a format=json response. The last column
+# also carries the error of a rejected target.
+CLI_CSV_COLUMNS = {
+    'nslookup': ('target', 'dns_server', 'name', 'addresses', 'cname_chain', 'status', 'error'),
+    'ping': ('target', 'stats.address', 'stats.method', 'stats.sent', 'stats.received', 'stats.loss_pct',
+             'stats.rtt_min_ms', 'stats.rtt_avg_ms', 'stats.rtt_max_ms', 'stats.error'),
+    'dig': ('target', 'record_type', 'dns_server', 'response.status', 'response.answer', 'response.query_time_ms', 'error'),
+    'traceroute': ('target', 'address', 'engine', 'reached', 'hops', 'elapsed_ms', 'error'),
+    'netconnection': ('target', 'port', 'protocol', 'state', 'error_code', 'error'),
+    # netconnection --scan: one row per scanned host and port, from the "scan" of the response
+    'scan': ('target', 'host', 'address', 'port', 'state', 'latency_ms', 'attempts', 'error'),
+    'compare': ('target', 'record_type', 'consistent', 'all_responded', 'ttl_min', 'ttl_max', 'elapsed_ms', 'error'),
+}
+
+def iter_cli_targets(targets, stdin):
     """
-    target = STATUS_CHECK_HOST
-    last_checked = session.get('dns_last_checked', 0)
-    status_message = session.get('dns_status_message', "Checking status...")
-    is_online = session.get('dns_is_online', False)
+    Yields the targets given on the command line, reading comma/whitespace-separated targets from
+    stdin (lazily, line by line) in place of '-' or when none were given.
+    """
+    for target in targets or ['-']:
+        if target != '-':
+            yield target
+            continue
+        for line in stdin:
+            yield from (token for token in re.split(r'[,\s]+', line) if token)
+
+def iter_cli_batch_jobs(stdin):
+    """Yields the jobs of an NDJSON stream of {"tool", "target", "options"} objects, one per line."""
+    for number, line in enumerate(stdin, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError:
+            job = None
+        if not is_valid_batch_job(job):
+            job = {'error': f"Line {number}: expected an object with 'tool', 'target' and optional 'options'"}
+        yield job
+
+def _run_cli_job(job):
+    """Runs one CLI job through its API tool handler (no response cache). Returns (payload, status)."""
+    if 'error' in job:
+        return {"error": job['error']}, 400
+    params = dict(job.get('options') or {})
+    params['target'] = job.get('target', '')
+    try:
+        handler = API_TOOLS.get(job.get('tool'))
+        if handler is None:
+            return {"error": f"Unknown tool '{job.get('tool')}'"}, 400
+        return run_async(handler(params))
+    except Exception as e:
+        logging.exception(f"{job.get('tool')} failed for {params['target']}")
+        return {"error": str(e)}, 500
 
-    current_time = datetime.datetime.now().timestamp()
-    if current_time - last_checked > STATUS_CHECK_INTERVAL or last_checked == 0:
+def iter_cli_results(jobs, concurrency):
+    """
+    Runs CLI jobs with at most `concurrency` in flight and yields one result per job, in input
+    order, shaped like the results of /api/batch. Jobs are consumed lazily, so results start
+    streaming before stdin has been read to the end.
+    """
+    concurrency = max(1, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='cli') as executor:
+        results = iterate_ordered_bounded(executor, lambda job: (job, *_run_cli_job(job)), jobs, concurrency * 2)
+        for index, (job, payload, status) in enumerate(results):
+            yield {"index": index, "tool": job.get('tool'), "target": job.get('target'), "status": status, **payload}
 
-        logging.info(f"Performing fresh status check for {target}")
+def _cli_csv_value(data, path):
+    """Reads a dotted path from a result's data as a CSV cell (lists space-separated, booleans as Yes/No)."""
+    value = data
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    if isinstance(value, list):
+        # DNS records by their data, traceroute hops by their address
+        return ' '.join(str(item.get('data') or item.get('address') or '*') if isinstance(item, dict) else str(item)
+                        for item in value)
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    return '' if value is None else value
 
-        ping_output = run_ping(target, count=1)
+def _cli_csv_rows(result, columns):
+    """CSV rows of one CLI result: one per target, or one per host and port of a port scan."""
+    if result['status'] != 200:
+        return [[result['target']] + [''] * (len(columns) - 2) + [result.get('error')]]
+    if 'scan' in result:
+        scan = result['scan']
+        items = scan['results'] + [host for host in scan['hosts'] if host['error']]
+        return [[_cli_csv_value({'target': result['target'], **item}, column) for column in columns] for item in items]
+    return [[_cli_csv_value(result['data'], column) for column in columns]]
 
-        if "time=" in ping_output.lower() or "ttl=" in ping_output.lower() or "bytes=" in ping_output.lower():
-            is_online = True
-            status_message = f"✅ {target} is ONLINE"
+def write_cli_results(results, output_format, columns, out, err):
+    """
+    Writes CLI results to `out` as text, NDJSON or CSV (with the CLI_CSV_COLUMNS entry named by
+    `columns`); rejected jobs are reported on `err` in text mode. Returns the exit status.
+    """
+    status = 0
+    writer = csv.writer(out, lineterminator='\n') if output_format == 'csv' else None
+    if writer:
+        writer.writerow(CLI_CSV_COLUMNS[columns])
+    for count, result in enumerate(results):
+        if result['status'] != 200:
+            status = 1
+        if output_format == 'ndjson':
+            out.write(json.dumps(result) + '\n')
+        elif writer:
+            writer.writerows(_cli_csv_rows(result, CLI_CSV_COLUMNS[columns]))
+        elif result['status'] != 200:
+            label = ' '.join(str(part) for part in (result['tool'], result['target']) if part)
+            err.write(f"{label}: {result.get('error')}\n" if label else f"{result.get('error')}\n")
         else:
-            is_online = False
-            status_message = f"❌ {target} is OFFLINE or unreachable"
+            out.write(('\n' if count else '') + result['result'] + '\n')
+    return status
 
-        session['dns_last_checked'] = current_time
-        session['dns_status_message'] = status_message
-        session['dns_is_online'] = is_online
-        last_checked = current_time
+def _cli_tool(args):
+    params = {name: getattr(args, name) for name in vars(args)
+              if name in CLI_PARAM_NAMES and getattr(args, name) not in (None, False)}
+    params['format'] = 'text' if args.format == 'text' else 'json'
+    if params.get('ports'):
+        params['mode'] = 'scan'
+    if not args.targets and sys.stdin.isatty():
+        args.parser.error('no targets given (pass them as arguments or on stdin)')
+    jobs = ({'tool': args.command, 'target': target, 'options': params}
+            for target in iter_cli_targets(args.targets, sys.stdin))
+    columns = 'scan' if params.get('mode') == 'scan' else args.command
+    return write_cli_results(iter_cli_results(jobs, args.concurrency), args.format, columns, sys.stdout, sys.stderr)
 
-    return jsonify({
-        "online": is_online,
-        "message": status_message,
-        "last_checked": last_checked
-    })
+def _cli_batch(args):
+    jobs = iter_cli_batch_jobs(sys.stdin)
+    if args.format == 'text':
+        jobs = ({**job, 'options': {**(job.get('options') or {}), 'format': 'text'}} for job in jobs)
+    return write_cli_results(iter_cli_results(jobs, args.concurrency), args.format, None, sys.stdout, sys.stderr)
+
+def _cli_bulk(args):
+    if args.files:
+        targets = itertools.chain.from_iterable(
+            (iter_bulk_targets(sys.stdin.buffer) if path == '-' else iter_bulk_targets_from_file(path)) for path in args.files)
+    else:
+        targets = iter_bulk_targets(sys.stdin.buffer)
+    memo = BulkWorkMemo()
+    rows = iter_bulk_nslookup(targets, args.dns_server or DNS_SERVERS[0], args.ping, args.reverse,
+                              concurrency=args.concurrency, memo=memo)
+    if args.format == 'csv':
+        sys.stdout.write(BULK_CSV_HEADER + '\n')
+    for row in rows:
+        sys.stdout.write((format_bulk_row_csv(row) if args.format == 'csv' else json.dumps(row)) + '\n')
+    if args.stats:
+        sys.stderr.write(json.dumps(memo.stats()) + '\n')
+    return 0
+
+def _cli_sweep(args):
+    params = {'networks': ','.join(args.networks), 'liveness': args.liveness, 'ports': args.ports, 'timeout': args.timeout,
+              'concurrency': args.concurrency, 'dns_server': args.dns_server, 'format': args.format}
+    stream, error = parse_sweep_request(params)
+    if error:
+        args.parser.error(error[0]['error'])
+    _, lines = stream
+    for line in iterate_async(lines):
+        sys.stdout.write(line)
+    return 0
+
+def build_cli_parser():
+    """Builds the argument parser of the command-line interface."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='app.py',
+        description='Network Diagnostics Tool. Without a command, starts the web server; with one, runs the '
+                    'diagnostics directly (no HTTP) and writes the results to stdout.')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--verbose', action='store_true', help="keep the application's INFO logging on stderr")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    commands.add_parser('serve', help='start the web server (the default)')
+
+    for tool, options in CLI_TOOL_OPTIONS.items():
+        command = commands.add_parser(tool, parents=[common], help=f"run {tool} for each target")
+        command.add_argument('targets', nargs='*', metavar='target',
+                             help="hostname or IP address; '-' or none reads targets from stdin")
+        for flag, kwargs in options:
+            command.add_argument(flag, **kwargs)
+        command.add_argument('--format', choices=('text', 'ndjson', 'csv'), default='text', help='output format (default: text)')
+        command.add_argument('--concurrency', type=int, default=BATCH_MAX_CONCURRENCY,
+                             help=f"targets run in parallel (default: {BATCH_MAX_CONCURRENCY})")
+        command.set_defaults(handler=_cli_tool, parser=command)
+
+    command = commands.add_parser('batch', parents=[common],
+                                  help='run NDJSON jobs from stdin ({"tool": ..., "target": ..., "options": {...}} per line)')
+    command.add_argument('--format', choices=('ndjson', 'text'), default='ndjson', help='output format (default: ndjson)')
+    command.add_argument('--concurrency', type=int, default=BATCH_MAX_CONCURRENCY,
+                         help=f"jobs run in parallel (default: {BATCH_MAX_CONCURRENCY})")
+    command.set_defaults(handler=_cli_batch, parser=command)
+
+    command = commands.add_parser('bulk', parents=[common], help='bulk NSLookup of a target list, as the bulk upload does')
+    command.add_argument('files', nargs='*', metavar='file', help="target list; '-' or none reads stdin")
+    command.add_argument('--dns-server', dest='dns_server', help='DNS server (default: the first of DNS_SERVERS)')
+    command.add_argument('--ping', action='store_true', help='ping the first address of each target')
+    command.add_argument('--reverse', action='store_true', help='look up the PTR record of the first address')
+    command.add_argument('--format', choices=('csv', 'ndjson'), default='csv', help='output format (default: csv)')
+    command.add_argument('--concurrency', type=int, default=BULK_CONCURRENCY,
+                         help=f"targets resolved in parallel (default: {BULK_CONCURRENCY})")
+    command.add_argument('--stats', action='store_true', help='print the lookups saved by de-duplication to stderr')
+    command.set_defaults(handler=_cli_bulk, parser=command)
+
+    command = commands.add_parser('sweep', parents=[common], help='PTR sweep of one or more networks')
+    command.add_argument('networks', nargs='+', metavar='network', help='CIDR network or address range')
+    command.add_argument('--liveness', choices=('none', 'icmp', 'tcp'), default='none', help='liveness probe (default: none)')
+    command.add_argument('--ports', help='ports tried by the tcp probe')
+    command.add_argument('--timeout', type=float, help=f"seconds to wait for each probe (default: {SWEEP_TIMEOUT:g})")
+    command.add_argument('--dns-server', dest='dns_server', help='DNS server (default: the first of DNS_SERVERS)')
+    command.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson', help='output format (default: ndjson)')
+    command.add_argument('--concurrency', type=int, default=SWEEP_CONCURRENCY,
+                         help=f"addresses in flight (default: {SWEEP_CONCURRENCY})")
+    command.set_defaults(handler=_cli_sweep, parser=command)
+    return parser
+
+def run_cli(argv):
+    """
+    Runs a command-line invocation. Returns the exit status: 0, or 1 if any target or job was
+    rejected. Returns None for 'serve', which leaves starting the web server to the caller.
+    """
+    args = build_cli_parser().parse_args(argv)
+    if args.command in (None, 'serve'):
+        return None
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    try:
+        status = args.handler(args)
+        sys.stdout.flush()
+        return status
+    except BrokenPipeError:
+        # The reader went away (e.g. `| head`); point stdout at devnull so the exit flush does not fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except KeyboardInterrupt:
+        return 130
 
 if __name__ == '__main__':
     """
@@ -828,18 +5358,37 @@ if __name__ == '__main__':
     the production-ready Waitress web server.
     """
     PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
-    
-    print(f"=== Network Diagnostics Tool Configuration ===")
+
+    if WEB_WORKER_FD is not None:
+        serve_worker(int(WEB_WORKER_FD), os.getppid())
+        sys.exit(0)
+
+    # Any command other than 'serve' runs the diagnostics directly and exits
+    cli_status = run_cli(sys.argv[1:])
+    if cli_status is not None:
+        sys.exit(cli_status)
+
+    print("=== Network Diagnostics Tool Configuration ===")
     print(f"Environment: {FLASK_ENV}")
     print(f"Port: {APP_PORT}")
     print(f"Canonical Host: {CANONICAL_HOST}")
     print(f"Status Check Host: {STATUS_CHECK_HOST}")
     print(f"DNS Servers: {len(DNS_SERVERS)} configured")
-    print(f"===============================================")
+    print("===============================================")
     print(f"Starting Flask application on http://0.0.0.0:{APP_PORT}...")
     
     if FLASK_ENV == 'development':
         app.run(host="0.0.0.0", port=APP_PORT, debug=True)
+    elif SERVER_MODE == 'asgi':
+        import uvicorn
+        uvicorn.run(asgi_app, host="0.0.0.0", port=APP_PORT)
+    elif WEB_WORKERS > 1 and os.name == 'posix':
+        print(f"Workers: {WEB_WORKERS} x {WEB_THREADS} threads")
+        WorkerSupervisor("0.0.0.0", APP_PORT, WEB_WORKERS).run()
     else:
         from waitress import serve
-        serve(app, host="0.0.0.0", port=APP_PORT, threads=25)
+        if WEB_WORKERS > 1:
+            logging.warning("WEB_WORKERS needs a POSIX system; serving from a single process")
+        PATH_MONITORS.start()
+        BULK_JOBS.start()
+        serve(app, host="0.0.0.0", port=APP_PORT, threads=WEB_THREADS)
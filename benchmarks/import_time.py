@@ -0,0 +1,136 @@
+"""
+Measures the cold-start cost of importing app.py, which is what every short-lived container,
+health check and CLI invocation pays before doing any work.
+
+Each run imports the app in a fresh interpreter. The report (JSON) gives wall-clock import time
+net of bare interpreter startup, the slowest modules according to `python -X importtime`, and
+which deferred dependencies and side effects (threads, log handlers) an import triggered.
+app.py is byte-compiled first, as it is once deployed; source_compile_ms is what every start
+additionally pays when no up-to-date .pyc exists (e.g. PYTHONDONTWRITEBYTECODE=1 in a container
+built without `python -m compileall`):
+
+    python benchmarks/import_time.py --runs 20
+    python benchmarks/import_time.py --output before.json
+    python benchmarks/import_time.py --max-ms 150    # exits with status 1 above the budget
+"""
+import argparse
+import json
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(APP_DIR, 'app.py')
+
+# Loaded on first use; importing the app should not pull these in
+DEFERRED_MODULES = ('dns.resolver', 'dns.asyncquery', 'dns.message', 'waitress', 'uvicorn',
+                    'multiprocessing.managers')
+
+PROBE = """
+import json, sys, threading
+import app
+print(json.dumps({
+    'deferred_modules_loaded': [name for name in %r if name in sys.modules],
+    'threads': threading.active_count(),
+    'api_log_handlers': len(app.api_logger.handlers),
+    'bulk_jobs_started': getattr(app.BULK_JOBS, '_started', None),
+    'modules': len(sys.modules)
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def timed_run(code):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'min_ms': round(samples[0] * 1000, 1),
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'max_ms': round(samples[-1] * 1000, 1)
+    }
+
+
+def slowest_modules(top):
+    """Parses `-X importtime` output into the `top` modules by cumulative and by self time."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=APP_DIR,
+                            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    # Nested imports are printed (indented) before the module that imported them
+    pending, app_imports = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        module = (name.strip(), int(self_us), int(cumulative_us))
+        modules.append(module)
+        if depth == 1:
+            pending.append(module)
+        elif depth == 0:
+            if module[0] == 'app':
+                app_imports = pending
+            pending = []
+    return {
+        'app_imports_by_cumulative_ms': {name: round(cumulative / 1000, 1)
+                                         for name, _, cumulative in sorted(app_imports, key=lambda m: -m[2])[:top]},
+        'by_self_ms': {name: round(own / 1000, 1) for name, own, _ in sorted(modules, key=lambda m: -m[1])[:top]}
+    }
+
+
+def source_compile_ms():
+    with open(APP_FILE, encoding='utf-8') as f:
+        source = f.read()
+    started = time.perf_counter()
+    compile(source, APP_FILE, 'exec')
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def run(args):
+    py_compile.compile(APP_FILE, doraise=True)
+    # Untimed runs populate the OS file cache and the dependencies' .pyc files
+    for _ in range(args.warmup):
+        timed_run('import app')
+    baseline = [timed_run('pass') for _ in range(args.runs)]
+    imports = [timed_run('import app') for _ in range(args.runs)]
+    probe = subprocess.run([sys.executable, '-c', PROBE], cwd=APP_DIR, check=True,
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    report = {
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'interpreter_startup': summarize(baseline),
+        'import_app': summarize(imports),
+        'net_import_median_ms': round((statistics.median(imports) - statistics.median(baseline)) * 1000, 1),
+        'source_compile_ms': source_compile_ms(),
+        'after_import': json.loads(probe.stdout.strip().splitlines()[-1]),
+        'slowest_modules': slowest_modules(args.top)
+    }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='fresh interpreters started per measurement')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed imports before measuring')
+    parser.add_argument('--top', type=int, default=10, help='modules listed in slowest_modules')
+    parser.add_argument('--max-ms', type=float, help='fail (exit status 1) if the net median import time exceeds this')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.max_ms is not None and report['net_import_median_ms'] > args.max_ms:
+        print(f"Import takes {report['net_import_median_ms']} ms, over the {args.max_ms} ms budget", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,93 @@
+"""
+Measures per-lookup overhead of building a resolver for every query (the old behaviour)
+versus reusing the shared instances from the resolver registry.
+
+Runs fully offline against a small DNS responder on 127.0.0.1 and prints the results as JSON:
+
+    python benchmarks/resolver_registry.py --queries 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import dns.asyncresolver
+import dns.message
+import dns.rrset
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def start_responder():
+    """Starts a UDP DNS responder answering every A query with 192.0.2.1. Returns its port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+
+    def serve():
+        while True:
+            data, addr = sock.recvfrom(4096)
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            response.answer.append(dns.rrset.from_text(query.question[0].name, 60, 'IN', 'A', '192.0.2.1'))
+            sock.sendto(response.to_wire(), addr)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+async def per_call_lookup(server, port, qname):
+    """The previous pattern: a fresh Resolver (reading resolv.conf) and nameserver resolution per query."""
+    resolver = dns.asyncresolver.Resolver()
+    if app.is_ip_address(server):
+        resolver.nameservers = [server]
+    else:
+        infos = await asyncio.get_running_loop().getaddrinfo(server, None, family=socket.AF_INET)
+        resolver.nameservers = [infos[0][4][0]]
+    resolver.port = port
+    return await resolver.resolve(qname, 'A', lifetime=5)
+
+
+async def registry_lookup(server, port, qname):
+    resolver = await app.RESOLVERS.get(f"{server}#{port}")
+    return await resolver.resolve(qname, 'A', lifetime=5)
+
+
+async def measure(lookup, server, port, queries):
+    started = time.perf_counter()
+    for i in range(queries):
+        await lookup(server, port, f"host{i}.bench.test")
+    elapsed = time.perf_counter() - started
+    return {
+        'queries': queries,
+        'elapsed_s': round(elapsed, 4),
+        'per_query_us': round(elapsed / queries * 1e6, 1),
+        'qps': round(queries / elapsed, 1)
+    }
+
+
+async def main(queries):
+    port = start_responder()
+    results = {}
+    for label, server in (('ip_nameserver', '127.0.0.1'), ('hostname_nameserver', 'localhost')):
+        await measure(registry_lookup, server, port, 50)
+        results[label] = {
+            'per_call_resolver': await measure(per_call_lookup, server, port, queries),
+            'resolver_registry': await measure(registry_lookup, server, port, queries)
+        }
+        before = results[label]['per_call_resolver']['per_query_us']
+        after = results[label]['resolver_registry']['per_query_us']
+        results[label]['overhead_saved_us'] = round(before - after, 1)
+    results['registry'] = app.RESOLVERS.stats()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=2000, help='sequential lookups per configuration')
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args.queries)), indent=2))
@@ -0,0 +1,164 @@
+"""
+Local stand-ins for the network services the diagnostics talk to, so benchmarks run offline:
+
+* StubDNSServer answers A, AAAA and PTR queries over UDP on 127.0.0.1 with a configurable
+  response latency, TTL, share of NXDOMAIN answers and CNAME chain length.
+* TCPListeners accepts (and immediately closes) connections on a few local ports.
+
+Both run on their own background threads and are independent of the application's event loop.
+"""
+import asyncio
+import ipaddress
+import socket
+import threading
+import zlib
+
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+ZONE = 'bench.test.'
+
+
+class _DNSProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            wire = self.server.respond(data)
+        except Exception:
+            return
+        if self.server.latency > 0:
+            asyncio.get_running_loop().call_later(self.server.latency, self.transport.sendto, wire, addr)
+        else:
+            self.transport.sendto(wire, addr)
+
+
+class StubDNSServer:
+    """
+    Authoritative-style responder for every name. Names are answered deterministically (the same
+    name always gets the same addresses, and the same NXDOMAIN decision), so DNS caching behaves
+    as it would against a real server.
+
+    latency       seconds before each response is sent
+    ttl           TTL of every answer record (and the SOA minimum for negative answers)
+    nxdomain_rate share of names answered with NXDOMAIN (0.0 - 1.0)
+    cname_depth   number of CNAME records in front of each A/AAAA answer
+    """
+
+    def __init__(self, latency=0.0, ttl=300, nxdomain_rate=0.0, cname_depth=0):
+        self.latency = latency
+        self.ttl = ttl
+        self.nxdomain_rate = nxdomain_rate
+        self.cname_depth = cname_depth
+        self.queries = 0
+        self.port = None
+        self._loop = None
+        self._transport = None
+
+    def start(self):
+        """Starts the server on 127.0.0.1 and an ephemeral port. Returns the port."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+            self._transport, _ = self._loop.run_until_complete(
+                self._loop.create_datagram_endpoint(lambda: _DNSProtocol(self), sock=sock))
+            ready.set()
+            self._loop.run_forever()
+            self._transport.close()
+            # Lets the transport release its socket before the loop is closed
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+        threading.Thread(target=run, name='stub-dns', daemon=True).start()
+        ready.wait()
+        return self.port
+
+    def stop(self):
+        """Stops the server and releases its socket."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    @property
+    def address(self):
+        """The server in the application's 'ip#port' DNS server notation."""
+        return f"127.0.0.1#{self.port}"
+
+    def is_nxdomain(self, name):
+        return (zlib.crc32(name.lower().encode()) % 10000) < self.nxdomain_rate * 10000
+
+    def respond(self, data):
+        self.queries += 1
+        query = dns.message.from_wire(data)
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name = question.name.to_text()
+
+        if question.rdtype == dns.rdatatype.PTR:
+            response.answer.append(dns.rrset.from_text(question.name, self.ttl, 'IN', 'PTR', self._ptr_target(name)))
+        elif self.is_nxdomain(name):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(self._soa())
+        elif question.rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+            digest = zlib.crc32(name.encode())
+            owner = question.name
+            for depth in range(self.cname_depth):
+                alias = dns.name.from_text(f"c{depth}-{digest:08x}.{ZONE}")
+                response.answer.append(dns.rrset.from_text(owner, self.ttl, 'IN', 'CNAME', alias.to_text()))
+                owner = alias
+            if question.rdtype == dns.rdatatype.A:
+                # 198.18.0.0/15 is reserved for benchmarking (RFC 2544)
+                value = f"198.{18 + ((digest >> 16) & 1)}.{(digest >> 8) & 0xFF}.{digest & 0xFF}"
+            else:
+                value = str(ipaddress.IPv6Address((0x2001_0db8 << 96) | digest))
+            response.answer.append(dns.rrset.from_text(owner, self.ttl, 'IN', dns.rdatatype.to_text(question.rdtype), value))
+        else:
+            response.authority.append(self._soa())
+        return response.to_wire()
+
+    def _ptr_target(self, name):
+        labels = name.rstrip('.').split('.')
+        separator = '' if name.endswith('.ip6.arpa.') else '-'
+        return f"host-{separator.join(reversed(labels[:-2]))}.{ZONE}"
+
+    def _soa(self):
+        return dns.rrset.from_text(ZONE, self.ttl, 'IN', 'SOA', f"ns.{ZONE} admin.{ZONE} 1 3600 600 86400 {self.ttl}")
+
+
+class TCPListeners:
+    """Accepts connections on `count` ephemeral ports of 127.0.0.1 and closes them right away."""
+
+    def __init__(self, count=1):
+        self.count = count
+        self.ports = []
+        self.accepted = 0
+
+    def start(self):
+        """Starts the listeners. Returns their ports."""
+        for _ in range(self.count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(1024)
+            self.ports.append(sock.getsockname()[1])
+            threading.Thread(target=self._serve, args=(sock,), name='stub-tcp', daemon=True).start()
+        return self.ports
+
+    def _serve(self, sock):
+        while True:
+            conn, _ = sock.accept()
+            self.accepted += 1
+            conn.close()
@@ -0,0 +1,222 @@
+"""
+Offline benchmark suite for the diagnostics tools and API.
+
+Starts a stub DNS server and TCP listeners on 127.0.0.1 (see benchmarks/stubs.py), then drives
+run_nslookup, run_reverse_lookup, run_tcp_connect_test, the bulk NSLookup pipeline and the Flask
+/api/* routes at each requested concurrency level. Every scenario reports throughput, p50/p99
+latency and error count; the run reports peak RSS. Results are printed (or written) as JSON so
+runs can be diffed:
+
+    python benchmarks/suite.py --requests 2000 --concurrency 1,8,32 --latency-ms 2
+    python benchmarks/suite.py --scenarios nslookup,api --nxdomain-rate 0.2 --cname-depth 3 --output before.json
+
+Names are unique per request by default, so every lookup reaches the stub server; use --names to
+draw from a smaller pool and measure the DNS cache instead.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# The per-server token bucket would otherwise cap bulk runs at its default rate
+os.environ.setdefault('BULK_RATE_LIMIT_PER_SERVER', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+from stubs import StubDNSServer, TCPListeners  # noqa: E402
+
+SCENARIOS = ('nslookup', 'reverse', 'tcp_connect', 'bulk', 'api')
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KiB, or None where it cannot be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else None
+    }
+
+
+def drive(call, requests, concurrency):
+    """
+    Runs call(i) for i in range(requests) on `concurrency` threads. call returns True on success.
+    Returns the summary of per-call latencies.
+    """
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            ok = call(i)
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latency, _ in outcomes], sum(1 for _, ok in outcomes if not ok), elapsed)
+
+
+class Workload:
+    """Builds the per-scenario calls against the stub services."""
+
+    def __init__(self, dns, tcp_ports, names, run_id, address_base):
+        self.dns = dns
+        self.tcp_ports = tcp_ports
+        self.names = names
+        self.run_id = run_id
+        self.address_base = address_base
+
+    def hostname(self, i):
+        return f"h{i % self.names if self.names else i}-{self.run_id}.bench.test"
+
+    def address(self, i):
+        i = self.address_base + (i % self.names if self.names else i)
+        return f"198.{18 + ((i >> 16) & 1)}.{(i >> 8) & 0xFF}.{i & 0xFF}"
+
+    def nslookup(self, i):
+        return not app.run_nslookup(self.hostname(i), self.dns.address).startswith('Error')
+
+    def reverse(self, i):
+        return app.run_reverse_lookup(self.address(i), self.dns.address) != 'Error'
+
+    def tcp_connect(self, i):
+        return 'is OPEN' in app.run_tcp_connect_test('127.0.0.1', self.tcp_ports[i % len(self.tcp_ports)])
+
+    def api(self, i):
+        # Rotates through the read-only tool routes, the way a dashboard or script would call them
+        kind = i % 3
+        client = app.app.test_client()
+        if kind == 0:
+            response = client.get('/api/nslookup', query_string={
+                'target': self.hostname(i), 'dns_server': self.dns.address, 'format': 'json'})
+        elif kind == 1:
+            response = client.post('/api/dig', json={
+                'target': self.hostname(i), 'dns_server': self.dns.address, 'type': 'AAAA', 'format': 'json'})
+        else:
+            response = client.get('/api/netconnection', query_string={
+                'target': '127.0.0.1', 'port': self.tcp_ports[i % len(self.tcp_ports)], 'format': 'json'})
+        return response.status_code == 200
+
+    def bulk(self, requests, concurrency):
+        """One bulk run over `requests` targets, timing each row from the start of the run."""
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        targets = (self.hostname(i) for i in range(requests))
+        memo = app.BulkWorkMemo()
+        for row in app.iter_bulk_nslookup(targets, self.dns.address, False, True, concurrency=concurrency, memo=memo):
+            latencies.append(time.perf_counter() - started)
+            errors += not row['resolved_ips']
+        summary = summarize(latencies, errors, time.perf_counter() - started)
+        summary['work'] = memo.stats()
+        summary['note'] = 'latency is time-to-row from the start of the run'
+        return summary
+
+
+def run(args):
+    dns = StubDNSServer(latency=args.latency_ms / 1000, ttl=args.ttl,
+                        nxdomain_rate=args.nxdomain_rate, cname_depth=args.cname_depth)
+    dns.start()
+    tcp = TCPListeners(args.tcp_listeners)
+    tcp_ports = tcp.start()
+    concurrency_levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    report = {
+        'started': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'requests': args.requests,
+            'concurrency': concurrency_levels,
+            'latency_ms': args.latency_ms,
+            'ttl': args.ttl,
+            'nxdomain_rate': args.nxdomain_rate,
+            'cname_depth': args.cname_depth,
+            'names': args.names,
+            'tcp_listeners': args.tcp_listeners
+        },
+        'rss_kb_at_start': peak_rss_kb(),
+        'results': {}
+    }
+    address_base = 0
+    for scenario in scenarios:
+        report['results'][scenario] = {}
+        for concurrency in concurrency_levels:
+            # Fresh names and addresses per run keep earlier runs from warming the DNS cache
+            workload = Workload(dns, tcp_ports, args.names, f"{scenario}{concurrency}", address_base)
+            address_base += args.warmup + args.requests
+            queries_before = dns.queries
+            if scenario == 'bulk':
+                summary = workload.bulk(args.requests, concurrency)
+            else:
+                drive(getattr(workload, scenario), min(args.warmup, args.requests), concurrency)
+                workload.run_id += 'm'
+                workload.address_base += args.warmup
+                queries_before = dns.queries
+                summary = drive(getattr(workload, scenario), args.requests, concurrency)
+            summary['dns_queries'] = dns.queries - queries_before
+            summary['peak_rss_kb'] = peak_rss_kb()
+            report['results'][scenario][str(concurrency)] = summary
+    report['dns_cache'] = app.DNS_CACHE.stats()
+    report['peak_rss_kb'] = peak_rss_kb()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000, help='calls per scenario and concurrency level')
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='stub DNS response delay')
+    parser.add_argument('--ttl', type=int, default=300, help='TTL of stub DNS answers')
+    parser.add_argument('--nxdomain-rate', type=float, default=0.0, help='share of names answered with NXDOMAIN (0-1)')
+    parser.add_argument('--cname-depth', type=int, default=0, help='CNAME records in front of each address answer')
+    parser.add_argument('--names', type=int, default=0, help='size of the hostname pool (0 = a unique name per call)')
+    parser.add_argument('--tcp-listeners', type=int, default=4, help='local TCP ports to connect to')
+    parser.add_argument('--warmup', type=int, default=50, help='untimed calls before each measured run')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help="keep the application's logging")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
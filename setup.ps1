@@ -77,6 +77,12 @@ New-Item -ItemType Directory -Force -Path logs | Out-Null
 New-Item -ItemType Directory -Force -Path bulk_results | Out-Null
 Write-Host "✅ Directories created" -ForegroundColor Green
 
+# Precompile the application so each start loads cached bytecode instead of compiling app.py
+Write-Host ""
+Write-Host "Precompiling application..." -ForegroundColor Yellow
+python -m compileall -q app.py
+Write-Host "✅ Application precompiled" -ForegroundColor Green
+
 Write-Host ""
 Write-Host "==========================================" -ForegroundColor Cyan
 Write-Host "✅ Setup Complete!" -ForegroundColor Green
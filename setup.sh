@@ -74,6 +74,12 @@ echo "Creating necessary directories..."
 mkdir -p logs bulk_results
 echo "✅ Directories created"
 
+# Precompile the application so each start loads cached bytecode instead of compiling app.py
+echo ""
+echo "Precompiling application..."
+python -m compileall -q app.py
+echo "✅ Application precompiled"
+
 echo ""
 echo "=========================================="
 echo "✅ Setup Complete!"
@@ -0,0 +1,65 @@
+"""
+Shared fixtures. The suite runs offline: DNS queries go to the stub server from
+benchmarks/stubs.py and TCP tests connect to its local listeners.
+"""
+import logging
+import os
+import sys
+import time
+
+import pytest
+
+# The per-server token bucket would otherwise slow bulk runs down to its default rate
+os.environ.setdefault('BULK_RATE_LIMIT_PER_SERVER', '0')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import app  # noqa: E402
+from stubs import StubDNSServer, TCPListeners  # noqa: E402
+
+# Usage log entries written by test requests must not end up in logs/api_usage.log
+app.API_USAGE.logger = logging.getLogger('tests.api_usage')
+app.API_USAGE.logger.propagate = False
+
+
+@pytest.fixture
+def stub_dns():
+    """A fresh stub DNS server per test, so query counts and answer settings are isolated."""
+    server = StubDNSServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def tcp_port():
+    """A local port that accepts connections."""
+    return TCPListeners(1).start()[0]
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    """Process-wide caches must not carry answers from one test into the next."""
+    app.DNS_CACHE.clear()
+    app.API_CACHE.clear()
+    yield
+    app.DNS_CACHE.clear()
+    app.API_CACHE.clear()
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def wait_for(condition, timeout=10.0, interval=0.02):
+    """Polls condition() until it returns a true value, which is returned; fails after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(interval)
+    pytest.fail(f"Condition not met within {timeout}s")
@@ -0,0 +1,336 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import app
+from conftest import wait_for
+
+
+def call_asgi(method, path, query=b'', body=b''):
+    """Sends one HTTP request through app.asgi_app and returns (status, JSON payload)."""
+    # The ASGI app adopts the running loop unless the diagnostics loop already exists
+    app.get_async_loop()
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': []}
+    asyncio.run(app.asgi_app(scope, receive, send))
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+
+class TestAsyncCore:
+
+    def test_concurrent_lookups_share_the_event_loop(self, stub_dns):
+        stub_dns.latency = 0.3
+
+        async def lookups():
+            return await asyncio.gather(*(app.run_nslookup_async(f"host{i}.bench.test", stub_dns.address)
+                                          for i in range(20)))
+
+        started = time.perf_counter()
+        results = app.run_async(lookups())
+        assert time.perf_counter() - started < 10 * stub_dns.latency
+        assert all('Address: ' in result for result in results)
+
+    def test_run_async_refuses_to_block_the_diagnostics_loop(self):
+        async def nested():
+            app.run_async(asyncio.sleep(0))
+
+        with pytest.raises(RuntimeError):
+            app.run_async(nested())
+
+
+class TestASGIApp:
+
+    def test_api_routes_run_on_the_diagnostics_loop(self, stub_dns):
+        status, payload = call_asgi('GET', '/api/nslookup', f'target=asgi.bench.test&dns_server={stub_dns.address}'.encode())
+        assert status == 200 and payload['success']
+        assert 'Name: asgi.bench.test' in payload['result']
+
+        status, payload = call_asgi('POST', '/api/nslookup', body=b'{"target": "bad!!"}')
+        assert (status, payload) == (400, {"error": "Invalid target format"})
+
+    def test_json_format_returns_the_result_model(self, stub_dns):
+        status, payload = call_asgi('GET', '/api/nslookup', f'target=json.bench.test&dns_server={stub_dns.address}&format=json'.encode())
+        assert status == 200 and 'result' not in payload
+        assert payload['data']['name'] == 'json.bench.test' and payload['data']['addresses']
+
+        status, payload = call_asgi('GET', '/api/nslookup', b'target=json.bench.test&format=xml')
+        assert status == 400
+
+    def test_only_get_and_post_are_allowed(self):
+        assert call_asgi('DELETE', '/api/ping')[0] == 405
+
+
+class TestColdImport:
+
+    def test_importing_the_app_defers_dns_threads_and_log_files(self):
+        probe = ("import json, sys, threading, app; print(json.dumps(["
+                 "[name for name in ('dns.resolver', 'multiprocessing.managers') if name in sys.modules], "
+                 "threading.active_count(), len(app.api_logger.handlers), app.BULK_JOBS._started]))")
+        output = subprocess.run([sys.executable, '-c', probe], cwd=os.path.dirname(app.__file__),
+                                capture_output=True, text=True, check=True).stdout
+        assert json.loads(output.splitlines()[-1]) == [[], 1, 0, False]
+
+
+def compute_counter(payload=None, status=200, delay=0.05):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return dict(payload or {'value': len(calls)}), status
+
+    return compute, calls
+
+
+def get(cache, params, compute, tool='nslookup', bypass=False):
+    return app.run_async(cache.get_or_compute(tool, params, compute, bypass=bypass))
+
+
+class TestApiResponseCache:
+
+    def make_cache(self, **ttls):
+        return app.ApiResponseCache(enabled=True, default_ttl=30, tool_ttls=ttls, max_entries=10)
+
+    def test_concurrent_identical_requests_share_one_computation(self):
+        cache = self.make_cache()
+        compute, calls = compute_counter()
+
+        async def burst():
+            return await asyncio.gather(*(cache.get_or_compute('nslookup', {'target': 'a.example'}, compute)
+                                          for _ in range(5)))
+
+        results = app.run_async(burst())
+        assert len(calls) == 1
+        assert all(result == ({'value': 1}, 200, {'Cache-Control': 'max-age=30', 'Age': '0'}) for result in results)
+        assert cache.stats()['coalesced'] == 4
+
+    def test_fresh_entries_are_reused_and_bypass_recomputes(self):
+        cache = self.make_cache()
+        compute, calls = compute_counter(delay=0)
+        get(cache, {'target': 'a.example', 'count': 4}, compute)
+        # Parameter names/values are normalized, so these share the entry
+        assert get(cache, {'TARGET': 'A.example', 'count': '4', 'cache': ''}, compute)[0] == {'value': 1}
+        assert get(cache, {'target': 'a.example', 'count': 4}, compute, bypass=True)[0] == {'value': 2}
+        assert get(cache, {'target': 'a.example', 'count': 4}, compute)[0] == {'value': 2}
+        assert len(calls) == 2
+
+    def test_errors_and_uncached_tools_are_not_stored(self):
+        cache = self.make_cache(ping=0)
+        failing, failures = compute_counter({'error': 'bad'}, status=400, delay=0)
+        assert get(cache, {'target': 'x'}, failing) == ({'error': 'bad'}, 400, {})
+        get(cache, {'target': 'x'}, failing)
+        assert len(failures) == 2
+
+        ping, pings = compute_counter(delay=0)
+        assert get(cache, {'target': 'x'}, ping, tool='ping')[2] == {}
+        get(cache, {'target': 'x'}, ping, tool='ping')
+        assert len(pings) == 2
+
+    def test_flask_responses_carry_cache_headers(self, client, stub_dns, monkeypatch):
+        monkeypatch.setattr(app, 'API_CACHE', self.make_cache())
+        query = {'target': 'headers.bench.test', 'dns_server': stub_dns.address, 'format': 'json'}
+
+        first = client.get('/api/nslookup', query_string=query)
+        second = client.get('/api/nslookup', query_string=query)
+        assert first.status_code == second.status_code == 200
+        assert first.headers['Cache-Control'] == second.headers['Cache-Control'] == 'max-age=30'
+        assert second.headers['Age'] == '0'
+        assert second.get_json() == first.get_json()
+        assert app.API_CACHE.stats()['hits'] == 1
+
+        client.get('/api/nslookup', query_string=query, headers={'Cache-Control': 'no-cache'})
+        assert app.API_CACHE.stats()['bypassed'] == 1
+
+
+BATCH_JOBS = [
+    {'tool': 'nslookup', 'target': 'batch.bench.test', 'options': {}},
+    {'tool': 'nslookup', 'target': 'not a host!'},
+    {'tool': 'whois', 'target': 'batch.bench.test'},
+    {'tool': 'netconnection', 'target': '127.0.0.1', 'options': {'format': 'json'}},
+]
+
+
+def batch_body(stub_dns, tcp_port, **extra):
+    jobs = json.loads(json.dumps(BATCH_JOBS))
+    jobs[0]['options']['dns_server'] = stub_dns.address
+    jobs[3]['options']['port'] = tcp_port
+    return {'jobs': jobs, **extra}
+
+
+class TestBatch:
+
+    def check_results(self, results):
+        assert [(result['index'], result['tool'], result['status']) for result in results] == [
+            (0, 'nslookup', 200), (1, 'nslookup', 400), (2, 'whois', 400), (3, 'netconnection', 200)]
+        assert 'Address: ' in results[0]['result']
+        assert results[1]['error'] == 'Invalid target format'
+        assert results[3]['data']['state'] == 'open'
+
+    def test_buffered_results_are_returned_in_job_order(self, client, stub_dns, tcp_port):
+        response = client.post('/api/batch', json=batch_body(stub_dns, tcp_port, concurrency=4))
+        assert response.status_code == 200
+        self.check_results(response.get_json()['results'])
+
+    def test_streamed_results_are_ndjson_lines(self, client, stub_dns, tcp_port):
+        response = client.post('/api/batch', json=batch_body(stub_dns, tcp_port, stream=True))
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.check_results(sorted(lines, key=lambda result: result['index']))
+
+    @pytest.mark.parametrize('body', [{}, {'jobs': []}, {'jobs': ['nslookup']}, {'jobs': [{'tool': 'ping'}], 'concurrency': 'x'},
+                                      {'jobs': [{'tool': ['x'], 'target': 'a'}]}, {'jobs': [{'tool': {'a': 1}, 'target': 'a'}]},
+                                      {'jobs': [{'tool': 'ping', 'target': ['a']}]}, {'jobs': [{'target': 'a'}]}])
+    def test_invalid_batches_are_rejected(self, client, body):
+        assert client.post('/api/batch', json=body).status_code == 400
+        assert client.post('/api/batch', json={**body, 'stream': True}).status_code == 400
+
+
+class TestParsePortSpec:
+
+    def test_lists_and_ranges_are_merged_and_sorted(self):
+        assert app.parse_port_spec('443, 22,8000-8002 22') == [22, 443, 8000, 8001, 8002]
+        assert app.parse_port_spec(80) == [80]
+
+    @pytest.mark.parametrize('spec', ['', 'http', '0', '65536', '10-5', '1-2-3', '22,-80'])
+    def test_malformed_specs_are_rejected(self, spec):
+        with pytest.raises(ValueError):
+            app.parse_port_spec(spec)
+
+
+class TestPortScan:
+
+    def test_open_and_closed_ports(self, client, tcp_port):
+        response = client.get(f'/api/netconnection?mode=scan&hosts=127.0.0.1&ports=1,{tcp_port}&retries=0')
+        assert response.status_code == 200
+        states = {result['port']: result['state'] for result in response.get_json()['scan']['results']}
+        assert states == {1: 'closed', tcp_port: 'open'}
+
+    @pytest.mark.parametrize('port', ['-1', '0', '70000', 'http'])
+    def test_out_of_range_single_ports_are_rejected(self, client, port):
+        response = client.get(f'/api/netconnection?target=127.0.0.1&port={port}')
+        assert response.status_code == 400
+        assert 'error' in response.get_json()
+
+    @pytest.mark.parametrize('query', ['timeout=nan', 'timeout=0', 'timeout=-1', 'timeout=11', 'timeout=x',
+                                       'retries=-1', 'retries=6', 'retries=1.5'])
+    def test_out_of_range_timeout_and_retries_are_rejected(self, client, tcp_port, query):
+        response = client.get(f'/api/netconnection?mode=scan&hosts=127.0.0.1&ports={tcp_port}&{query}')
+        assert response.status_code == 400
+
+    def test_direct_callers_are_clamped(self, tcp_port):
+        scan = app.run_async(app.scan_tcp_ports_async(['127.0.0.1'], [tcp_port], timeout=float('nan'), retries=100))
+        assert (scan['timeout'], scan['retries']) == (app.SCAN_DEFAULT_TIMEOUT, app.SCAN_MAX_RETRIES)
+        assert scan['results'][0]['state'] == 'open'
+
+
+class TestPathMonitors:
+
+    @pytest.mark.parametrize('interval', ['nan', 'inf', '-inf', 1, 86401])
+    def test_out_of_range_intervals_are_rejected(self, client, interval):
+        response = client.post('/api/path-monitors', json={'target': '127.0.0.1', 'interval': interval})
+        assert response.status_code == 400
+        assert 'interval must be between' in response.get_json()['error']
+        assert app.PATH_MONITORS.list() == []
+
+
+class TestSweep:
+
+    def test_addresses_are_streamed_with_their_ptr_records(self, client, stub_dns):
+        response = client.get('/api/sweep', query_string={'networks': '127.0.0.0/30,127.0.0.1', 'dns_server': stub_dns.address})
+        assert response.mimetype == 'application/x-ndjson'
+        results = {row['address']: row for row in map(json.loads, response.get_data(as_text=True).splitlines())}
+        assert sorted(results) == ['127.0.0.1', '127.0.0.2']
+        assert results['127.0.0.1']['ptr'] == 'host-127-0-0-1.bench.test'
+        assert results['127.0.0.1']['alive'] is None
+
+    def test_networks_are_merged_and_capped(self, monkeypatch):
+        assert [str(n) for n in app.parse_sweep_networks('10.0.0.0/25, 10.0.0.128/25 10.0.0.7')] == ['10.0.0.0/24']
+        monkeypatch.setattr(app, 'SWEEP_MAX_ADDRESSES', 256)
+        with pytest.raises(ValueError):
+            app.parse_sweep_networks('10.0.0.0/23')
+
+    def test_too_many_liveness_ports_are_rejected(self, client):
+        response = client.get('/api/sweep?networks=127.0.0.0/30&liveness=tcp&ports=1-65535')
+        assert response.status_code == 400
+        assert 'Too many liveness ports' in response.get_json()['error']
+
+    def test_socket_errors_are_reported_as_filtered(self, monkeypatch):
+        def no_descriptors(*args):
+            raise OSError(24, 'Too many open files')
+
+        monkeypatch.setattr(app.socket, 'socket', no_descriptors)
+        probe = app._probe_tcp_port(app.socket.AF_INET, ('127.0.0.1', 9), 0.1, 1)
+        assert app.run_async(probe) == ('filtered', None, 2)
+
+
+class RecordingLogger:
+
+    def __init__(self):
+        self.batches = []
+
+    def info(self, message):
+        self.batches.append([json.loads(line) for line in message.split('\n')])
+
+
+class TestApiUsageLog:
+
+    def make_log(self, **options):
+        logger = RecordingLogger()
+        settings = dict(max_queue=100, batch_size=10, flush_interval=0.05, overflow='drop')
+        settings.update(options)
+        return app.ApiUsageLog(lambda: logger, **settings), logger
+
+    def test_entries_are_written_in_batches(self):
+        log, logger = self.make_log(batch_size=3, flush_interval=5)
+        for status in (200, 201, 404):
+            log.record('127.0.0.1', '/api/dig', 'GET', 'pytest', status, 1.234)
+        wait_for(lambda: log.stats()['batches'] == 1)
+        assert [entry['status'] for entry in logger.batches[0]] == [200, 201, 404]
+        assert logger.batches[0][0]['latency_ms'] == 1.23
+        assert logger.batches[0][0]['timestamp'].endswith('Z')
+
+    def test_flush_writes_the_partial_batch(self):
+        log, logger = self.make_log(flush_interval=5)
+        log.record('127.0.0.1', '/api/ping', 'GET', None, 200, None)
+        log.flush()
+        assert log.stats() == {'queued': 0, 'dropped': 0, 'written': 1, 'batches': 1}
+        [[entry]] = logger.batches
+        assert (entry['path'], entry['user_agent'], entry['latency_ms']) == ('/api/ping', None, None)
+
+    def test_overflowing_entries_are_dropped_and_reported(self):
+        log, logger = self.make_log(max_queue=2, batch_size=1)
+        writing = threading.Event()
+        write = logger.info
+        logger.info = lambda message: writing.wait(5) and write(message)
+        log.record('127.0.0.1', '/api/dig', 'GET', None, 200, 1.0)
+        # The writer took the first entry and is held in the logger; two more fill the queue
+        wait_for(lambda: log.stats()['queued'] == 0)
+        for _ in range(4):
+            log.record('127.0.0.1', '/api/dig', 'GET', None, 200, 1.0)
+        assert log.stats()['dropped'] == 2
+        writing.set()
+        log.flush()
+        wait_for(lambda: log.stats()['written'] == 3)
+        entries = [entry for batch in logger.batches for entry in batch]
+        assert len([entry for entry in entries if 'path' in entry]) == 3
+        assert [entry['count'] for entry in entries if entry.get('event') == 'dropped'] == [2]
+
+    def test_only_api_like_requests_are_logged(self):
+        assert not app.looks_like_api_request('GET', 'text/html', None)
+        assert app.looks_like_api_request('GET', 'application/json; charset=utf-8', None)
+        assert app.looks_like_api_request('GET', None, 'Bearer token')
+        assert app.looks_like_api_request('POST', None, None)
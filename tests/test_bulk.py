@@ -0,0 +1,178 @@
+import io
+import json
+import os
+from collections import OrderedDict
+
+import app
+from conftest import wait_for
+
+
+def bulk_rows(targets, dns_server, concurrency=8, reverse=False, memo=None):
+    return list(app.iter_bulk_nslookup(iter(targets), dns_server, False, reverse, concurrency=concurrency, memo=memo))
+
+
+class TestServerRateLimiters:
+
+    def test_spellings_of_a_server_share_one_bucket(self, monkeypatch):
+        monkeypatch.setattr(app, '_server_rate_limiters', OrderedDict())
+        limiter = app.get_server_rate_limiter('127.0.0.1')
+        assert app.get_server_rate_limiter('localhost') is limiter
+        assert app.get_server_rate_limiter('127.0.0.1#53') is limiter
+        assert app.get_server_rate_limiter('127.0.0.1#5353') is not limiter
+
+    def test_least_recently_used_servers_are_dropped(self, monkeypatch):
+        monkeypatch.setattr(app, '_server_rate_limiters', OrderedDict())
+        monkeypatch.setattr(app, 'RESOLVER_REGISTRY_MAX_ENTRIES', 2)
+        first = app.get_server_rate_limiter('192.0.2.1')
+        app.get_server_rate_limiter('192.0.2.2')
+        assert app.get_server_rate_limiter('192.0.2.1') is first
+        app.get_server_rate_limiter('192.0.2.3')
+        assert len(app._server_rate_limiters) == 2
+        assert app.get_server_rate_limiter('192.0.2.1') is first
+
+    def test_each_token_is_one_query(self):
+        limiter = app.RateLimiter(rate=1000, burst=3)
+        limiter.acquire(2)
+        assert limiter._take() == 0
+        assert limiter._take() > 0
+
+
+class TestBulkNSLookup:
+
+    def test_rows_follow_input_order(self, stub_dns):
+        stub_dns.nxdomain_rate = 0.3
+        targets = [f"order{i}.bench.test" for i in range(60)]
+        rows = bulk_rows(targets, stub_dns.address, concurrency=16)
+        assert [row['target'] for row in rows] == targets
+        resolved = [row for row in rows if row['resolved_ips']]
+        assert resolved and len(resolved) < len(rows)
+
+    def test_duplicate_names_are_resolved_once(self, stub_dns):
+        targets = ['a.bench.test', 'A.bench.test', 'b.bench.test', 'a.bench.test.', ' b.bench.test', 'c.bench.test']
+        memo = app.BulkWorkMemo()
+        rows = bulk_rows(targets, stub_dns.address, reverse=True, memo=memo)
+
+        assert [row['target'] for row in rows] == targets
+        assert rows[1]['resolved_ips'] == rows[0]['resolved_ips']
+        assert rows[4]['reverse_lookup_ptr'] == rows[2]['reverse_lookup_ptr'] != 'N/A'
+        stats = memo.stats()
+        assert stats['rows'] == 6
+        assert stats['lookups_performed'] == 3 and stats['lookups_reused'] == 3
+        assert stats['ptrs_performed'] == 3 and stats['ptrs_reused'] == 3
+        # A and AAAA per unique name, one PTR per unique address
+        assert stub_dns.queries == 3 * 2 + 3
+
+    def test_csv_row_format(self):
+        row = {'target': 'a', 'resolved_name': 'a', 'resolved_ips': ['192.0.2.1', '192.0.2.2'],
+               'ping_result': 'N/A', 'reverse_lookup_ptr': 'N/A'}
+        assert app.format_bulk_row_csv(row) == '"a","a","192.0.2.1; 192.0.2.2","N/A","N/A"'
+
+    def test_invalid_targets_are_dropped_from_uploads(self):
+        stream = io.BytesIO(b"good.example, bad_target!!\nalso-good.example\n")
+        assert list(app.iter_bulk_targets(stream, chunk_size=5)) == ['good.example', 'also-good.example']
+
+    def test_api_streams_csv_and_ndjson(self, client, stub_dns):
+        body = b'api0.bench.test\napi1.bench.test, api2.bench.test'
+        response = client.post('/api/bulk-nslookup', query_string={'dns_server': stub_dns.address}, data=body,
+                               content_type='text/csv')
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[0] == app.BULK_CSV_HEADER
+        assert [line.split(',')[0] for line in lines[1:]] == ['"api0.bench.test"', '"api1.bench.test"', '"api2.bench.test"']
+
+        response = client.post('/api/bulk-nslookup', query_string={'dns_server': stub_dns.address, 'format': 'ndjson'},
+                               data=body, content_type='text/csv')
+        assert response.mimetype == 'application/x-ndjson'
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [row['target'] for row in rows] == ['api0.bench.test', 'api1.bench.test', 'api2.bench.test']
+
+
+def upload(*targets):
+    return io.BytesIO(('\n'.join(targets) + '\n').encode())
+
+
+def finished(manager, job_id):
+    status = manager.status(job_id)
+    return status if status['status'] in manager.FINISHED else None
+
+
+class TestBulkJobManager:
+
+    def test_submitted_job_completes_in_order(self, tmp_path, stub_dns):
+        manager = app.BulkJobManager(str(tmp_path), 1)
+        targets = [f"job{i}.bench.test" for i in range(25)]
+        job = manager.submit(upload(*targets), stub_dns.address, False, False, filename='hosts.csv')
+        assert job['total'] == 25 and job['filename'] == 'hosts.csv'
+
+        status = wait_for(lambda: finished(manager, job['id']))
+        assert status['status'] == 'completed'
+        assert status['done'] == status['total'] == 25
+        assert status['work']['lookups_performed'] == 25
+        rows = manager.read_results(job['id'], limit=100)
+        assert [row['target'] for row in rows] == targets
+        assert [row['target'] for row in manager.read_results(job['id'], offset=20, limit=2)] == targets[20:22]
+
+    def test_cancel_queued_and_running_jobs(self, tmp_path, stub_dns):
+        stub_dns.latency = 0.05
+        manager = app.BulkJobManager(str(tmp_path), 1)
+        running = manager.submit(upload(*(f"slow{i}.bench.test" for i in range(400))), stub_dns.address, False, False)
+        queued = manager.submit(upload('queued.bench.test'), stub_dns.address, False, False)
+        wait_for(lambda: manager.status(running['id'])['done'] > 0)
+
+        assert manager.cancel(queued['id'])['status'] == 'cancelled'
+        manager.cancel(running['id'])
+        status = wait_for(lambda: finished(manager, running['id']))
+        assert status['status'] == 'cancelled'
+        assert 0 < status['done'] < status['total']
+        assert len(manager.read_results(running['id'], limit=1000)) == status['done']
+        assert manager.status(queued['id'])['done'] == 0
+
+    def test_unfinished_job_resumes_after_its_last_complete_row(self, tmp_path, stub_dns):
+        stopped = app.BulkJobManager(str(tmp_path), 1)
+        stopped.enqueue = lambda job_id: None  # the process "stops" before running the job
+        targets = [f"resume{i}.bench.test" for i in range(6)]
+        job = stopped.submit(upload(*targets), stub_dns.address, False, False)
+
+        # Two rows were written before the crash, plus a partially written third one
+        job_dir = os.path.join(str(tmp_path), job['id'])
+        with open(os.path.join(job_dir, 'results.csv'), 'w') as f:
+            f.write(app.BULK_CSV_HEADER + '\n')
+            f.write('"resume0.bench.test","kept","N/A","N/A","N/A"\n')
+            f.write('"resume1.bench.test","kept","N/A","N/A","N/A"\n')
+            f.write('"resume2.bench')
+        with open(os.path.join(job_dir, 'job.json')) as f:
+            state = json.load(f)
+        state.update(status='running', done=3)
+        with open(os.path.join(job_dir, 'job.json'), 'w') as f:
+            json.dump(state, f)
+
+        restarted = app.BulkJobManager(str(tmp_path), 1)
+        restarted.start()
+        status = wait_for(lambda: finished(restarted, job['id']))
+        assert status['status'] == 'completed' and status['done'] == 6
+        assert status['work']['lookups_performed'] == 4
+        rows = restarted.read_results(job['id'], limit=100)
+        assert [row['target'] for row in rows] == targets
+        assert [row['resolved_name'] for row in rows[:2]] == ['kept', 'kept']
+        assert rows[2]['resolved_name'] == 'resume2.bench.test'
+
+    def test_finished_jobs_expire_on_the_next_submit(self, tmp_path, stub_dns):
+        manager = app.BulkJobManager(str(tmp_path), 1, retention_hours=1)
+        old = manager.submit(upload('old.bench.test'), stub_dns.address, False, False)
+        wait_for(lambda: finished(manager, old['id']))
+        state_path = os.path.join(str(tmp_path), old['id'], 'job.json')
+        with open(state_path) as f:
+            state = json.load(f)
+        state['finished_at'] -= 2 * 3600
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+
+        new = manager.submit(upload('new.bench.test'), stub_dns.address, False, False)
+        assert manager.status(old['id']) is None
+        assert not os.path.exists(os.path.join(str(tmp_path), old['id']))
+        assert wait_for(lambda: finished(manager, new['id']))['status'] == 'completed'
+
+    def test_completed_rows_counts_in_chunks_and_drops_partial_line(self, tmp_path):
+        path = tmp_path / 'results.csv'
+        path.write_bytes(b'header\n' + b'x' * 100 + b'\n' + b'y' * 100 + b'\npartial')
+        assert app.BulkJobManager._completed_rows(str(path), chunk_size=16) == 2
+        assert path.read_bytes().endswith(b'y' * 100 + b'\n')
@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import logging
+import subprocess
+import sys
+
+import pytest
+
+import app
+from conftest import ROOT
+
+
+@pytest.fixture(autouse=True)
+def restore_log_level():
+    # run_cli quiets the root logger for the rest of the process
+    level = logging.getLogger().level
+    yield
+    logging.getLogger().setLevel(level)
+
+
+def set_stdin(monkeypatch, text):
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(text.encode())))
+
+
+class TestExitCodes:
+
+    def test_accepted_targets_exit_zero(self, stub_dns, capsys):
+        assert app.run_cli(['nslookup', 'cli.bench.test', '--dns-server', stub_dns.address]) == 0
+        assert 'Name: cli.bench.test' in capsys.readouterr().out
+
+    def test_diagnostic_failures_are_results_not_errors(self, stub_dns, capsys):
+        stub_dns.nxdomain_rate = 1.0
+        assert app.run_cli(['nslookup', 'gone.bench.test', '--dns-server', stub_dns.address]) == 0
+        assert app.run_cli(['netconnection', '127.0.0.1', '--port', '1']) == 0
+
+    def test_rejected_target_exits_one(self, stub_dns, capsys):
+        status = app.run_cli(['nslookup', 'ok.bench.test', 'bad!!', '--dns-server', stub_dns.address])
+        assert status == 1
+        captured = capsys.readouterr()
+        assert 'Name: ok.bench.test' in captured.out
+        assert 'nslookup bad!!: Invalid target format' in captured.err
+
+    def test_invalid_batch_line_exits_one(self, monkeypatch, capsys):
+        set_stdin(monkeypatch, 'not json\n')
+        assert app.run_cli(['batch']) == 1
+        assert json.loads(capsys.readouterr().out)['status'] == 400
+
+    def test_job_with_unhashable_tool_does_not_abort_the_batch(self, stub_dns, monkeypatch, capsys):
+        set_stdin(monkeypatch, '{"tool": ["x"], "target": "a"}\n'
+                               f'{{"tool": "nslookup", "target": "ok.bench.test", "options": {{"dns_server": "{stub_dns.address}"}}}}\n')
+        assert app.run_cli(['batch']) == 1
+        rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [row['status'] for row in rows] == [400, 200]
+
+    @pytest.mark.parametrize('argv', [['nslookup', '--format', 'xml', 'a.example'], ['ping', '--count', 'many'],
+                                      ['sweep', '10.0.0.0/8'], ['frobnicate']])
+    def test_invalid_arguments_exit_two(self, argv, capsys):
+        with pytest.raises(SystemExit) as exited:
+            app.run_cli(argv)
+        assert exited.value.code == 2
+
+    @pytest.mark.parametrize('argv', [[], ['serve']])
+    def test_no_command_leaves_serving_to_the_caller(self, argv):
+        assert app.run_cli(argv) is None
+
+    def test_script_exit_status(self):
+        result = subprocess.run([sys.executable, 'app.py', 'nslookup', 'bad!!'], cwd=ROOT,
+                                capture_output=True, text=True, timeout=60)
+        assert result.returncode == 1
+        assert 'Invalid target format' in result.stderr
+        assert 'Starting Flask application' not in result.stdout
+
+
+class TestOutput:
+
+    def test_stdin_targets_as_csv_in_input_order(self, stub_dns, monkeypatch, capsys):
+        set_stdin(monkeypatch, 'c.bench.test, a.bench.test\nb.bench.test\n')
+        assert app.run_cli(['nslookup', '--dns-server', stub_dns.address, '--format', 'csv', '--concurrency', '3']) == 0
+        rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+        assert [row['target'] for row in rows] == ['c.bench.test', 'a.bench.test', 'b.bench.test']
+        assert all(row['addresses'] and not row['error'] for row in rows)
+
+    def test_ndjson_rows_are_batch_results(self, stub_dns, capsys):
+        assert app.run_cli(['dig', 'x.bench.test', '--dns-server', stub_dns.address, '--type', 'AAAA',
+                            '--format', 'ndjson']) == 0
+        result = json.loads(capsys.readouterr().out)
+        assert (result['index'], result['tool'], result['status']) == (0, 'dig', 200)
+        assert result['data']['response']['answer'][0]['type'] == 'AAAA'
+
+    def test_port_scan_rows(self, tcp_port, capsys):
+        assert app.run_cli(['netconnection', '127.0.0.1', '--ports', f"{tcp_port},1", '--retries', '0',
+                            '--format', 'csv']) == 0
+        rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+        assert {row['port']: row['state'] for row in rows} == {'1': 'closed', str(tcp_port): 'open'}
+
+    def test_bulk_from_stdin(self, stub_dns, monkeypatch, capsys):
+        set_stdin(monkeypatch, 'one.bench.test\nbad!!\ntwo.bench.test\none.bench.test\n')
+        assert app.run_cli(['bulk', '--dns-server', stub_dns.address, '--stats']) == 0
+        captured = capsys.readouterr()
+        lines = captured.out.splitlines()
+        assert lines[0] == app.BULK_CSV_HEADER
+        assert [line.split(',')[0] for line in lines[1:]] == ['"one.bench.test"', '"two.bench.test"', '"one.bench.test"']
+        assert json.loads(captured.err)['lookups_reused'] == 1
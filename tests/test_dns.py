@@ -0,0 +1,172 @@
+import ipaddress
+import os
+import time
+import zlib
+
+import dns.exception
+import dns.resolver
+import pytest
+
+import app
+
+
+def resolve(resolver, name, rdtype='A'):
+    return app.run_async(app.resolve_cached(resolver, name, rdtype))
+
+
+class TestDNSAnswerCache:
+
+    def test_answer_expires_after_its_ttl(self):
+        cache = app.DNSAnswerCache(max_entries=10, max_ttl=3600)
+        cache.put('key', 'answer', 0.05)
+        assert cache.get('key') == 'answer'
+        time.sleep(0.1)
+        assert cache.get('key') is None
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_ttl_is_capped_by_max_ttl(self):
+        cache = app.DNSAnswerCache(max_entries=10, max_ttl=0.05)
+        cache.put('key', 'answer', 3600)
+        time.sleep(0.1)
+        assert cache.get('key') is None
+
+    def test_zero_ttl_and_disabled_cache_store_nothing(self):
+        cache = app.DNSAnswerCache(max_entries=10, max_ttl=3600)
+        cache.put('key', 'answer', 0)
+        assert cache.get('key') is None
+        disabled = app.DNSAnswerCache(max_entries=0, max_ttl=3600)
+        disabled.put('key', 'answer', 60)
+        assert disabled.get('key') is None
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = app.DNSAnswerCache(max_entries=2, max_ttl=3600)
+        cache.put('a', 1, 60)
+        cache.put('b', 2, 60)
+        assert cache.get('a') == 1
+        cache.put('c', 3, 60)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.stats()['evictions'] == 1
+
+    def test_positive_answers_are_served_from_the_cache(self, stub_dns):
+        resolver = app.run_async(app.RESOLVERS.get(stub_dns.address))
+        first = resolve(resolver, 'cached.bench.test')
+        second = resolve(resolver, 'CACHED.bench.test.')
+        assert [str(r) for r in first] == [str(r) for r in second]
+        assert stub_dns.queries == 1
+
+    def test_nxdomain_is_cached_for_the_soa_minimum(self, stub_dns):
+        stub_dns.nxdomain_rate = 1.0
+        resolver = app.run_async(app.RESOLVERS.get(stub_dns.address))
+        for _ in range(2):
+            with pytest.raises(dns.resolver.NXDOMAIN):
+                resolve(resolver, 'missing.bench.test')
+        assert stub_dns.queries == 1
+
+    def test_negative_answer_without_ttl_is_not_cached(self, stub_dns):
+        stub_dns.nxdomain_rate = 1.0
+        stub_dns.ttl = 0
+        resolver = app.run_async(app.RESOLVERS.get(stub_dns.address))
+        for _ in range(2):
+            with pytest.raises(dns.resolver.NXDOMAIN):
+                resolve(resolver, 'uncached.bench.test')
+        assert stub_dns.queries == 2
+
+    def test_noanswer_is_cached(self, stub_dns):
+        resolver = app.run_async(app.RESOLVERS.get(stub_dns.address))
+        for _ in range(2):
+            with pytest.raises(dns.resolver.NoAnswer):
+                resolve(resolver, 'nomx.bench.test', 'MX')
+        assert stub_dns.queries == 1
+
+
+
+class TestNSLookup:
+
+    def test_cname_chain_and_both_families_in_one_round(self, stub_dns):
+        stub_dns.cname_depth = 3
+        stub_dns.latency = 0.3
+        started = time.perf_counter()
+        result = app.run_async(app.nslookup_result_async('www.bench.test', stub_dns.address))
+        elapsed = time.perf_counter() - started
+
+        aliases = [f"c{depth}-{zlib.crc32(b'www.bench.test.'):08x}.bench.test" for depth in range(3)]
+        assert result.cname_chain == ['www.bench.test'] + aliases
+        assert result.name == aliases[-1]
+        assert [ipaddress.ip_address(a).version for a in result.addresses] == [4, 6]
+        # One A and one AAAA query, sent together: the chain comes from the answers
+        assert stub_dns.queries == 2
+        assert elapsed < 2 * stub_dns.latency
+
+    def test_answer_and_nxdomain_are_not_failures(self, stub_dns):
+        result = app.run_async(app.nslookup_result_async('found.bench.test', stub_dns.address))
+        assert result.addresses and result.failure is None
+        assert result.to_dict()['name'] == 'found.bench.test'
+
+        stub_dns.nxdomain_rate = 1.0
+        result = app.run_async(app.nslookup_result_async('missing.bench.test', stub_dns.address))
+        assert not result.addresses and result.failure is None
+        assert result.status == "Hostname does not exist or could not be resolved."
+
+    def test_unanswered_lookup_is_a_timeout(self, monkeypatch):
+        async def no_answer(*args, **kwargs):
+            raise dns.exception.Timeout()
+
+        monkeypatch.setattr(app, 'resolve_cached', no_answer)
+        result = app.run_async(app.nslookup_result_async('silent.bench.test', '127.0.0.1'))
+        assert not result.addresses and result.failure == 'timeout'
+
+
+class TestResolverRegistry:
+
+    def test_one_shared_resolver_per_server_and_port(self):
+        registry = app.ResolverRegistry()
+        first = app.run_async(registry.get('127.0.0.1#5353'))
+        assert app.run_async(registry.get('127.0.0.1#5353')) is first
+        assert first.nameservers == ['127.0.0.1'] and first.port == 5353
+        assert app.run_async(registry.get('127.0.0.1')) is not first
+        assert registry.stats()['resolvers'] == 2
+
+    def test_least_recently_used_resolver_is_evicted(self):
+        registry = app.ResolverRegistry(max_entries=2)
+        first = app.run_async(registry.get('127.0.0.1'))
+        app.run_async(registry.get('127.0.0.2'))
+        assert app.run_async(registry.get('127.0.0.1')) is first
+        app.run_async(registry.get('127.0.0.3'))
+        assert registry.stats()['resolvers'] == 2 and registry.stats()['evictions'] == 1
+        assert app.run_async(registry.get('127.0.0.1')) is first
+
+    def test_busy_nameserver_hostnames_stay_cached(self, monkeypatch):
+        registry = app.ResolverRegistry(address_ttl=3600, max_entries=2)
+        lookups = []
+
+        async def getaddrinfo(host, port, **kwargs):
+            lookups.append(host)
+            return [(None, None, None, None, ('127.0.0.1', port))]
+
+        monkeypatch.setattr(app.get_async_loop(), 'getaddrinfo', getaddrinfo)
+        for name in ('busy.example', 'other.example', 'busy.example', 'third.example', 'busy.example'):
+            app.run_async(registry.nameserver_address(name))
+        assert lookups == ['busy.example', 'other.example', 'third.example']
+
+    def test_invalid_port_is_rejected(self):
+        with pytest.raises(ValueError):
+            app.ResolverRegistry.split_server('127.0.0.1#99999')
+
+    def test_system_resolver_reloads_when_resolv_conf_changes(self, tmp_path):
+        resolv_conf = tmp_path / 'resolv.conf'
+        resolv_conf.write_text('nameserver 192.0.2.1\n')
+        registry = app.ResolverRegistry(resolv_conf=str(resolv_conf))
+        first = registry.system_resolver()
+        assert registry.system_resolver() is first
+        assert [str(ns) for ns in first.nameservers] == ['192.0.2.1']
+
+        resolv_conf.write_text('nameserver 192.0.2.2\n')
+        stat = os.stat(resolv_conf)
+        os.utime(resolv_conf, (stat.st_atime, stat.st_mtime + 10))
+        reloaded = registry.system_resolver()
+        assert reloaded is not first
+        assert [str(ns) for ns in reloaded.nameservers] == ['192.0.2.2']
+        assert registry.stats()['system_resolver_reloads'] == 1
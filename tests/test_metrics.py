@@ -0,0 +1,185 @@
+import os
+import threading
+
+import dns.exception
+
+import app
+from conftest import wait_for
+
+
+class TestShardedMetrics:
+
+    def run_threads(self, target, count=4):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_shards_of_ended_threads_are_folded_into_the_totals(self):
+        counter = app.Counter('calls_total', 'Calls.', ('tool',))
+        self.run_threads(lambda: [counter.inc(('dig',)) for _ in range(100)])
+        counter.inc(('ping',), 3)
+        assert counter.collect() == [('', ('dig',), 400), ('', ('ping',), 3)]
+        # Only this thread's shard is still live
+        assert len(counter._shards) == 1
+
+    def test_an_ending_thread_retires_its_own_shard_not_an_equal_one(self):
+        counter = app.Counter('calls_total', 'Calls.')
+        first_counted, second_done, finish = threading.Event(), threading.Event(), threading.Event()
+
+        def long_lived():
+            counter.inc()
+            first_counted.set()
+            second_done.wait()
+            counter.inc()
+            finish.wait()
+
+        thread = threading.Thread(target=long_lived)
+        thread.start()
+        first_counted.wait()
+        # Ends with a shard equal to the long-lived thread's, {(): 1}
+        self.run_threads(counter.inc, count=1)
+        second_done.set()
+        try:
+            wait_for(lambda: counter.collect() == [('', (), 3)])
+        finally:
+            finish.set()
+            thread.join()
+        assert counter.collect() == [('', (), 3)]
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = app.Histogram('duration_seconds', 'Duration.', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+        samples = {(suffix, labels): value for suffix, labels, value in histogram.collect()}
+        assert samples[('_bucket', ('0.1',))] == 1
+        assert samples[('_bucket', ('1',))] == 3
+        assert samples[('_bucket', ('+Inf',))] == samples[('_count', ())] == 4
+        assert samples[('_sum', ())] == 6.05
+
+    def test_render_uses_the_prometheus_text_format(self):
+        registry = app.MetricsRegistry()
+        registry.counter('calls_total', 'Calls.', ('tool',)).inc(('say "hi"',))
+        registry.add_collector(lambda: [('entries', 'gauge', 'Entries.', [({}, 2.5)])])
+        assert registry.render() == ('# HELP calls_total Calls.\n# TYPE calls_total counter\n'
+                                     'calls_total{tool="say \\"hi\\""} 1\n'
+                                     '# HELP entries Entries.\n# TYPE entries gauge\nentries 2.5\n')
+
+
+class TestDNSServerLabel:
+
+    def test_configured_addresses_and_hostnames_keep_their_address(self, monkeypatch):
+        registry = app.ResolverRegistry(address_ttl=3600)
+
+        async def getaddrinfo(host, port, **kwargs):
+            return [(None, None, None, None, ('192.0.2.53', port))]
+
+        monkeypatch.setattr(app, 'RESOLVERS', registry)
+        monkeypatch.setattr(app, 'DNS_SERVERS', ['192.0.2.1', 'dns.example#5353'])
+        monkeypatch.setattr(app, '_metric_dns_servers', None)
+        monkeypatch.setattr(app.get_async_loop(), 'getaddrinfo', getaddrinfo)
+
+        assert app._dns_server_label('192.0.2.1') == '192.0.2.1'
+        assert app._dns_server_label('192.0.2.53') == 'other'
+        app.run_async(registry.nameserver_address('dns.example#5353'))
+        assert app._dns_server_label('192.0.2.53') == '192.0.2.53'
+        assert app._dns_server_label('198.51.100.7') == 'other'
+
+    def test_system_nameservers_follow_resolv_conf_reloads(self, tmp_path, monkeypatch):
+        resolv_conf = tmp_path / 'resolv.conf'
+        resolv_conf.write_text('nameserver 192.0.2.10\n')
+        registry = app.ResolverRegistry(resolv_conf=str(resolv_conf))
+        monkeypatch.setattr(app, 'RESOLVERS', registry)
+        monkeypatch.setattr(app, 'DNS_SERVERS', [])
+        monkeypatch.setattr(app, '_metric_dns_servers', None)
+        assert app._dns_server_label('192.0.2.10') == '192.0.2.10'
+
+        resolv_conf.write_text('nameserver 192.0.2.20\n')
+        stat = resolv_conf.stat()
+        app.os.utime(resolv_conf, (stat.st_atime, stat.st_mtime + 10))
+        registry.system_resolver()
+        assert app._dns_server_label('192.0.2.20') == '192.0.2.20'
+        assert app._dns_server_label('192.0.2.10') == 'other'
+
+
+def tool_calls(tool):
+    return {labels[1]: value for _, labels, value in app.TOOL_CALLS.collect() if labels[0] == tool}
+
+
+class TestInstrumentTool:
+
+    def test_unanswered_nslookup_counts_as_a_timeout(self, monkeypatch):
+        async def no_answer(*args, **kwargs):
+            raise dns.exception.Timeout()
+
+        monkeypatch.setattr(app, 'resolve_cached', no_answer)
+        before = tool_calls('nslookup').get('timeout', 0)
+        app.run_async(app.nslookup_result_async('silent.bench.test', '192.0.2.1'))
+        assert tool_calls('nslookup')['timeout'] == before + 1
+
+    def test_generators_are_timed_as_a_whole_and_closing_early_cancels(self):
+        @app.instrument_tool('test_stream')
+        def rows(count):
+            yield from range(count)
+
+        assert list(rows(3)) == [0, 1, 2]
+        stream = rows(3)
+        next(stream)
+        stream.close()
+        assert tool_calls('test_stream') == {'ok': 1, 'cancelled': 1}
+
+    def test_metrics_endpoint(self, client):
+        client.get('/api/dns-cache')
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        text = response.get_data(as_text=True)
+        assert '# TYPE netdiag_tool_duration_seconds histogram' in text
+        assert 'netdiag_http_responses_total{route="/api/dns-cache",status="200"}' in text
+
+
+class TestMetricsAggregator:
+
+    def make_registry(self, calls, in_flight):
+        registry = app.MetricsRegistry()
+        registry.counter('calls_total', 'Calls.', ('tool',)).inc(('dig',), calls)
+        registry.gauge('in_flight', 'Running.').inc((), in_flight)
+        registry.histogram('duration_seconds', 'Duration.', buckets=(1,)).observe(0.5)
+        return registry
+
+    def test_workers_are_summed_and_exited_workers_keep_their_counters(self):
+        aggregator = app.MetricsAggregator(self.make_registry(1, 0))
+        aggregator.push(101, self.make_registry(2, 1).families())
+        text = aggregator.render(102, self.make_registry(4, 1).families())
+        assert 'calls_total{tool="dig"} 7' in text
+        assert 'in_flight 2' in text
+        assert 'duration_seconds_bucket{le="1"} 3' in text
+        assert 'duration_seconds_count 3' in text
+
+        aggregator.retire(101)
+        text = aggregator.render()
+        assert 'calls_total{tool="dig"} 7' in text
+        assert 'in_flight 1' in text
+        assert text.count('# TYPE calls_total counter') == 1
+
+
+class TestSupervisorService:
+
+    def test_workers_push_to_the_supervisor_aggregator(self, monkeypatch):
+        aggregator = app.MetricsAggregator(app.MetricsRegistry())
+        monkeypatch.setattr(app, 'METRICS_AGGREGATOR', aggregator)
+        authkey = os.urandom(16)
+        server = app.supervisor_manager(('127.0.0.1', 0), authkey).get_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        monkeypatch.setenv('NETDIAG_SUPERVISOR_ADDRESS', '%s:%d' % server.address)
+        monkeypatch.setenv('NETDIAG_SUPERVISOR_AUTHKEY', authkey.hex())
+        monkeypatch.setattr(app.SupervisorService, '_manager', None)
+
+        remote = app.SupervisorService('metrics')
+        for pid, calls in ((101, 2), (102, 3)):
+            registry = app.MetricsRegistry()
+            registry.counter('calls_total', 'Calls.').inc((), calls)
+            remote.push(pid, registry.families())
+        assert 'calls_total 5' in remote.render()
+        remote.retire(101)
+        assert 'calls_total 5' in aggregator.render()
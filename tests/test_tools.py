@@ -0,0 +1,170 @@
+import json
+import time
+
+import pytest
+
+import app
+from stubs import StubDNSServer
+
+
+class TestPing:
+
+    def test_tcp_engine_counts_accepted_and_refused_connects_as_replies(self, tcp_port, monkeypatch):
+        monkeypatch.setattr(app, 'PING_ENGINE', 'tcp')
+        monkeypatch.setattr(app, 'PING_TCP_PORTS', [tcp_port])
+        stats = app.run_async(app.ping_address_async('127.0.0.1', count=3, interval=0))
+        assert (stats.method, stats.sent, stats.received) == ('tcp', 3, 3)
+
+        monkeypatch.setattr(app, 'PING_TCP_PORTS', [1])
+        assert app.run_async(app.ping_address_async('127.0.0.1', count=1)).received == 1
+
+    def test_echo_requests_are_spaced_by_the_interval(self, tcp_port, monkeypatch):
+        monkeypatch.setattr(app, 'PING_ENGINE', 'tcp')
+        monkeypatch.setattr(app, 'PING_TCP_PORTS', [tcp_port])
+        started = time.perf_counter()
+        app.run_async(app.ping_address_async('127.0.0.1', count=3, interval=0.1))
+        assert time.perf_counter() - started >= 0.2
+
+    def test_icmp_engine_pings_the_loopback(self, monkeypatch):
+        monkeypatch.setattr(app, 'PING_ENGINE', 'icmp')
+        stats = app.run_async(app.ping_address_async('127.0.0.1', count=2, interval=0))
+        if stats.error:
+            pytest.skip(stats.error)
+        assert (stats.method, stats.received) == ('icmp', 2)
+
+    def test_statistics_and_text_output(self):
+        stats = app.PingStats(host='h', address='192.0.2.1', method='tcp', replies=[1.0, None, 3.0])
+        summary = stats.to_dict()
+        assert (summary['sent'], summary['received'], summary['loss_pct']) == (3, 2, 33.3)
+        assert (summary['rtt_min_ms'], summary['rtt_avg_ms'], summary['rtt_max_ms']) == (1.0, 2.0, 3.0)
+        text = app.format_ping_stats(stats)
+        assert 'Request timed out: seq=2' in text
+        assert '3 packets transmitted, 2 received, 33.3% packet loss' in text
+
+
+class TestStatusMonitor:
+
+    def test_snapshot_keeps_a_rolling_history(self, tcp_port, monkeypatch):
+        monkeypatch.setattr(app, 'PING_ENGINE', 'tcp')
+        monkeypatch.setattr(app, 'PING_TCP_PORTS', [tcp_port])
+        monitor = app.StatusMonitor(['127.0.0.1', '127.0.0.1'], interval=60, history_size=2)
+        assert monitor.snapshot()['message'] == "Checking status..."
+
+        for _ in range(3):
+            app.run_async(monitor._probe_all())
+        summary = monitor.snapshot()
+        assert summary['online'] and len(summary['hosts']) == 1
+        assert summary['hosts'][0]['availability_pct'] == 100.0 and summary['hosts'][0]['samples'] == 2
+        assert 'history' not in summary['hosts'][0]
+        assert len(monitor.snapshot(history=True)['hosts'][0]['history']) == 2
+
+
+class TestDig:
+
+    def test_answer_and_header_come_from_the_server(self, stub_dns):
+        stub_dns.cname_depth = 1
+        result = app.run_async(app.dig_result_async('dig.bench.test', 'A', stub_dns.address))
+        response = result.response
+        assert result.error is None and response.status == 'NOERROR'
+        assert [record['type'] for record in response.answer] == ['CNAME', 'A']
+        assert response.port == stub_dns.port and response.protocol == 'UDP'
+        text = app.format_dig_result(result)
+        assert ';; ANSWER SECTION:' in text
+        assert f";; SERVER: 127.0.0.1#{stub_dns.port}" in text
+
+    def test_nxdomain_is_a_response_not_an_error(self, stub_dns):
+        stub_dns.nxdomain_rate = 1.0
+        result = app.run_async(app.dig_result_async('gone.bench.test', 'AAAA', stub_dns.address))
+        assert result.error is None
+        assert result.response.status == 'NXDOMAIN' and result.response.answer == []
+
+    def test_unsupported_record_types_are_rejected(self, client):
+        response = client.get('/api/dig?target=a.example&type=BOGUS')
+        assert response.status_code == 400
+
+
+class TestCompare:
+
+    def test_servers_are_grouped_by_answer(self, stub_dns):
+        missing = StubDNSServer(nxdomain_rate=1.0)
+        missing.start()
+        try:
+            result = app.run_async(app.compare_resolvers_async('cmp.bench.test', 'A', [stub_dns.address, missing.address]))
+        finally:
+            missing.stop()
+        assert not result.consistent and result.all_responded
+        statuses = {answer.server: answer.status for answer in result.results}
+        assert statuses == {stub_dns.address: 'NOERROR', missing.address: 'NXDOMAIN'}
+        assert sorted(group['status'] for group in result.groups) == ['NOERROR', 'NXDOMAIN']
+        assert result.ttl_min == result.ttl_max == stub_dns.ttl
+
+    def test_silent_servers_time_out_without_delaying_the_others(self, stub_dns):
+        started = time.perf_counter()
+        result = app.run_async(app.compare_resolvers_async('cmp.bench.test', 'A', [stub_dns.address, '127.0.0.1#9'],
+                                                           timeout=0.5))
+        assert time.perf_counter() - started < 2
+        assert not result.all_responded
+        assert {answer.server: answer.error is None for answer in result.results} == {
+            stub_dns.address: True, '127.0.0.1#9': False}
+        assert '1 resolver(s) did not respond' in app.format_resolver_comparison(result)
+
+
+class TestTraceroute:
+
+    def trace_loopback(self, client, fmt):
+        response = client.get(f'/api/traceroute/stream?target=127.0.0.1&max_hops=3&timeout=1&format={fmt}')
+        assert response.status_code == 200
+        return response
+
+    def test_hops_are_streamed_between_start_and_done(self, client):
+        response = self.trace_loopback(client, 'ndjson')
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert events[0]['event'] == 'start'
+        if events[0]['engine'] != 'udp':
+            pytest.skip('In-process traceroute probes are not available here')
+        assert [event['event'] for event in events] == ['start', 'hop', 'done']
+        assert events[1]['address'] == '127.0.0.1' and events[1]['reached']
+        assert events[-1]['reached'] and events[-1]['hops'] == [{k: v for k, v in events[1].items() if k != 'event'}]
+
+    def test_server_sent_events(self, client):
+        response = self.trace_loopback(client, 'sse')
+        assert response.mimetype == 'text/event-stream'
+        events = response.get_data(as_text=True).rstrip('\n').split('\n\n')
+        assert events[0].startswith('event: start\ndata: {')
+        if json.loads(events[0].split('data: ', 1)[1])['engine'] != 'udp':
+            pytest.skip('In-process traceroute probes are not available here')
+        assert events[-1].startswith('event: done\ndata: {')
+
+    @pytest.mark.parametrize('query', ['target=bad!!', 'target=127.0.0.1&max_hops=65', 'target=127.0.0.1&probes=0',
+                                       'target=127.0.0.1&timeout=nan', 'target=127.0.0.1&format=xml'])
+    def test_invalid_requests_are_rejected_before_streaming(self, client, query):
+        assert client.get(f'/api/traceroute/stream?{query}').status_code == 400
+
+
+class TestPathSeries:
+
+    def round(self, series, timestamp, first_rtt, reached=True):
+        hops = [app.TracerouteHop(ttl=1, address='192.0.2.1', rtts=[first_rtt]),
+                app.TracerouteHop(ttl=2, address='192.0.2.2', rtts=[5.0], reached=reached)]
+        series.record(timestamp, hops, reached)
+
+    def test_ring_buffer_keeps_the_latest_rounds(self):
+        series = app.PathSeries(max_hops=4, capacity=3)
+        memory = series.memory_bytes
+        for i in range(5):
+            self.round(series, 100.0 + i, float(i + 1))
+        assert series.memory_bytes == memory
+        assert [row[0] for row in series.window()] == [102.0, 103.0, 104.0]
+        assert [row[0] for row in series.window(since=103.0)] == [104.0]
+
+    def test_aggregate_reports_loss_and_latency_per_hop(self):
+        series = app.PathSeries(max_hops=4, capacity=10)
+        self.round(series, 1.0, 2.0)
+        self.round(series, 2.0, None, reached=False)
+        self.round(series, 3.0, 4.0)
+        summary = series.aggregate(percentiles=(50,))
+        assert summary['rounds'] == 3 and summary['destination_loss_pct'] == 33.3
+        first, second = summary['hops']
+        assert (first['sent'], first['received'], first['loss_pct']) == (3, 2, 33.3)
+        assert (first['best_ms'], first['worst_ms'], first['last_ms']) == (2.0, 4.0, 4.0)
+        assert second['loss_pct'] == 0.0 and second['address'] == '192.0.2.2'